@@ -1,12 +1,17 @@
 import os
+import time
+import asyncio
 import requests 
 from typing import List, Optional, Annotated, Dict, Any
 from pydantic import BaseModel, Field
-from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
 from langgraph.graph import END, START, StateGraph
 from langchain_core.messages import HumanMessage
 from datetime import datetime, timezone
+from metrics import metrics
+from models import chat_model, guarded_ainvoke
+from circuit_breaker import CircuitOpenError, llm_breaker
+from tracing import traced_node
 load_dotenv()
 if not os.getenv("GOOGLE_API_KEY"):
     raise ValueError("GOOGLE_API_KEY not found! Please check your ai_engine/.env file.")
@@ -18,16 +23,25 @@ class GraphState(BaseModel):
     routeId: Optional[str] = Field(default=None, description="The active route ID")
     message: List[FrontendMessage] = Field(description="Chat history")
     context: Optional[str] = Field(default=None, description="AI Analysis Result")
-flash_model = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0, 
-    max_retries=2,
-)
+    alertId: str = Field(description="Client-generated id of the alert document, sent with both writes")
+    persisted: Optional[bool] = Field(default=None, description="Whether the placeholder alert was stored")
+    startedAt: Optional[float] = Field(default=None, description="perf_counter() when the throttle was pressed")
+    degraded: Optional[bool] = Field(default=None, description="Analysis skipped because the LLM circuit was open")
+    skipAnalysis: Optional[bool] = Field(default=None, description="Caller is over its rate limit; persist the alert without analysis")
+PERSIST_TIMEOUT = float(os.getenv("THROTTLE_PERSIST_TIMEOUT_SECONDS", "5"))
+PLACEHOLDER_ANALYSIS = "AI analysis pending. Emergency throttle pressed by user."
+
+flash_model = chat_model("flash")
+@traced_node
 async def analyzeEmergency(state: GraphState):
     """
     Analyzes chat history.
     """
     print(f"--- ANALYZING EMERGENCY FOR USER: {state.userId} ---")
+    if llm_breaker.degraded or state.skipAnalysis:
+        # Persist-only: the placeholder written by persistAlert stands
+        metrics.inc("throttle_rate_limited" if state.skipAnalysis else "throttle_degraded")
+        return {"context": PLACEHOLDER_ANALYSIS, "degraded": True}
     
     rawHistory = state.message
     history_str = "\n".join([f"[{m.userId}]: {m.message}" for m in rawHistory]) if rawHistory else "No recent chat history."
@@ -46,53 +60,99 @@ async def analyzeEmergency(state: GraphState):
     2. If normal, state: "No textual anomaly detected, but throttle pressed by user."
     """
     
-    response = await flash_model.ainvoke([HumanMessage(content=prompt)])
-    
+    # A failure here must not cancel persistAlert, which runs in the same step
+    try:
+        response = await guarded_ainvoke(flash_model, [HumanMessage(content=prompt)], site="throttle_analysis")
+    except CircuitOpenError:
+        metrics.inc("throttle_degraded")
+        return {"context": PLACEHOLDER_ANALYSIS, "degraded": True}
+    except Exception as e:
+        print(f" ERROR: Emergency analysis failed: {e}")
+        metrics.inc("throttle_analysis_failures")
+        return {"context": "AI analysis unavailable. Emergency throttle pressed by user."}
+    metrics.observe("throttle_time_to_analysis_seconds", _since_start(state))
 
     return {"context": response.content}
 
-async def saveToDatabase(state: GraphState):
+def _post_throttle(payload: dict) -> dict:
+    backend_url = os.getenv("BACKEND_URL", "http://localhost:3000")
+    endpoint = f"{backend_url}/api/room/throttle-room"
+    response = requests.post(endpoint, json=payload, timeout=PERSIST_TIMEOUT)
+    response.raise_for_status()
+    return response.json() if response.content else {}
+
+def _since_start(state: GraphState) -> float:
+    return time.perf_counter() - state.startedAt if state.startedAt else 0.0
+
+@traced_node
+async def persistAlert(state: GraphState):
     """
-    Sends the analyzed data to your Node.js Backend.
+    Persists the alert right away with a placeholder analysis, concurrently with analyzeEmergency.
     """
-    current_time = datetime.now(timezone.utc).isoformat()
-    
     payload = {
+        "alertId": state.alertId,
         "triggeredByUserId": state.userId,
         "routeId": state.routeId,
-        "aiAnalysis": state.context,
+        "aiAnalysis": PLACEHOLDER_ANALYSIS,
+        "analysisStatus": "PENDING",
         "alertLevel": "HIGH",
-        "timestamp": current_time
+        "timestamp": datetime.now(timezone.utc).isoformat()
     }
-    
-    backend_url = os.getenv("BACKEND_URL", "http://localhost:3000")
-    endpoint = f"{backend_url}/api/room/throttle-room"
     try:
-        response = requests.post(endpoint, json=payload)
-        
-        response.raise_for_status()
-        
-        print(f" SUCCESS: Backend received the log. Status Code: {response.status_code}")
-        
+        await asyncio.to_thread(_post_throttle, payload)
+        metrics.observe("throttle_time_to_persist_seconds", _since_start(state))
+        print(f" SUCCESS: Throttle alert persisted. alertId={state.alertId}")
+        return {"persisted": True}
     except requests.exceptions.ConnectionError:
-        print(f" ERROR: Could not connect to backend at {backend_url}. Is the Node server running?")
+        print(f" ERROR: Could not connect to backend. Is the Node server running?")
     except requests.exceptions.HTTPError as e:
         print(f"ERROR: Backend returned an error: {e}")
     except Exception as e:
         print(f" ERROR: An unexpected error occurred: {e}")
+    metrics.inc("throttle_persist_failures")
+    return {"persisted": False}
 
-
-    return {}
-
+@traced_node
+async def saveToDatabase(state: GraphState):
+    """
+    Follow-up once both branches are done: attaches the AI analysis to the persisted alert,
+    or persists the whole alert if the first write failed.
+    Both writes target the same alertId, so a first write that reached the backend
+    but was reported as failed is overwritten rather than duplicated.
+    In degraded mode there is no analysis to attach, so a persisted alert is left as is.
+    """
+    if state.degraded and state.persisted:
+        return {}
+    if state.persisted:
+        payload = {"alertId": state.alertId, "aiAnalysis": state.context, "analysisStatus": "COMPLETE"}
+    else:
+        payload = {
+            "alertId": state.alertId,
+            "triggeredByUserId": state.userId,
+            "routeId": state.routeId,
+            "aiAnalysis": state.context,
+            "alertLevel": "HIGH",
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+    try:
+        await asyncio.to_thread(_post_throttle, payload)
+        print(f" SUCCESS: Throttle analysis saved. alertId={state.alertId}")
+        return {"persisted": True}
+    except Exception as e:
+        print(f" ERROR: Could not save throttle analysis: {e}")
+        metrics.inc("throttle_update_failures")
+        return {}
 
 graph = StateGraph(GraphState)
 
+graph.add_node("persistAlert", persistAlert)
 graph.add_node("analyzeEmergency", analyzeEmergency)
 graph.add_node("saveToDatabase", saveToDatabase)
 
+# Persisting never waits on the LLM; the follow-up runs once both are done
+graph.add_edge(START, "persistAlert")
 graph.add_edge(START, "analyzeEmergency")
-graph.add_edge("analyzeEmergency", "saveToDatabase")
+graph.add_edge(["persistAlert", "analyzeEmergency"], "saveToDatabase")
 graph.add_edge("saveToDatabase", END)
 
 analyze_emergency = graph.compile()
-
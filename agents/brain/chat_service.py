@@ -0,0 +1,238 @@
+import asyncio
+import time
+from typing import Optional
+
+from brain.layel_1 import (
+    chat_graphs, log_provisional_sos, review_sos_event, rule_judge, SAFE_SCORE,
+    SentimentScore, UrgencyScore, SeverityScore, FinalScore,
+)
+from brain.lexical_screen import has_risk_terms, screen_message
+from brain.room_context import room_context
+from brain.room_coalescer import RoomJob, room_coalescer
+from brain.verdict_cache import CACHE_ENABLED, CLEAN_HISTORY, verdict_cache
+from brain.route_buffers import route_buffers
+from brain.layel_2 import flag_routes
+from circuit_breaker import CircuitOpenError, llm_breaker
+from metrics import metrics
+from rate_limit import chat_limiter
+
+# Canned verdict for routine messages ("ok", "on my way", "reached")
+BENIGN_SCORES = (
+    SentimentScore(sentiment_score=0.9, reason="Lexical pre-screen: routine message"),
+    UrgencyScore(urgency_score=0.0, reason="Lexical pre-screen: routine message"),
+    SeverityScore(severity_score=0.0, reason="Lexical pre-screen: routine message"),
+)
+BENIGN_VERDICT = FinalScore(
+    final_safety_score=9.5,
+    trigger_sos=False,
+    reason="Routine message matched the benign lexicon; no LLM evaluation needed.",
+    sos_context="No threat detected.",
+)
+
+# Keep references so background confirmations are not garbage collected mid-flight
+_background_tasks = set()
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def track_route(room_id: str, score: float):
+    """Feeds the room's route buffer; raises the surveillance alert the moment its trend crosses into danger."""
+    risk = route_buffers.record(room_id, score)
+    if risk is not None:
+        print(f"📉 Route {room_id} crossed surveillance criteria: {risk.reasons}")
+        _spawn(flag_routes([risk]))
+
+
+def build_response(decision: FinalScore, sentiment, urgency, severity, **extra) -> dict:
+    response = {
+        "status": "success",
+        "final_score": decision.final_safety_score,
+        "trigger_sos": decision.trigger_sos,
+        "sos_context": decision.sos_context,
+        "analysis": decision.reason,
+        "details": {
+            "sentiment": sentiment,
+            "urgency": urgency,
+            "severity": severity,
+        }
+    }
+    response.update(extra)
+    return response
+
+
+def degraded_verdict(message: str, reason: str = "LLM unavailable; lexical decision") -> dict:
+    """
+    Rule-based verdict from the lexicon alone, used while the LLM circuit is open
+    or the sender is over the chat rate limit.
+    Risk terms (harassment, or danger phrases in an ambiguous context) score as suspicious,
+    anything else as neutral; clear emergencies never get here because the pre-screen
+    already handles them without the LLM.
+    """
+    if has_risk_terms(message):
+        scores = (
+            SentimentScore(sentiment_score=0.2, reason=f"{reason}: risk terms"),
+            UrgencyScore(urgency_score=0.2, reason=reason),
+            SeverityScore(severity_score=0.6, reason=f"{reason}: risk terms"),
+        )
+    else:
+        scores = (
+            SentimentScore(sentiment_score=0.5, reason=reason),
+            UrgencyScore(urgency_score=0.0, reason=reason),
+            SeverityScore(severity_score=0.0, reason=reason),
+        )
+    metrics.inc("chat_degraded")
+    return build_response(rule_judge(*scores), *scores, degraded=True)
+
+
+async def run_graph(initial_state: dict, mode: str, job: Optional[RoomJob] = None) -> dict:
+    config = {"configurable": {"thread_id": initial_state["roomId"]}}
+    started = time.perf_counter()
+    final_state = None
+    async for stream_mode, chunk in chat_graphs[mode].astream(
+        initial_state, config=config, stream_mode=["updates", "values"]
+    ):
+        if stream_mode == "values":
+            final_state = chunk
+        elif job is not None and "final_judge" in chunk:
+            # From here on the verdict (and any SOS) must be allowed to complete
+            job.verdict_reached = True
+    metrics.observe(f"chat_graph_seconds_{mode}", time.perf_counter() - started)
+    metrics.inc(f"chat_requests_{mode}")
+    return final_state
+
+
+async def _confirm_emergency(initial_state: dict, mode: str, sos_id: Optional[str]):
+    """
+    LLM review of a fast-path SOS that is already logged as PROVISIONAL.
+    The SOS is confirmed if the model agrees and retracted if it overrules the lexicon;
+    if the review cannot run (LLM down or failing) the SOS stays in place.
+    """
+    if llm_breaker.degraded:
+        return
+    try:
+        final_state = await run_graph({**initial_state, "sos_logged": True}, mode)
+    except Exception as e:
+        print(f"Fast-path SOS confirmation failed: {e}")
+        return
+    decision = final_state["final_model_score"]
+    metrics.inc("chat_prescreen_emergency_confirmed" if decision.trigger_sos else "chat_prescreen_emergency_overruled")
+    print(f"Fast-path SOS for room {initial_state['roomId']} LLM verdict: trigger_sos={decision.trigger_sos}")
+    if sos_id is None:
+        return
+    outcome = "CONFIRMED" if decision.trigger_sos else "RETRACTED"
+    result = await asyncio.to_thread(review_sos_event, sos_id, outcome, decision.reason)
+    print(f"🚨 Fast-path SOS {sos_id}: {result}")
+
+
+async def evaluate_chat(initial_state: dict, mode: str) -> dict:
+    """
+    Lexical pre-screen first:
+    - BENIGN short-circuits to a canned safe verdict,
+    - EMERGENCY logs a provisional SOS immediately; the LLM confirms or retracts it in the background,
+    - anything else runs the full graph, coalesced per (room, sender) so a burst of
+      one sender's messages is judged once, together, by the newest evaluation,
+      or gets a lexical/rule-based verdict while the LLM circuit is open or the
+      sender is over the chat rate limit.
+    Room history comes from the context store; client-sent messages only seed a room it has not seen.
+    """
+    room_id = initial_state["roomId"]
+    room_context.seed(room_id, initial_state.get("messages") or [])
+    recent = room_context.recent_messages(room_id)
+    prior_risk = room_context.has_prior_risk(room_id)
+    # Checkpointed channels persist per room, so per-run fields are reset explicitly
+    initial_state = {
+        **initial_state,
+        "messages": [],
+        "history": room_context.history_str(room_id),
+        "model_1": None, "model_2": None, "model_3": None,
+        "sos_logged": False,
+    }
+    room_context.append(room_id, initial_state["currentUserId"], initial_state["currentUserMessage"])
+
+    screen = screen_message(initial_state["currentUserMessage"], recent)
+    metrics.inc("chat_prescreen_total")
+
+    if screen.verdict == "BENIGN":
+        metrics.inc("chat_prescreen_benign")
+        track_route(room_id, BENIGN_VERDICT.final_safety_score)
+        return build_response(BENIGN_VERDICT, *BENIGN_SCORES, fast_path="BENIGN")
+
+    if screen.verdict == "EMERGENCY":
+        metrics.inc("chat_prescreen_emergency")
+        room_context.mark_risk(room_id)
+        context = f"Lexical pre-screen matched {screen.matches}: \"{initial_state['currentUserMessage']}\""
+        decision = FinalScore(
+            final_safety_score=1.0,
+            trigger_sos=True,
+            reason=f"{screen.reason}. LLM confirmation running asynchronously.",
+            sos_context=context,
+        )
+        sos_id = await asyncio.to_thread(
+            log_provisional_sos, initial_state["roomId"], initial_state["currentUserId"],
+            context, decision.final_safety_score,
+        )
+        print(f"🚨 Fast-path SOS for room {initial_state['roomId']}: {sos_id or 'not logged'}")
+        track_route(room_id, decision.final_safety_score)
+        _spawn(_confirm_emergency(initial_state, mode, sos_id))
+        return build_response(
+            decision,
+            SentimentScore(sentiment_score=0.0, reason=screen.reason),
+            UrgencyScore(urgency_score=1.0, reason=", ".join(screen.matches)),
+            SeverityScore(severity_score=1.0, reason=screen.reason),
+            fast_path="EMERGENCY",
+        )
+
+    metrics.inc("chat_prescreen_passthrough")
+
+    if llm_breaker.degraded:
+        response = degraded_verdict(initial_state["currentUserMessage"])
+        track_route(room_id, response["final_score"])
+        return response
+    # Only the LLM evaluation is rate limited; the pre-screen above (and its SOS) always runs
+    if not chat_limiter.allow(initial_state["currentUserId"]):
+        response = degraded_verdict(initial_state["currentUserMessage"], reason="Rate limited; lexical decision")
+        track_route(room_id, response["final_score"])
+        return {**response, "rate_limited": True}
+
+    async def evaluate(job: RoomJob) -> dict:
+        message = job.merged_message()
+        state = {**initial_state, "currentUserMessage": message}
+        # Rooms with prior risk always get a fresh, history-aware evaluation
+        use_cache = CACHE_ENABLED and not prior_risk
+        cached = verdict_cache.get(message, CLEAN_HISTORY) if use_cache else None
+        if cached is not None:
+            state.update(model_1=cached[0], model_2=cached[1], model_3=cached[2])
+
+        try:
+            final_state = await run_graph(state, mode, job)
+        except CircuitOpenError:
+            response = degraded_verdict(message)
+            track_route(room_id, response["final_score"])
+            return response
+        scores = (final_state.get("model_1"), final_state.get("model_2"), final_state.get("model_3"))
+        decision = final_state["final_model_score"]
+        track_route(room_id, decision.final_safety_score)
+        # A suspicious verdict also puts the room on fresh evaluations; only safe sub-scores are reused
+        if decision.trigger_sos or decision.final_safety_score < SAFE_SCORE:
+            room_context.mark_risk(room_id)
+        elif use_cache and cached is None:
+            verdict_cache.put(message, scores, CLEAN_HISTORY)
+
+        extra = {"cached_scores": True} if cached is not None else {}
+        return build_response(decision, *scores, **extra)
+
+    return await room_coalescer.run(room_id, initial_state["currentUserId"], initial_state["currentUserMessage"], evaluate)
+
+
+def _hit_rate() -> float:
+    total = metrics.value("chat_prescreen_total")
+    hits = metrics.value("chat_prescreen_benign") + metrics.value("chat_prescreen_emergency")
+    return round(hits / total, 4) if total else 0.0
+
+
+metrics.gauge("chat_prescreen_hit_rate", _hit_rate)
@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Set, Tuple
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from metrics import metrics
+
+# --- CONFIG ---
+# memory (default) | sqlite
+CHECKPOINT_BACKEND = os.getenv("CHAT_CHECKPOINT_BACKEND", "memory")
+CHECKPOINT_SQLITE_PATH = os.getenv(
+    "CHAT_CHECKPOINT_SQLITE_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), ".checkpoints", "chat.sqlite3")
+)
+MAX_ROOMS = int(os.getenv("CHAT_CHECKPOINT_MAX_ROOMS", "10000"))
+ROOM_TTL_SECONDS = float(os.getenv("CHAT_CHECKPOINT_TTL_SECONDS", str(6 * 3600)))
+MAX_BYTES = int(os.getenv("CHAT_CHECKPOINT_MAX_BYTES", str(64 * 1024 * 1024)))
+# Only the latest checkpoint is ever read; one spare keeps an in-flight run safe
+MAX_CHECKPOINTS_PER_ROOM = int(os.getenv("CHAT_CHECKPOINT_HISTORY", "2"))
+SQLITE_SWEEP_EVERY = 500
+
+
+class _RoomEntry:
+    __slots__ = ("last_seen", "blob_keys", "write_keys", "bytes")
+
+    def __init__(self):
+        self.last_seen = time.monotonic()
+        self.blob_keys: Set[tuple] = set()
+        self.write_keys: Set[tuple] = set()
+        self.bytes = 0
+
+
+def _typed_len(typed) -> int:
+    return len(typed[1]) if typed and isinstance(typed[1], (bytes, bytearray)) else 0
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    In-process checkpointer that cannot grow without bound.
+    - keeps only the newest MAX_CHECKPOINTS_PER_ROOM checkpoints per room,
+    - evicts whole rooms LRU-first when idle past the TTL, over MAX_ROOMS,
+      or when the total serialized size exceeds MAX_BYTES.
+    Keys are indexed per room so eviction never scans other rooms.
+    """
+
+    def __init__(
+        self,
+        max_rooms: int = MAX_ROOMS,
+        ttl_seconds: float = ROOM_TTL_SECONDS,
+        max_bytes: int = MAX_BYTES,
+        max_checkpoints: int = MAX_CHECKPOINTS_PER_ROOM,
+    ):
+        super().__init__()
+        self.max_rooms = max_rooms
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_checkpoints = max(1, max_checkpoints)
+        self._rooms: "OrderedDict[str, _RoomEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        metrics.gauge("chat_checkpoint_rooms", lambda: len(self._rooms))
+        metrics.gauge("chat_checkpoint_bytes", lambda: self._total_bytes)
+
+    def _entry(self, thread_id: str) -> _RoomEntry:
+        entry = self._rooms.get(thread_id)
+        if entry is None:
+            entry = self._rooms[thread_id] = _RoomEntry()
+        else:
+            entry.last_seen = time.monotonic()
+            self._rooms.move_to_end(thread_id)
+        return entry
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            entry = self._entry(thread_id)
+            entry.blob_keys.update((thread_id, checkpoint_ns, k, v) for k, v in new_versions.items())
+            self._prune(thread_id, checkpoint_ns, entry)
+            self._measure(thread_id, entry)
+            self._evict(keep=thread_id)
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            thread_id = config["configurable"]["thread_id"]
+            entry = self._entry(thread_id)
+            entry.write_keys.add(
+                (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+            )
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, entry: _RoomEntry):
+        checkpoints = self.storage.get(thread_id, {}).get(checkpoint_ns)
+        if not checkpoints or len(checkpoints) <= self.max_checkpoints:
+            return
+        ordered = sorted(checkpoints.keys())
+        for checkpoint_id in ordered[: -self.max_checkpoints]:
+            checkpoints.pop(checkpoint_id, None)
+            key = (thread_id, checkpoint_ns, checkpoint_id)
+            self.writes.pop(key, None)
+            entry.write_keys.discard(key)
+
+        # Drop channel blobs no retained checkpoint refers to
+        referenced = set()
+        for saved in checkpoints.values():
+            try:
+                versions = self.serde.loads_typed(saved[0]).get("channel_versions", {})
+            except Exception:
+                return
+            referenced.update((thread_id, checkpoint_ns, ch, ver) for ch, ver in versions.items())
+        for key in [k for k in entry.blob_keys if k[1] == checkpoint_ns and k not in referenced]:
+            self.blobs.pop(key, None)
+            entry.blob_keys.discard(key)
+
+    def _measure(self, thread_id: str, entry: _RoomEntry):
+        size = sum(_typed_len(self.blobs.get(k)) for k in entry.blob_keys)
+        for namespace in self.storage.get(thread_id, {}).values():
+            for saved in namespace.values():
+                size += _typed_len(saved[0]) + _typed_len(saved[1])
+        for key in entry.write_keys:
+            for write in self.writes.get(key, {}).values():
+                size += _typed_len(write[2])
+        self._total_bytes += size - entry.bytes
+        entry.bytes = size
+
+    def _drop_room(self, thread_id: str):
+        entry = self._rooms.pop(thread_id, None)
+        if entry is None:
+            return
+        self.storage.pop(thread_id, None)
+        for key in entry.write_keys:
+            self.writes.pop(key, None)
+        for key in entry.blob_keys:
+            self.blobs.pop(key, None)
+        self._total_bytes -= entry.bytes
+        metrics.inc("chat_checkpoint_evictions")
+
+    def _evict(self, keep: Optional[str] = None):
+        now = time.monotonic()
+        while self._rooms:
+            thread_id, entry = next(iter(self._rooms.items()))
+            if thread_id == keep:
+                break
+            over = (
+                len(self._rooms) > self.max_rooms
+                or self._total_bytes > self.max_bytes
+                or now - entry.last_seen > self.ttl_seconds
+            )
+            if not over:
+                break
+            self._drop_room(thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            if thread_id in self._rooms:
+                self._drop_room(thread_id)
+            else:
+                super().delete_thread(thread_id)
+
+
+def create_persistent_checkpointer(path: str = CHECKPOINT_SQLITE_PATH):
+    """
+    SQLite-backed checkpointer with the same retention rules, for state that
+    should survive restarts. Needs `langgraph-checkpoint-sqlite` and must be
+    created inside the running event loop.
+    """
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    class BoundedSqliteSaver(AsyncSqliteSaver):
+        _puts = 0
+        _activity_ready = False
+
+        async def setup(self) -> None:
+            await super().setup()
+            if self._activity_ready:
+                return
+            async with self.lock:
+                await self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS room_activity (thread_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)"
+                )
+                await self.conn.execute("CREATE INDEX IF NOT EXISTS room_activity_seen ON room_activity (last_seen)")
+                await self.conn.commit()
+            self._activity_ready = True
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            result = await super().aput(config, checkpoint, metadata, new_versions)
+            thread_id = str(config["configurable"]["thread_id"])
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            async with self.lock:
+                await self.conn.execute(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+                    "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns, MAX_CHECKPOINTS_PER_ROOM),
+                )
+                await self.conn.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+                    "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+                )
+                await self.conn.execute(
+                    "INSERT OR REPLACE INTO room_activity (thread_id, last_seen) VALUES (?, ?)",
+                    (thread_id, time.time()),
+                )
+                await self.conn.commit()
+            self._puts += 1
+            if self._puts % SQLITE_SWEEP_EVERY == 0:
+                await self.sweep()
+            return result
+
+        async def sweep(self) -> int:
+            """Deletes rooms idle past the TTL, then the oldest rooms beyond MAX_ROOMS."""
+            async with self.lock:
+                async with self.conn.execute(
+                    "SELECT thread_id FROM room_activity WHERE last_seen < ? "
+                    "UNION SELECT thread_id FROM (SELECT thread_id FROM room_activity ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                    (time.time() - ROOM_TTL_SECONDS, MAX_ROOMS),
+                ) as cur:
+                    stale = [row[0] for row in await cur.fetchall()]
+                for thread_id in stale:
+                    await self.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                    await self.conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                    await self.conn.execute("DELETE FROM room_activity WHERE thread_id = ?", (thread_id,))
+                await self.conn.commit()
+            metrics.inc("chat_checkpoint_evictions", len(stale))
+            return len(stale)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return BoundedSqliteSaver(aiosqlite.connect(path))
@@ -1,5 +1,6 @@
 from state import AgentState
 from utils import analyze_image_category
+from tracing import traced_node
 
 ELECTRIC_SYSTEM_PROMPT = """
 You are a High-Voltage Electrical Safety Inspector.
@@ -27,6 +28,7 @@ Assign severity based on electrocution and fire risk:
 - LOW: Day-burning streetlight (wastage), messy but high wires.
 """
 
+@traced_node
 async def electric_agent_node(state: AgentState):
     print("⚡ Electricity Agent Analyzing...")
     
@@ -3,8 +3,10 @@ from langchain_core.messages import SystemMessage, HumanMessage
 from pydantic import BaseModel, Field
 from langchain_core.output_parsers import PydanticOutputParser
 
-from state import AgentState, ReportCategory, SeverityLevel
-from utils import llm  
+from state import AgentAnalysis, AgentState, ReportCategory, SeverityLevel
+from circuit_breaker import CircuitOpenError
+from models import Cascade
+from tracing import traced_node
 
 ROUTE_MAPPING = {
     ReportCategory.WATER: "reports/waterReports",
@@ -51,7 +53,36 @@ OUTPUT FORMAT:
 You must strictly output valid JSON matching the FinalVerdict schema.
 """
 
+verdict_parser = PydanticOutputParser(pydantic_object=FinalVerdict)
 
+def parse_verdict(response) -> FinalVerdict:
+    """Parses the judge's reply; an unknown category counts as invalid output and escalates."""
+    verdict = verdict_parser.parse(response.content)
+    ReportCategory(verdict.selected_category.upper())
+    return verdict
+
+judge_cascade = Cascade("report_judge", parse=parse_verdict)
+
+
+DEGRADED_REASONING = "AI classification unavailable; saved as UNCERTAIN for manual review."
+
+def degraded_verdict(state: AgentState):
+    """Confidence-free UNCERTAIN routing used while the LLM circuit is open."""
+    return {
+        "assigned_category": ReportCategory.UNCERTAIN,
+        "severity": SeverityLevel.MEDIUM,
+        "aiAnalysis": DEGRADED_REASONING,
+        "title": "Pending Review",
+        "uncertain_analysis": AgentAnalysis(
+            confidence=0.0, severity=SeverityLevel.MEDIUM, reasoning=DEGRADED_REASONING, title="Pending Review"
+        ),
+        "route": ROUTE_MAPPING[ReportCategory.UNCERTAIN],
+        "updatedRoute": None,
+        "degraded": True,
+    }
+
+
+@traced_node
 async def finalizer_node(state: AgentState):
     print(" Judge Agent Deciding...")
     
@@ -81,19 +112,13 @@ async def finalizer_node(state: AgentState):
     {format_agent("ELECTRICITY AGENT", electric)}
     """
 
-    parser = PydanticOutputParser(pydantic_object=FinalVerdict)
-    
-    final_prompt = JUDGE_SYSTEM_PROMPT + "\n\n" + parser.get_format_instructions()
+    final_prompt = JUDGE_SYSTEM_PROMPT + "\n\n" + verdict_parser.get_format_instructions()
 
     try:
-
-        response = await llm.ainvoke([
+        verdict = await judge_cascade.ainvoke([
             SystemMessage(content=final_prompt),
             HumanMessage(content=reports_text)
         ])
-        
-
-        verdict = parser.parse(response.content)
 
         category_enum = ReportCategory.UNCERTAIN
         try:
@@ -118,6 +143,9 @@ async def finalizer_node(state: AgentState):
             "updatedRoute": UPDATED_ROUTE_MAPPING.get(category_enum)
         }
 
+    except CircuitOpenError:
+        print(" Judge Agent skipped: LLM circuit open, routing as UNCERTAIN")
+        return degraded_verdict(state)
     except Exception as e:
         print(f" Judge Agent Failed: {e}")
     
@@ -1,5 +1,6 @@
 from state import AgentState
 from utils import analyze_image_category
+from tracing import traced_node
 
 INFRA_SYSTEM_PROMPT = """
 You are a senior Civil Engineer.
@@ -23,6 +24,7 @@ Assign severity based on immediate physical danger:
 - LOW: Cosmetic cracks, graffiti, faded paint.
 """
 
+@traced_node
 async def infra_agent_node(state: AgentState):
     print(" Infrastructure Agent Analyzing...")
     
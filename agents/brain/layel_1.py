@@ -1,20 +1,22 @@
 import os
+import asyncio
 import requests
 from typing import List, Optional, TypedDict
 from pydantic import BaseModel, Field
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.tools import tool
 from dotenv import load_dotenv
 from langgraph.graph import END, START, StateGraph
-from langgraph.checkpoint.memory import MemorySaver
+from metrics import metrics
+from models import Cascade
+from brain.checkpointer import BoundedMemorySaver, create_persistent_checkpointer
+from brain.micro_batcher import MicroBatcher
+from tracing import traced_node
 
 load_dotenv()
 
 if not os.getenv("GOOGLE_API_KEY"):
     raise ValueError("GOOGLE_API_KEY not found!")
 
-flash_model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0, max_retries=2)
-pro_model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0)
 class SentimentScore(BaseModel):
     sentiment_score: float = Field(description="Float 0.0 to 1.0. 0=Hostile/Dangerous, 1=Safe/Supportive")
     reason: str = Field(description="Concise evidence citing specific words")
@@ -27,6 +29,20 @@ class SeverityScore(BaseModel):
     severity_score: float = Field(description="Float 0.0 to 1.0. 1=Direct Threat/Violence")
     reason: str = Field(description="Specific threat category detected")
 
+class CombinedScores(BaseModel):
+    sentiment: SentimentScore
+    urgency: UrgencyScore
+    severity: SeverityScore
+
+class BatchItemScores(BaseModel):
+    id: str = Field(description="The item id, copied exactly from the input")
+    sentiment: SentimentScore
+    urgency: UrgencyScore
+    severity: SeverityScore
+
+class BatchedScores(BaseModel):
+    items: List[BatchItemScores]
+
 class FinalScore(BaseModel):
     final_safety_score: float = Field(description="Float 1.0 to 10.0")
     trigger_sos: bool = Field(description="TRUE only for immediate physical danger.")
@@ -43,6 +59,30 @@ def log_sos_event(route_id: str, user_id: str, context: str, score: float):
         return f"SOS Logged: {response.status_code}"
     except Exception as e: return f"SOS Fail: {str(e)}"
 
+def log_provisional_sos(route_id: str, user_id: str, context: str, score: float) -> Optional[str]:
+    """Logs a fast-path SOS that still awaits LLM review; returns its id so it can be confirmed or retracted."""
+    try:
+        backend_url = os.getenv("BACKEND_URL", "http://localhost:3000")
+        response = requests.post(f"{backend_url}/api/room/log-sos", json={
+            "routeId": route_id, "userId": user_id, "context": context, "score": score,
+            "severity": "CRITICAL", "status": "PROVISIONAL",
+        }, timeout=3)
+        response.raise_for_status()
+        return response.json().get("sosId")
+    except Exception as e:
+        print(f"SOS Fail: {e}")
+        return None
+
+def review_sos_event(sos_id: str, outcome: str, reason: str) -> str:
+    """Marks a provisional SOS as CONFIRMED or RETRACTED after the LLM has judged the message."""
+    try:
+        backend_url = os.getenv("BACKEND_URL", "http://localhost:3000")
+        response = requests.post(f"{backend_url}/api/room/review-sos", json={
+            "sosId": sos_id, "outcome": outcome, "reason": reason
+        }, timeout=3)
+        return f"SOS {outcome}: {response.status_code}"
+    except Exception as e: return f"SOS review failed: {str(e)}"
+
 @tool
 def log_suspicious_event(route_id: str, user_id: str, context: str, score: float):
     """Logs SUSPICIOUS/HARASSMENT behavior (Non-Emergency) to backend."""
@@ -68,19 +108,66 @@ class GraphState(TypedDict):
     model_3: Optional[SeverityScore]
     final_model_score: Optional[FinalScore]
     tool_logs: Optional[List[str]]
+    sos_logged: Optional[bool]
+    # Rolling summary + recent tail from the room context store, already token-budgeted
+    history: Optional[str]
+
+SENTIMENT_RUBRIC = """RUBRIC (0.0 - 1.0):
+    - 0.0: Aggressive, Hateful, Predator-like, Manipulative.
+    - 0.5: Neutral, Transactional, Bored.
+    - 1.0: Supportive, Friendly, Respectful.
+    
+    RULES:
+    - Ignore profanity if used playfully between friends (check history).
+    - Flag sudden shifts from friendly to aggressive as LOW score."""
+
+URGENCY_RUBRIC = """RUBRIC (0.0 - 1.0):
+    - 1.0 (CRITICAL): "Help", "Police", "Followed", "Scared", "Where are you taking me".
+    - 0.8 (HIGH): "Stop it", "Leave me alone" (Repeatedly).
+    - 0.0 (NONE): Casual chat, "Call me later", "I'm running late".
+    
+    RULES:
+    - Context is key. "I'm dying of laughter" is 0.0. "I'm dying, help" is 1.0."""
+
+SEVERITY_RUBRIC = """RUBRIC (0.0 - 1.0):
+    - 1.0 (DANGER): Physical threats, kidnapping, sexual assault implication, stalking.
+    - 0.6 (HARASSMENT): Slurs, persistent unwanted requests, sexual comments.
+    - 0.2 (RUDE): Insults, arguments.
+    - 0.0 (SAFE): Normal interaction.
+    
+    RULES:
+    - If the user said "NO" or "STOP" in history and this message continues -> Severity > 0.7."""
+
+def near(value: float, *thresholds: float) -> bool:
+    return any(abs(value - t) <= JUDGE_AMBIGUITY_MARGIN for t in thresholds)
 
-sentiment_engine = flash_model.with_structured_output(SentimentScore)
-urgency_engine = flash_model.with_structured_output(UrgencyScore)
-severity_engine = flash_model.with_structured_output(SeverityScore)
-final_engine = pro_model.with_structured_output(FinalScore)
+def consistent_verdict(result: FinalScore) -> bool:
+    """The judge's score must sit in its decision-matrix band for the SOS flag it chose."""
+    score = result.final_safety_score
+    return 1.0 <= score <= 10.0 and result.trigger_sos == (score < 3.5)
+
+# Scores near a decision threshold escalate to the stronger tier (models.DEFAULT_CASCADES)
+sentiment_engine = Cascade("chat_scores", SentimentScore, accept=lambda r: not near(r.sentiment_score, SUSPICIOUS_SENTIMENT))
+urgency_engine = Cascade("chat_scores", UrgencyScore, accept=lambda r: not near(r.urgency_score, SOS_URGENCY))
+severity_engine = Cascade("chat_scores", SeverityScore, accept=lambda r: not near(r.severity_score, SOS_SEVERITY, SUSPICIOUS_SEVERITY))
+combined_engine = Cascade("chat_scores", CombinedScores, accept=lambda r: not is_ambiguous(
+    r.sentiment.sentiment_score, r.urgency.urgency_score, r.severity.severity_score
+))
+# A whole batch is never escalated; its ambiguous items are re-scored one by one on the stronger tier
+batched_engine = Cascade("chat_scores", BatchedScores)
+final_engine = Cascade("chat_judge", FinalScore, accept=consistent_verdict)
 
 def get_history_str(messages: List[FrontendMessage]) -> str:
     raw = messages[-6:] 
     return "\n".join([f"[{m.userId}]: {m.message}" for m in raw]) if raw else "No history."
 
+def state_history(state: GraphState) -> str:
+    return state.get("history") or get_history_str(state.get("messages") or [])
+
 
+@traced_node
 async def analyze_sentiment(state: GraphState):
-    history = get_history_str(state["messages"])
+    history = state_history(state)
     current = state["currentUserMessage"]
     
     prompt = f"""
@@ -93,20 +180,14 @@ async def analyze_sentiment(state: GraphState):
     CURRENT MESSAGE:
     "{current}"
     
-    RUBRIC (0.0 - 1.0):
-    - 0.0: Aggressive, Hateful, Predator-like, Manipulative.
-    - 0.5: Neutral, Transactional, Bored.
-    - 1.0: Supportive, Friendly, Respectful.
-    
-    RULES:
-    - Ignore profanity if used playfully between friends (check history).
-    - Flag sudden shifts from friendly to aggressive as LOW score.
+    {SENTIMENT_RUBRIC}
     """
     result = await sentiment_engine.ainvoke(prompt)
     return {"model_1": result}
 
+@traced_node
 async def analyze_urgency(state: GraphState):
-    history = get_history_str(state["messages"])
+    history = state_history(state)
     current = state["currentUserMessage"]
     
     prompt = f"""
@@ -119,19 +200,14 @@ async def analyze_urgency(state: GraphState):
     CURRENT MESSAGE:
     "{current}"
     
-    RUBRIC (0.0 - 1.0):
-    - 1.0 (CRITICAL): "Help", "Police", "Followed", "Scared", "Where are you taking me".
-    - 0.8 (HIGH): "Stop it", "Leave me alone" (Repeatedly).
-    - 0.0 (NONE): Casual chat, "Call me later", "I'm running late".
-    
-    RULES:
-    - Context is key. "I'm dying of laughter" is 0.0. "I'm dying, help" is 1.0.
+    {URGENCY_RUBRIC}
     """
     result = await urgency_engine.ainvoke(prompt)
     return {"model_2": result}
 
+@traced_node
 async def analyze_severity(state: GraphState):
-    history = get_history_str(state["messages"])
+    history = state_history(state)
     current = state["currentUserMessage"]
     
     prompt = f"""
@@ -144,22 +220,176 @@ async def analyze_severity(state: GraphState):
     CURRENT MESSAGE:
     "{current}"
     
-    RUBRIC (0.0 - 1.0):
-    - 1.0 (DANGER): Physical threats, kidnapping, sexual assault implication, stalking.
-    - 0.6 (HARASSMENT): Slurs, persistent unwanted requests, sexual comments.
-    - 0.2 (RUDE): Insults, arguments.
-    - 0.0 (SAFE): Normal interaction.
-    
-    RULES:
-    - If the user said "NO" or "STOP" in history and this message continues -> Severity > 0.7.
+    {SEVERITY_RUBRIC}
     """
     result = await severity_engine.ainvoke(prompt)
     return {"model_3": result}
 
+COMBINED_RUBRICS = f"""--- 1. SENTIMENT (Forensic Psycholinguist): emotional tone and intent ---
+    {SENTIMENT_RUBRIC}
+    
+    --- 2. URGENCY (911 Emergency Dispatcher): immediate time-sensitive threats ---
+    {URGENCY_RUBRIC}
+    
+    --- 3. SEVERITY (Threat Intelligence Analyst): category of harm ---
+    {SEVERITY_RUBRIC}"""
+
+def combined_prompt(history: str, current: str) -> str:
+    return f"""
+    ROLE: Panel of three safety experts reviewing one chat message.
+    TASK: Score the CURRENT MESSAGE within the context of the chat on three independent axes.
+    
+    CONTEXT (History):
+    {history}
+    
+    CURRENT MESSAGE:
+    "{current}"
+    
+    {COMBINED_RUBRICS}
+    
+    Score each axis on its own rubric; do not let one axis bias another.
+    """
+
+@traced_node
+async def analyze_combined(state: GraphState):
+    """One structured call that produces all three expert scores."""
+    result = await combined_engine.ainvoke(combined_prompt(state_history(state), state["currentUserMessage"]))
+    return {"model_1": result.sentiment, "model_2": result.urgency, "model_3": result.severity}
+
+# --- CROSS-ROOM MICRO-BATCHING ---
+CHAT_BATCH_MAX_SIZE = int(os.getenv("CHAT_BATCH_MAX_SIZE", "16"))
+CHAT_BATCH_MAX_WAIT_MS = float(os.getenv("CHAT_BATCH_MAX_WAIT_MS", "5"))
+
+async def _score_batch(items) -> dict:
+    blocks = "\n".join(
+        f"""
+    === ITEM id="{item_id}" ===
+    CONTEXT (History):
+    {history}
+    CURRENT MESSAGE:
+    "{current}"
+    """
+        for item_id, (history, current) in items
+    )
+    prompt = f"""
+    ROLE: Panel of three safety experts reviewing several unrelated chat rooms.
+    TASK: For EACH item below, score its CURRENT MESSAGE within that item's own history on three independent axes.
+    Items are independent: never let one item's content influence another's scores.
+    Return exactly one result per item, with its id copied exactly.
+    {COMBINED_RUBRICS}
+    {blocks}
+    """
+    result = await batched_engine.ainvoke(prompt)
+    wanted = dict(items)
+    scores = {
+        r.id: CombinedScores(sentiment=r.sentiment, urgency=r.urgency, severity=r.severity)
+        for r in result.items if r.id in wanted
+    }
+    ambiguous = [item_id for item_id, r in scores.items() if not combined_engine.accept(r)]
+    if ambiguous and len(combined_engine.tiers) > 1:
+        metrics.inc("chat_batch_escalations", len(ambiguous))
+        rescored = await asyncio.gather(
+            *(combined_engine.ainvoke(combined_prompt(*wanted[item_id]), start=1) for item_id in ambiguous),
+            return_exceptions=True,
+        )
+        for item_id, r in zip(ambiguous, rescored):
+            if not isinstance(r, Exception):
+                scores[item_id] = r
+    return scores
+
+async def _score_single(item) -> CombinedScores:
+    history, current = item
+    return await combined_engine.ainvoke(combined_prompt(history, current))
+
+chat_batcher = MicroBatcher(
+    "chat", _score_batch, _score_single,
+    max_size=CHAT_BATCH_MAX_SIZE, max_wait=CHAT_BATCH_MAX_WAIT_MS / 1000.0,
+)
+
+@traced_node
+async def analyze_batched(state: GraphState):
+    """Combined scoring through the cross-room micro-batcher."""
+    result = await chat_batcher.submit((state_history(state), state["currentUserMessage"]))
+    return {"model_1": result.sentiment, "model_2": result.urgency, "model_3": result.severity}
+
+# --- LOCAL JUDGE ---
+# Thresholds of the judge's decision matrix (see the final_judge prompt)
+SOS_URGENCY = 0.8
+SOS_SEVERITY = 0.9
+SUSPICIOUS_SEVERITY = 0.5
+SUSPICIOUS_SENTIMENT = 0.3
+# Final scores below this are suspicious (CASE B) or SOS (CASE A)
+SAFE_SCORE = 8.0
+
+# hybrid: rules unless a sub-score sits near a threshold | rules: always local | llm: always the LLM judge
+JUDGE_MODE = os.getenv("CHAT_JUDGE_MODE", "hybrid")
+JUDGE_AMBIGUITY_MARGIN = float(os.getenv("CHAT_JUDGE_AMBIGUITY_MARGIN", "0.05"))
+
+def is_ambiguous(sentiment: float, urgency: float, severity: float, margin: float = JUDGE_AMBIGUITY_MARGIN) -> bool:
+    """True when any sub-score is within `margin` of a decision boundary."""
+    checks = [
+        (urgency, SOS_URGENCY),
+        (severity, SOS_SEVERITY),
+        (severity, SUSPICIOUS_SEVERITY),
+        (sentiment, SUSPICIOUS_SENTIMENT),
+    ]
+    return any(abs(value - threshold) <= margin for value, threshold in checks)
+
+def rule_judge(s: SentimentScore, u: UrgencyScore, sev: SeverityScore) -> FinalScore:
+    """Deterministic version of the judge's decision matrix, with the same score bands."""
+    sentiment, urgency, severity = s.sentiment_score, u.urgency_score, sev.severity_score
+    evidence = f"sentiment={sentiment:.2f} ({s.reason}); urgency={urgency:.2f} ({u.reason}); severity={severity:.2f} ({sev.reason})"
+
+    if urgency > SOS_URGENCY or severity > SOS_SEVERITY:
+        # CASE A: 1.0 - 3.0, lower for stronger signals
+        intensity = max(
+            (urgency - SOS_URGENCY) / (1 - SOS_URGENCY),
+            (severity - SOS_SEVERITY) / (1 - SOS_SEVERITY),
+        )
+        score = 3.0 - 2.0 * min(max(intensity, 0.0), 1.0)
+        return FinalScore(
+            final_safety_score=round(score, 2),
+            trigger_sos=True,
+            reason=f"SOS: urgency > {SOS_URGENCY} or severity > {SOS_SEVERITY}. {evidence}",
+            sos_context=f"Immediate danger indicated. {u.reason}; {sev.reason}",
+        )
+
+    if severity > SUSPICIOUS_SEVERITY or sentiment < SUSPICIOUS_SENTIMENT:
+        # CASE B: 4.0 - 7.9
+        risk = max(
+            (severity - SUSPICIOUS_SEVERITY) / (SOS_SEVERITY - SUSPICIOUS_SEVERITY),
+            (SUSPICIOUS_SENTIMENT - sentiment) / SUSPICIOUS_SENTIMENT,
+        )
+        score = 7.9 - 3.9 * min(max(risk, 0.0), 1.0)
+        return FinalScore(
+            final_safety_score=round(score, 2),
+            trigger_sos=False,
+            reason=f"Suspicious: severity > {SUSPICIOUS_SEVERITY} or sentiment < {SUSPICIOUS_SENTIMENT}. {evidence}",
+            sos_context=f"Possible harassment. {sev.reason}; {s.reason}",
+        )
+
+    # CASE C: 8.0 - 10.0
+    score = SAFE_SCORE + 2.0 * min(max(sentiment, 0.0), 1.0) * (1.0 - severity)
+    return FinalScore(
+        final_safety_score=round(score, 2),
+        trigger_sos=False,
+        reason=f"Safe: normal conversation. {evidence}",
+        sos_context="No threat detected.",
+    )
+
+@traced_node
 async def final_judge(state: GraphState):
-    history_str = get_history_str(state["messages"])
-    current_msg = state["currentUserMessage"]
     s, u, sev = state["model_1"], state["model_2"], state["model_3"]
+
+    if JUDGE_MODE == "rules" or (
+        JUDGE_MODE != "llm" and not is_ambiguous(s.sentiment_score, u.urgency_score, sev.severity_score)
+    ):
+        metrics.inc("chat_judge_rules")
+        return {"final_model_score": rule_judge(s, u, sev)}
+
+    metrics.inc("chat_judge_llm")
+    history_str = state_history(state)
+    current_msg = state["currentUserMessage"]
     
     prompt = f"""
     ROLE: Senior Safety Operations Director.
@@ -197,14 +427,19 @@ async def final_judge(state: GraphState):
     result = await final_engine.ainvoke(prompt)
     return {"final_model_score": result}
 
+@traced_node
 async def sos_reporter(state: GraphState):
     decision = state["final_model_score"]
+    if state.get("sos_logged"):
+        # The lexical fast path already logged this SOS; this run only confirms it
+        return {"tool_logs": ["SOS already logged by lexical pre-screen"]}
     log_result = log_sos_event.invoke({
         "route_id": state["roomId"], "user_id": state["currentUserId"],
         "context": decision.sos_context, "score": decision.final_safety_score
     })
     return {"tool_logs": [log_result]}
 
+@traced_node
 async def suspicious_reporter(state: GraphState):
     decision = state["final_model_score"]
     print(f"⚠️ SUSPICIOUS ACTIVITY detected. Logging to specialized DB...")
@@ -218,38 +453,76 @@ def route_decision(state: GraphState):
     score = decision.final_safety_score
     if decision.trigger_sos:
         return "report_sos"
-    elif score < 8.0: 
+    elif score < SAFE_SCORE:
         return "report_suspicious"
 
     return "finalize"
-graph = StateGraph(GraphState)
-graph.add_node("analyze_sentiment", analyze_sentiment)
-graph.add_node("analyze_urgency", analyze_urgency)
-graph.add_node("analyze_severity", analyze_severity)
-graph.add_node("final_judge", final_judge)
-graph.add_node("sos_reporter", sos_reporter)
-graph.add_node("suspicious_reporter", suspicious_reporter)
-
-graph.add_edge(START, "analyze_sentiment")
-graph.add_edge(START, "analyze_urgency")
-graph.add_edge(START, "analyze_severity")
-
-graph.add_edge("analyze_sentiment", "final_judge")
-graph.add_edge("analyze_urgency", "final_judge")
-graph.add_edge("analyze_severity", "final_judge")
-
-graph.add_conditional_edges(
-    "final_judge",
-    route_decision,
-    {
-        "report_sos": "sos_reporter",
-        "report_suspicious": "suspicious_reporter",
-        "finalize": END
-    }
-)
+def has_prefilled_scores(state: GraphState) -> bool:
+    return all(state.get(key) is not None for key in ("model_1", "model_2", "model_3"))
+
+SCORING_MODES = ("parallel", "combined", "batched")
+DEFAULT_SCORING_MODE = os.getenv("CHAT_SCORING_MODE", "parallel")
+
+def build_graph(scoring_mode: str = "parallel", checkpointer=None):
+    """
+    parallel: three analyzer calls fan out and join at the judge.
+    combined: one structured call returns all three scores.
+    batched:  like combined, but concurrent rooms share one multi-item call.
+    """
+    graph = StateGraph(GraphState)
+    if scoring_mode in ("combined", "batched"):
+        node = analyze_batched if scoring_mode == "batched" else analyze_combined
+        graph.add_node("analyze_combined", node)
+        analyzers = ["analyze_combined"]
+        graph.add_edge("analyze_combined", "final_judge")
+    else:
+        graph.add_node("analyze_sentiment", analyze_sentiment)
+        graph.add_node("analyze_urgency", analyze_urgency)
+        graph.add_node("analyze_severity", analyze_severity)
+
+        analyzers = ["analyze_sentiment", "analyze_urgency", "analyze_severity"]
+
+        graph.add_edge("analyze_sentiment", "final_judge")
+        graph.add_edge("analyze_urgency", "final_judge")
+        graph.add_edge("analyze_severity", "final_judge")
+
+    # Sub-scores prefilled from the verdict cache go straight to the judge
+    graph.add_conditional_edges(
+        START,
+        lambda state: ["final_judge"] if has_prefilled_scores(state) else analyzers,
+        analyzers + ["final_judge"],
+    )
+
+    graph.add_node("final_judge", final_judge)
+    graph.add_node("sos_reporter", sos_reporter)
+    graph.add_node("suspicious_reporter", suspicious_reporter)
+
+    graph.add_conditional_edges(
+        "final_judge",
+        route_decision,
+        {
+            "report_sos": "sos_reporter",
+            "report_suspicious": "suspicious_reporter",
+            "finalize": END
+        }
+    )
+
+    graph.add_edge("sos_reporter", END)
+    graph.add_edge("suspicious_reporter", END)
+
+    return graph.compile(checkpointer=checkpointer or memory)
 
-graph.add_edge("sos_reporter", END)
-graph.add_edge("suspicious_reporter", END)
+# Checkpoints are keyed by roomId; the bounded saver evicts idle rooms
+memory = BoundedMemorySaver()
+app_graph = build_graph("parallel")
+combined_graph = build_graph("combined")
+batched_graph = build_graph("batched")
+chat_graphs = {"parallel": app_graph, "combined": combined_graph, "batched": batched_graph}
 
-memory = MemorySaver()
-app_graph = graph.compile(checkpointer=memory)
\ No newline at end of file
+async def use_persistent_checkpointer():
+    """Recompiles the chat graphs on the SQLite checkpointer. Must run inside the event loop."""
+    saver = create_persistent_checkpointer()
+    await saver.setup()
+    for mode in list(chat_graphs):
+        chat_graphs[mode] = build_graph(mode, checkpointer=saver)
+    return saver
@@ -1,22 +1,26 @@
+import asyncio
 import os
 import requests
 import json
 from typing import List, Dict, TypedDict, Annotated
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, ToolMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.tools import tool
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
 from dotenv import load_dotenv
+from brain.route_risk import RouteRisk, evaluate_routes
+from models import chat_model, guarded_ainvoke
+from tracing import traced_node
 
 load_dotenv()
 @tool
-def flag_suspicious_route(route_id: str):
+def flag_suspicious_route(route_id: str, reason: str = "Automated surveillance flag by AI Agent"):
     """
     Triggers a backend alert for a specific route ID. 
     Use this tool when a route's score pattern indicates danger.
     Args:
         route_id: The ID of the suspicious route.
+        reason: Which danger criteria the route matched.
     """
     try:
         backend_url = os.getenv("BACKEND_URL", "http://localhost:3000")
@@ -25,7 +29,7 @@ def flag_suspicious_route(route_id: str):
         payload = {
             "roomId": route_id,
             "severity": "HIGH",
-            "ai_reason": "Automated surveillance flag by AI Agent"
+            "ai_reason": reason
         }
         response = requests.post(endpoint, json=payload, timeout=5)
         return f"ALARM TRIGGERED for {route_id}. Status: {response.status_code}"
@@ -35,165 +39,122 @@ def flag_suspicious_route(route_id: str):
 class SurveillanceState(TypedDict):
     # This is the INPUT data (The Dictionary)
     route_data: Dict[str, List[float]]
-    # This is the INTERNAL scratchpad (UserMsg -> AI -> Tool -> ToolMsg ...)
+    # Routes the deterministic risk engine flagged
+    flagged: List[RouteRisk]
+    # Outputs of the flag tool, one per flagged route
+    tool_logs: List[str]
+    # Analyst narrative (UserMsg -> AI)
     messages: Annotated[List[BaseMessage], add_messages]
 
 # --- 3. MODEL SETUP ---
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0)
-llm_with_tools = llm.bind_tools([flag_suspicious_route])
+llm = chat_model("flash", max_retries=6)
+# Only this many flagged routes are described in the narrative prompt
+NARRATIVE_MAX_ROUTES = int(os.getenv("SURVEILLANCE_NARRATIVE_MAX_ROUTES", "25"))
+# Concurrent flag-room requests, and a hard cap on alerts raised by one sweep
+FLAG_CONCURRENCY = int(os.getenv("SURVEILLANCE_FLAG_CONCURRENCY", "16"))
+MAX_FLAGS_PER_SWEEP = int(os.getenv("SURVEILLANCE_MAX_FLAGS", "500"))
 
 # --- 4. NODES ---
 
-# ... inside layel_2.py ...
-
-async def analyst_node(state: SurveillanceState):
+@traced_node
+async def risk_engine_node(state: SurveillanceState):
     """
-    The Brain: Looks at 'route_data' and decides if tools are needed.
+    The Rules: every route is scored against the danger criteria in one
+    vectorized pass (brain/route_risk.py). No LLM involved.
     """
-    print("\n--- 🧠 ANALYST NODE STARTED ---")
-    data = state["route_data"]
-    messages = state["messages"]
-    
-    # 1. INITIALIZATION: If no messages exist, we must start the conversation
-    if not messages:
-        print("🔹 Mode: Initialization (Creating Prompt)")
-        prompt_content = f"""
-        Analyze this Route Safety Data: {json.dumps(data)}
-
-        --- THE SAFETY RUBRIC (Reference) ---
-        [9-10] SAFE (Green): Friendly banter, logistics.
-        [7-8]  CAUTION (Yellow): Rude, weird vibes.
-        [4-6]  UNSAFE (Orange): Harassment, "Stop" ignored, Stalking.
-        [1-3]  DANGER (Red): Threats, SOS, Violence.
-        
-        RULES:
-        1. Input is a dictionary: {{ "routeId": [score_history] }}
-        2. DATA STRUCTURE: The array is chronological. The LAST number is the LATEST score.
-        3. DANGER CRITERIA:
-           - Rapid Drop: Score drops >= 3 points (e.g., 9 -> 5).
-           - Low Average: Last 3 scores are all < 5.
-        4. ACTION:
-           - If a route matches DANGER CRITERIA, call 'flag_suspicious_route(route_id)'.
-           - If multiple routes are bad, call the tool for EACH one.
-        5. If all are safe, simply respond "Surveillance Clean".
-        """
-        
-        # Create the prompt object
-        first_message = HumanMessage(content=prompt_content)
-        
-        # ⚠️ CRITICAL STEP: Invoke the LLM *IMMEDIATELY* with this new message
-        print("🔹 Invoking LLM with initial prompt...")
-        response = await llm_with_tools.ainvoke([first_message])
-        
-        print(f"🔹 LLM Response Generated. Tool Calls: {response.tool_calls}")
-        
-        # ⚠️ CRITICAL RETURN: We must return BOTH the prompt AND the response
-        # This ensures the Router sees the AI's response as the last message.
-        return {"messages": [first_message, response]}
-    
-    # 2. CONTINUATION: If messages exist (e.g., looping back from a tool)
-    print("🔹 Mode: Continuation (History exists)")
-    response = await llm_with_tools.ainvoke(state["messages"])
-    print(f"🔹 LLM Response Generated. Tool Calls: {response.tool_calls}")
-    
-    return {"messages": [response]}
+    flagged = evaluate_routes(state["route_data"])
+    print(f"--- 📐 RISK ENGINE: {len(flagged)}/{len(state['route_data'])} routes flagged ---")
+    return {"flagged": flagged}
+
+
+async def flag_routes(risks: List[RouteRisk], concurrency: int = FLAG_CONCURRENCY) -> List[str]:
+    """Raises the backend alert for many routes at once, at most `concurrency` requests in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
 
+    async def flag(risk: RouteRisk) -> str:
+        async with semaphore:
+            print(f"🚨 FLAGGING ROUTE: {risk.route_id}")
+            return await asyncio.to_thread(
+                flag_suspicious_route.invoke, {"route_id": risk.route_id, "reason": "; ".join(risk.reasons)}
+            )
 
+    return list(await asyncio.gather(*(flag(risk) for risk in risks)))
+
+
+@traced_node
 async def tool_node(state: SurveillanceState):
     """
-    The Executor: actually calls the function `flag_suspicious_route`.
-    Handles both 'tool_calls' and legacy 'function_call'.
+    The Executor: flags the routes the risk engine selected, up to MAX_FLAGS_PER_SWEEP.
     """
-    last_message = state["messages"][-1]
-    tool_outputs = []
-    
-    # 1. Get the tool calls (Try standard first, then fallback)
-    tool_calls = getattr(last_message, "tool_calls", [])
-    
-    # 2. If empty, check for legacy 'function_call' (The Fix)
-    if not tool_calls and "function_call" in last_message.additional_kwargs:
-        fc = last_message.additional_kwargs["function_call"]
-        # Convert legacy format to modern format manually
-        tool_calls = [{
-            "name": fc["name"],
-            "args": json.loads(fc["arguments"]),
-            "id": "legacy_call" 
-        }]
-
-    # 3. Execute Loop
-    if tool_calls:
-        for tool_call in tool_calls:
-            if tool_call["name"] == "flag_suspicious_route":
-                print(f"🚨 FLAGGING ROUTE: {tool_call['args']['route_id']}")
-                
-                # Since we changed the tool to 'def' (sync), .ainvoke handles the thread automatically.
-                # This is much safer than before.
-                result = await flag_suspicious_route.ainvoke(tool_call)
-                
-                tool_outputs.append(
-                    ToolMessage(
-                        content=str(result),
-                        tool_call_id=tool_call["id"],
-                        name=tool_call["name"]
-                    )
-                )
-    else:
-        print("⚠️ Tool Node ran but found no tool calls to execute!")
-    
-    return {"messages": tool_outputs}
-# --- 5. LOGIC & EDGES ---
+    flagged = state["flagged"]
+    tool_logs = await flag_routes(flagged[:MAX_FLAGS_PER_SWEEP])
+    if len(flagged) > MAX_FLAGS_PER_SWEEP:
+        tool_logs.append(f"SKIPPED {len(flagged) - MAX_FLAGS_PER_SWEEP} routes: flag cap of {MAX_FLAGS_PER_SWEEP} reached")
+    return {"tool_logs": tool_logs}
 
-async def router(state: SurveillanceState):
+
+@traced_node
+async def analyst_node(state: SurveillanceState):
+    """
+    The Brain: writes a short narrative for the flagged routes. It does not decide what gets flagged.
     """
-    Router with Debugging to fix the 'Silent Failure'
+    flagged = state["flagged"]
+    shown = flagged[:NARRATIVE_MAX_ROUTES]
+    prompt_content = f"""
+    You are a route-safety analyst. These routes were flagged by deterministic rules:
+    {json.dumps([r.model_dump() for r in shown])}
+    {f"({len(flagged) - len(shown)} more flagged routes omitted.)" if len(flagged) > len(shown) else ""}
+
+    --- THE SAFETY RUBRIC (Reference) ---
+    [9-10] SAFE (Green): Friendly banter, logistics.
+    [7-8]  CAUTION (Yellow): Rude, weird vibes.
+    [4-6]  UNSAFE (Orange): Harassment, "Stop" ignored, Stalking.
+    [1-3]  DANGER (Red): Threats, SOS, Violence.
+
+    Fields: latest = most recent score, drawdown = fall of the latest score below its recent peak,
+    ewma = smoothed score, cusum = accumulated downward drift.
+
+    Write a brief operator summary: for each route one line on what the trend suggests
+    and how urgent it looks. Do not invent data that is not listed.
     """
-    messages = state["messages"]
-    last_message = messages[-1]
-    
-    # 🔍 DEBUGGING: Print exactly what the Router sees
-    print("\n--- 🧐 ROUTER DIAGNOSTICS ---")
-    print(f"Message Type: {type(last_message)}")
-    print(f"Message Content: {last_message.content[:50]}...") # Print first 50 chars
-    
-    # Check for tool_calls safely
-    tool_calls = getattr(last_message, "tool_calls", [])
-    print(f"Tool Calls Found: {tool_calls}")
-
-    # 1. Check standard tool_calls (New LangChain standard)
-    if tool_calls and len(tool_calls) > 0:
-        print("✅ DECISION: Routing to 'tools' node.")
-        print("-----------------------------\n")
-        return "call_tool"
-    
-    # 2. Safety Fallback: Sometimes Gemini puts it in additional_kwargs (Older style)
-    # This catches cases where tool_calls might be empty but the data exists elsewhere
-    if "function_call" in last_message.additional_kwargs:
-        print("✅ DECISION: Routing to 'tools' node (via fallback).")
-        print("-----------------------------\n")
-        return "call_tool"
-
-    print("🛑 DECISION: Routing to END.")
-    print("-----------------------------\n")
-    return "end"
-
-# ... (Ens
+    first_message = HumanMessage(content=prompt_content)
+    try:
+        response = await guarded_ainvoke(llm, [first_message], site="surveillance_narrative")
+    except Exception as e:
+        print(f"Analyst narrative failed: {e}")
+        response = AIMessage(content="\n".join(f"{r.route_id}: {'; '.join(r.reasons)}" for r in flagged))
+    return {"messages": [first_message, response]}
+
+# --- 5. LOGIC & EDGES ---
+
+def route_after_engine(state: SurveillanceState):
+    return "flag" if state["flagged"] else "clean"
+
+@traced_node
+async def clean_node(state: SurveillanceState):
+    return {"messages": [AIMessage(content="Surveillance Clean")], "tool_logs": []}
+
 workflow = StateGraph(SurveillanceState)
 
-workflow.add_node("analyst", analyst_node)
+workflow.add_node("risk_engine", risk_engine_node)
 workflow.add_node("tools", tool_node)
+workflow.add_node("analyst", analyst_node)
+workflow.add_node("clean", clean_node)
 
-workflow.add_edge(START, "analyst")
+workflow.add_edge(START, "risk_engine")
 
 workflow.add_conditional_edges(
-    "analyst",
-    router,
+    "risk_engine",
+    route_after_engine,
     {
-        "call_tool": "tools",
-        "end": END
+        "flag": "tools",
+        "clean": "clean"
     }
 )
 
-# After tool runs, go back to analyst (to see if more routes need flagging or to finish)
+# Flags are raised before the narrative, so an LLM failure never loses an alert
 workflow.add_edge("tools", "analyst")
+workflow.add_edge("analyst", END)
+workflow.add_edge("clean", END)
 
-surveillance_agent = workflow.compile()
\ No newline at end of file
+surveillance_agent = workflow.compile()
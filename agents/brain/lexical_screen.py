@@ -0,0 +1,198 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+from pydantic import BaseModel
+
+# --- LEXICONS ---
+# DANGER phrases fire the SOS fast path, but only when the rest of the message is
+# nothing but distress filler ("help, he has a knife"). With any other content
+# around them ("he is following me on insta") they go to the LLM instead.
+DANGER_PHRASES = [
+    "call the police", "call police", "call 911", "call 112",
+    "save me", "help me", "somebody help", "someone help", "help help",
+    "someone is following me", "somebody is following me", "he is following me", "being followed",
+    "where are you taking me", "get away from me",
+    "he has a knife", "has a knife", "has a gun", "pulled a gun",
+    "kidnapped", "being kidnapped",
+    "attacking me", "being attacked", "he hit me", "touching me",
+    "i am in danger", "im in danger", "i'm in danger",
+]
+# Words that may surround a DANGER phrase without making it ambiguous
+DISTRESS_FILLERS = {
+    "help", "please", "pls", "plz", "sos", "emergency", "urgent", "now", "quick", "quickly", "hurry",
+    "someone", "somebody", "anyone", "me", "oh", "god", "i'm", "im", "scared", "police",
+}
+# Distress words that are just as often harmless ("let me go get coffee", "call 100 times");
+# always judged by the LLM, never the fast path
+SUSPICIOUS_PHRASES = [
+    "let me go", "call 100", "kidnapping", "rape", "raped", "stalking me", "don't touch me", "dont touch me",
+]
+# A message consisting of nothing but one of these is treated as a plea
+DANGER_WHOLE_MESSAGES = {"help", "help me", "sos", "emergency", "save me", "police"}
+
+HARASSMENT_PHRASES = [
+    "send nudes", "send pics", "send me pics", "i know where you live", "come to my place",
+    "you will regret", "shut up", "bitch", "slut", "whore", "sexy", "hot body",
+    "i'll find you", "ill find you", "watch your back", "stupid", "idiot",
+]
+
+BENIGN_PHRASES = [
+    "ok", "okay", "k", "kk", "okk", "yes", "yeah", "yep", "sure", "cool", "fine", "done", "alright",
+    "on my way", "omw", "coming", "almost there", "nearly there", "be there soon", "wait",
+    "reached", "i reached", "reached home", "i have reached", "i'm here", "im here", "i am here",
+    "reached safely", "home safe", "got home", "i'm home", "im home",
+    "thanks", "thank you", "thx", "ty", "welcome", "no problem", "np",
+    "hi", "hello", "hey", "bye", "good night", "gn", "good morning", "see you", "see ya", "take care",
+    "lol", "haha", "hahaha", "nice", "great", "got it", "noted", "5 min", "2 min", "10 min", "mins", "min",
+]
+
+NEGATORS = {"not", "no", "dont", "don't", "never", "didnt", "didn't", "isnt", "isn't", "wasnt", "wasn't", "nobody"}
+NEGATION_WINDOW = 3
+MAX_BENIGN_TOKENS = 8
+
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("’", "'")
+    text = re.sub(r"[^a-z0-9' ]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class PhraseAutomaton:
+    """
+    Aho-Corasick automaton over normalized phrases.
+    One pass over the message finds every lexicon hit, whatever the number of phrases.
+    """
+
+    def __init__(self, phrases: Iterable[Tuple[str, str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, int]]] = [[]]
+        for phrase, label in phrases:
+            self._add(normalize(phrase), label)
+        self._build()
+
+    def _add(self, phrase: str, label: str):
+        node = 0
+        for ch in phrase:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((label, len(phrase)))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[str, int, int]]:
+        """Returns (label, start, end) for whole-word matches in already-normalized text."""
+        hits = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for label, length in self._out[node]:
+                start, end = i - length + 1, i + 1
+                if (start == 0 or text[start - 1] == " ") and (end == len(text) or text[end] == " "):
+                    hits.append((label, start, end))
+        return hits
+
+
+_automaton = PhraseAutomaton(
+    [(p, "danger") for p in DANGER_PHRASES]
+    + [(p, "suspicious") for p in SUSPICIOUS_PHRASES]
+    + [(p, "harassment") for p in HARASSMENT_PHRASES]
+    + [(p, "benign") for p in BENIGN_PHRASES]
+)
+
+
+class ScreenResult(BaseModel):
+    verdict: str  # BENIGN | EMERGENCY | UNKNOWN
+    reason: str
+    matches: List[str] = []
+
+
+def _is_negated(text: str, start: int) -> bool:
+    preceding = text[:start].split()[-NEGATION_WINDOW:]
+    return any(tok in NEGATORS for tok in preceding)
+
+
+def has_risk_terms(text: str) -> bool:
+    """True if the text contains any non-negated danger, suspicious or harassment phrase."""
+    norm = normalize(text)
+    return any(
+        label in ("danger", "suspicious", "harassment") and not _is_negated(norm, start)
+        for label, start, _ in _automaton.find(norm)
+    )
+
+
+def _only_distress_around(text: str, spans: List[Tuple[int, int]]) -> bool:
+    """True if every word outside the given spans is distress filler."""
+    covered = [False] * len(text)
+    for s, e in spans:
+        covered[s:e] = [True] * (e - s)
+    rest = "".join(" " if c else ch for c, ch in zip(covered, text))
+    return all(tok in DISTRESS_FILLERS for tok in rest.split())
+
+
+def screen_message(message: str, history: Optional[List[str]] = None) -> ScreenResult:
+    """
+    EMERGENCY: a non-negated plea for help with nothing but distress filler around it.
+    BENIGN:    every word is covered by benign phrases and the recent room history is clean.
+    UNKNOWN:   everything else; the LLM analyzers decide.
+    """
+    norm = normalize(message)
+    if not norm:
+        return ScreenResult(verdict="UNKNOWN", reason="Empty message")
+
+    if norm in DANGER_WHOLE_MESSAGES:
+        return ScreenResult(verdict="EMERGENCY", reason=f"Explicit plea: '{norm}'", matches=[norm])
+
+    hits = _automaton.find(norm)
+    danger = [(s, e) for label, s, e in hits if label == "danger" and not _is_negated(norm, s)]
+    negated = [norm[s:e] for label, s, e in hits if label in ("danger", "suspicious") and _is_negated(norm, s)]
+    suspicious = [norm[s:e] for label, s, e in hits if label == "suspicious" and not _is_negated(norm, s)]
+    harassment = [norm[s:e] for label, s, e in hits if label == "harassment"]
+
+    if danger and _only_distress_around(norm, danger):
+        return ScreenResult(verdict="EMERGENCY", reason="Unambiguous danger phrase", matches=[norm[s:e] for s, e in danger])
+    if danger or suspicious:
+        return ScreenResult(
+            verdict="UNKNOWN", reason="Danger phrase in context", matches=[norm[s:e] for s, e in danger] + suspicious
+        )
+    if harassment or negated:
+        return ScreenResult(verdict="UNKNOWN", reason="Needs context", matches=harassment + negated)
+
+    tokens = norm.split()
+    if len(tokens) > MAX_BENIGN_TOKENS:
+        return ScreenResult(verdict="UNKNOWN", reason="Too long for the fast path")
+
+    covered = [False] * len(norm)
+    for label, s, e in hits:
+        if label == "benign":
+            covered[s:e] = [True] * (e - s)
+    fully_covered = all(c or ch == " " for c, ch in zip(covered, norm))
+    if not fully_covered:
+        return ScreenResult(verdict="UNKNOWN", reason="Not a routine phrase")
+
+    if history and any(has_risk_terms(h) for h in history):
+        return ScreenResult(verdict="UNKNOWN", reason="Room history has risk terms")
+
+    return ScreenResult(
+        verdict="BENIGN",
+        reason="Routine message",
+        matches=[norm[s:e] for label, s, e in hits if label == "benign"],
+    )
@@ -5,13 +5,26 @@ from PIL import Image
 from io import BytesIO
 from dotenv import load_dotenv
 from datetime import datetime, timezone
-from typing import Literal
+from typing import List, Literal, Optional, Tuple
+import numpy as np
 from langgraph.graph import StateGraph, START, END
 from state import AgentState
+from visual_index import Match, visual_index, compute_fingerprint, distance_m
+from outbox import report_outbox, new_outbox_key, derive_outbox_key, OUTBOX_ENABLED
+from report_artifacts import report_artifacts, ARTIFACT_CATEGORIES
+from models import MODEL_PRICES, MODEL_TIERS
+from circuit_breaker import llm_breaker
+from tracing import traced_node, tracer
 
 load_dotenv()
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:3000")
 TIMEOUT = 10
+# Cosine similarity bands for the local fingerprint check. Anything in between goes to Gemini.
+FINGERPRINT_DUPLICATE_SCORE = float(os.getenv("FINGERPRINT_DUPLICATE_SCORE", "0.92"))
+FINGERPRINT_DISTINCT_SCORE = float(os.getenv("FINGERPRINT_DISTINCT_SCORE", "0.50"))
+# An index match other than the backend's candidate is only a duplicate within this distance
+FINGERPRINT_MATCH_RADIUS_M = float(os.getenv("FINGERPRINT_MATCH_RADIUS_M", "100"))
+FINGERPRINT_SEARCH_K = 5
 
 if not os.getenv("GOOGLE_API_KEY"):
     raise ValueError("GOOGLE_API_KEY not found!")
@@ -26,17 +39,77 @@ def load_image_from_url(url: str) -> Image.Image:
     except Exception as e:
         print(f"Failed to load Cloudinary image from {url}: {e}")
         return None
-def verify_image_similarity(new_image_url: str, existing_image_url: str) -> bool:
+def fingerprint_image(img: Image.Image):
+    """Fingerprint as a plain list so it can live in the graph state."""
+    if img is None:
+        return None
+    try:
+        return compute_fingerprint(img).tolist()
+    except Exception as e:
+        print(f"Fingerprinting failed: {e}")
+        return None
+def location_of(state: AgentState) -> Optional[Tuple[float, float]]:
+    loc = state.get("location")
+    loc = loc.dict() if hasattr(loc, "dict") else loc
+    try:
+        return float(loc["lat"]), float(loc["lng"])
+    except (TypeError, KeyError, ValueError):
+        return None
+def visual_matches(fingerprint, geohash: str, category, location: Optional[Tuple[float, float]]) -> List[Match]:
+    """
+    Nearest indexed reports to the new image in its geohash cell and the 8 around it,
+    best first, above the distinct band. Matches that are known to be farther than
+    FINGERPRINT_MATCH_RADIUS_M are dropped.
+    """
+    if fingerprint is None:
+        return []
+    try:
+        matches = visual_index.search(
+            np.asarray(fingerprint, dtype=np.float32), geohash, category,
+            k=FINGERPRINT_SEARCH_K, min_score=FINGERPRINT_DISTINCT_SCORE,
+        )
+    except Exception as e:
+        print(f"Visual index search failed: {e}")
+        return []
+    if location is not None:
+        matches = [
+            m for m in matches
+            if np.isnan(m.lat) or distance_m(location[0], location[1], m.lat, m.lng) <= FINGERPRINT_MATCH_RADIUS_M
+        ]
+    return matches
+def fingerprint_verdict(fingerprint, report_id: str, geohash: str, category, matches: List[Match]) -> Optional[bool]:
+    """
+    Scores the new image against the backend's candidate report.
+    Returns True/False when the score is decisive, None when Gemini should decide.
+    """
+    if fingerprint is None or not report_id:
+        return None
+    score = next((m.score for m in matches if m.report_id == report_id), None)
+    if score is None:
+        existing = visual_index.get(report_id, geohash, category)
+        if existing is None:
+            return None
+        score = float(np.dot(existing, np.asarray(fingerprint, dtype=np.float32)))
+    print(f"Fingerprint similarity with {report_id}: {score:.3f}")
+    if score >= FINGERPRINT_DUPLICATE_SCORE:
+        return True
+    if score <= FINGERPRINT_DISTINCT_SCORE:
+        return False
+    return None
+def verify_image_similarity(new_image_url: str, existing_image_url: str, img_new: Image.Image = None) -> bool:
     """Uses Gemini to compare visual similarity between two report images."""
     if not new_image_url or not existing_image_url:
         return False
+    if llm_breaker.degraded:
+        print("Image similarity check skipped: LLM circuit open. Saving as new.")
+        return False
     try:
-        img_new = load_image_from_url(new_image_url)
+        img_new = img_new or load_image_from_url(new_image_url)
         img_existing = load_image_from_url(existing_image_url)
 
         if not img_new or not img_existing:
             return False
-        model = genai.GenerativeModel('gemini-2.0-flash')
+        model = genai.GenerativeModel(MODEL_TIERS["flash"])
         prompt = (
             "You are an expert civic issue surveyor. "
             "Compare these two images. Image 1 is a new report, Image 2 is an existing database record. "
@@ -45,7 +118,13 @@ def verify_image_similarity(new_image_url: str, existing_image_url: str) -> bool
             "Return ONLY the word 'TRUE' if they are the same, or 'FALSE' if different."
         )
 
-        response = model.generate_content([prompt, img_new, img_existing])
+        with tracer.span("LLM duplicate_check", kind="client", **{"llm.site": "duplicate_check", "llm.tier": "flash"}) as span:
+            response = model.generate_content([prompt, img_new, img_existing])
+            usage = getattr(response, "usage_metadata", None)
+            tracer.record_llm(span, MODEL_TIERS["flash"], {
+                "input_tokens": getattr(usage, "prompt_token_count", 0),
+                "output_tokens": getattr(usage, "candidates_token_count", 0),
+            }, MODEL_PRICES["flash"])
         result = response.text.strip().upper()
         print(f"Similarity Check Result: {result}")
         return "TRUE" in result
@@ -55,6 +134,7 @@ def verify_image_similarity(new_image_url: str, existing_image_url: str) -> bool
 
 # --- Nodes ---
 
+@traced_node
 def locality_check_agent(state: AgentState):
     """
     Checks if a report is a duplicate using Geohash + Visual Verification.
@@ -75,6 +155,16 @@ def locality_check_agent(state: AgentState):
         print("Tool used is save, and endpoint not found ")
         return {"tool": "SAVE"}
 
+    img_new = load_image_from_url(state.get("imageUrl"))
+    fingerprint = fingerprint_image(img_new)
+    if category in ARTIFACT_CATEGORIES:
+        # Thumbnail while the image is in memory; persisted once the report is saved
+        report_artifacts.stage_thumbnail(state.get("imageUrl"), img_new)
+
+    # Visually nearest reports around the new one, independent of the backend's single candidate
+    matches = visual_matches(fingerprint, state.get("geohash"), category, location_of(state))
+    match = matches[0] if matches and matches[0].score >= FINGERPRINT_DUPLICATE_SCORE else None
+
     try:
         url = f"{BACKEND_URL}{endpoint_path}"
         loc = state.get("location")
@@ -90,36 +180,78 @@ def locality_check_agent(state: AgentState):
         data = response.json()
         print("data", data)
 
-        if data.get("duplicateFound") is True:
-            # ✅ FIX: Define variable FIRST
-            report_data = data.get("data", {}) 
-            
-            # ✅ FIX: Then print it
-            print(f"report data: {report_data}") 
-
-            existing_backend_url = report_data.get("imageUrl")
-            current_user_url = state.get("imageUrl")
-            
-            # Visual Verification
-            if verify_image_similarity(current_user_url, existing_backend_url):
-                print("Duplicate confirmed via visual check.")
-                return {
-                    "tool": "UPDATE",
-                    "locality_imageUrl": existing_backend_url,
-                    "locality_userId": report_data.get("userId"),
-                    "locality_email": report_data.get("locality_email"),
-                    "locality_reportId": report_data.get("reportId")
-                }
-            else:
-                print("Visual check failed (images different). Saving as new.")
-                return {"tool": "SAVE", "locality_imageUrl": None, "locality_userId": None}
-
-        print("No duplicate found by Geohash.")
-        return {"tool": "SAVE", "locality_imageUrl": None, "locality_userId": None}
+        report_data = data.get("data", {}) if data.get("duplicateFound") is True else {}
+        if report_data:
+            print(f"report data: {report_data}")
+            if match is None or match.report_id == report_data.get("reportId"):
+                # Visual Verification: local fingerprint first, Gemini only when ambiguous
+                is_duplicate = fingerprint_verdict(
+                    fingerprint, report_data.get("reportId"), state.get("geohash"), category, matches
+                )
+                if is_duplicate is None:
+                    is_duplicate = verify_image_similarity(state.get("imageUrl"), report_data.get("imageUrl"), img_new)
+                if is_duplicate:
+                    print("Duplicate confirmed via visual check.")
+                    return duplicate_of(report_data, fingerprint)
+                if match is None:
+                    print("Visual check failed (images different). Saving as new.")
+                    return {"tool": "SAVE", "locality_imageUrl": None, "locality_userId": None, "image_fingerprint": fingerprint}
+        else:
+            print("No duplicate found by Geohash.")
+    except Exception as e:
+        print(f"Locality check failed with error: {e}.")
 
+    if match is not None and match.user_id and match.email and match.geohash:
+        print(f"Duplicate found via visual index: {match.report_id} (score {match.score:.3f})")
+        return duplicate_of({
+            "reportId": match.report_id, "userId": match.user_id,
+            "locality_email": match.email, "geohash": match.geohash,
+        }, fingerprint)
+    return {"tool": "SAVE", "locality_imageUrl": None, "locality_userId": None, "image_fingerprint": fingerprint}
+def duplicate_of(report_data: dict, fingerprint) -> dict:
+    return {
+        "tool": "UPDATE",
+        "locality_imageUrl": report_data.get("imageUrl"),
+        "locality_userId": report_data.get("userId"),
+        "locality_email": report_data.get("locality_email"),
+        "locality_reportId": report_data.get("reportId"),
+        "locality_geohash": report_data.get("geohash"),
+        "image_fingerprint": fingerprint
+    }
+def index_report_image(state: AgentState, report_id: str):
+    """Adds a saved report's image fingerprint to the local visual index."""
+    fingerprint = state.get("image_fingerprint")
+    if fingerprint is None:
+        fingerprint = fingerprint_image(load_image_from_url(state.get("imageUrl")))
+    if fingerprint is None or not report_id:
+        return
+    try:
+        visual_index.add(
+            report_id,
+            np.asarray(fingerprint, dtype=np.float32),
+            state.get("geohash"),
+            state.get("assigned_category"),
+            user_id=state.get("userId"),
+            email=state.get("email"),
+            location=location_of(state),
+        )
     except Exception as e:
-        print(f"Locality check failed with error: {e}. Defaulting to SAVE.")
-        return {"tool": "SAVE"}
+        print(f"Visual index insert failed for {report_id}: {e}")
+def save_report_artifact(state: AgentState, report_id: str, analysis):
+    """Keeps the thumbnail, fingerprint and analysis for reuse when the report is resolved."""
+    if state.get("assigned_category") not in ARTIFACT_CATEGORIES:
+        return
+    try:
+        report_artifacts.save(
+            state.get("imageUrl"),
+            report_id,
+            state.get("assigned_category"),
+            fingerprint=state.get("image_fingerprint"),
+            analysis=analysis,
+        )
+    except Exception as e:
+        print(f"Report artifact write failed for {report_id}: {e}")
+@traced_node
 def save_report_tool(state: AgentState):
     """Creates a NEW report in the database."""
     print("--- Save Report Node ---")
@@ -173,17 +305,29 @@ def save_report_tool(state: AgentState):
 
         }
 
+        if OUTBOX_ENABLED:
+            # The backend uses the outbox key as the document id, so the reportId is known now.
+            # Reusing the request's idempotency key means a retried /reports call maps to the same document.
+            report_id = report_outbox.enqueue("save", url, payload, key=state.get("idempotencyKey") or new_outbox_key())
+            print(f"Report QUEUED for delivery: {report_id}")
+            index_report_image(state, report_id)
+            save_report_artifact(state, report_id, current_analysis)
+            return {"status": "VERIFIED", "reportId": report_id}
+
         response = requests.post(url, json=payload, timeout=TIMEOUT)
         response.raise_for_status()
         data = response.json()
         report_id = data.get("reportId") or data.get("id")
         
         print(f"Report SAVED successfully: {report_id}")
+        index_report_image(state, report_id)
+        save_report_artifact(state, report_id, current_analysis)
         return {"status": "VERIFIED", "reportId": report_id}
     except Exception as e:
         print(f"Failed to SAVE report to {url}: {e}")
         return {"status": "FAILED"}
 
+@traced_node
 def update_report_tool(state: AgentState):
     """Updates an EXISTING report in the database."""
     print("--- Update Report Node ---")
@@ -208,10 +352,20 @@ def update_report_tool(state: AgentState):
             "userId": state.get("locality_userId"),
             "reportId": state.get("locality_reportId"),
             "updatedAt": current_time,
-            "geohash": state.get("geohash")
+            # The existing report may sit in a neighbouring geohash cell
+            "geohash": state.get("locality_geohash") or state.get("geohash")
         }
+
+        # One upvote per (existing report, submission): the submission's own key tells
+        # two reporters of the same spot apart, while a retry of one maps to the same key
+        key = derive_outbox_key("update", payload["reportId"], payload, state.get("idempotencyKey"))
+
+        if OUTBOX_ENABLED:
+            report_outbox.enqueue("update", url, payload, key=key)
+            print(f"Report update QUEUED for delivery: {state.get('locality_reportId')}")
+            return {"status": "VERIFIED", "reportId": state.get("locality_reportId")}
         
-        response = requests.post(url, json=payload, timeout=TIMEOUT)
+        response = requests.post(url, json={**payload, "idempotencyKey": key}, timeout=TIMEOUT)
         response.raise_for_status()
         data = response.json()
         report_id = data.get("reportId") or data.get("id")
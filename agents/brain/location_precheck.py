@@ -0,0 +1,162 @@
+import os
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from visual_index import compute_fingerprint
+
+# --- CONFIG ---
+PRECHECK_ENABLED = os.getenv("WASTE_PRECHECK", "1") == "1"
+# A proof photo this similar to the report photo shows the scene unchanged (typically the
+# report photo re-uploaded), so it is settled without an LLM call. Measured on real photos:
+# re-encoded/resized/brightened copies score ~0.997, a 3% zoom of the same scene already
+# ~0.48 and unrelated scenes < 0.12.
+PRECHECK_UNCHANGED_ABOVE = float(os.getenv("WASTE_PRECHECK_UNCHANGED_ABOVE", "0.95"))
+# Location check: ORB keypoints on both photos (longest side KEYPOINT_SIDE, the size of the
+# stored thumbnail), ratio-tested matches, then a RANSAC homography. Measured on real photos:
+# unrelated scenes leave 0-6 chance inliers; the same scene zoomed up to 40%, re-angled,
+# rotated, darkened, blurred or with the pile painted out keeps >= 47. Only pairs at or below
+# MISMATCH_MAX_INLIERS are rejected locally.
+KEYPOINT_SIDE = 384
+ORB_FEATURES = 1000
+MATCH_RATIO = 0.75
+RANSAC_REPROJ_PX = 5.0
+MISMATCH_MAX_INLIERS = int(os.getenv("WASTE_PRECHECK_MISMATCH_MAX_INLIERS", "8"))
+# Inliers that count as a full match for the reported 0-1 score
+FULL_MATCH_INLIERS = 50
+# Fewer keypoints than this (a blank wall, a dark frame) says nothing about the location
+MIN_KEYPOINTS = 100
+# The report's stored fingerprint rules most pairs out before its image is even loaded:
+# copies of a photo score >= 0.999 against it, a 10% zoom ~0.89, a changed centre < 0.3
+FINGERPRINT_GATE = float(os.getenv("WASTE_PRECHECK_FINGERPRINT_GATE", "0.98"))
+SIZE = (128, 96)
+WINDOW = 7
+# Small offsets between the two photos are tolerated
+MAX_SHIFT = 6
+SHIFT_STEP = 3
+_C1 = (0.01) ** 2
+_C2 = (0.03) ** 2
+
+
+def _prepare(img: Image.Image) -> np.ndarray:
+    """Grayscale, downscaled, gradient magnitude normalised to [0, 1]."""
+    img = ImageOps.exif_transpose(img).convert("L")
+    if img.width < img.height:
+        img = img.rotate(90, expand=True)
+    gray = np.asarray(img.resize(SIZE, Image.BILINEAR), dtype=np.float64) / 255.0
+    gy, gx = np.gradient(gray)
+    mag = np.hypot(gx, gy)
+    peak = mag.max()
+    return mag / peak if peak > 0 else mag
+
+
+def _box_mean(x: np.ndarray) -> np.ndarray:
+    """Mean over WINDOW x WINDOW blocks ('valid' positions) via a summed-area table."""
+    s = np.pad(x, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    w = WINDOW
+    return (s[w:, w:] - s[:-w, w:] - s[w:, :-w] + s[:-w, :-w]) / (w * w)
+
+
+def _ssim_map(a: np.ndarray, b: np.ndarray):
+    """SSIM per window, and which windows carry structure in at least one image."""
+    mu_a, mu_b = _box_mean(a), _box_mean(b)
+    var_a = _box_mean(a * a) - mu_a ** 2
+    var_b = _box_mean(b * b) - mu_b ** 2
+    cov = _box_mean(a * b) - mu_a * mu_b
+    ssim = ((2 * mu_a * mu_b + _C1) * (2 * cov + _C2)) / ((mu_a ** 2 + mu_b ** 2 + _C1) * (var_a + var_b + _C2))
+    # Flat-vs-flat windows score ~1 from the constants alone and would mask a mismatch
+    return ssim, (var_a + var_b) > _C2
+
+
+def scene_similarity(before: Image.Image, after: Image.Image) -> Optional[float]:
+    """
+    Structural similarity of the edge structure over the whole frame, best over
+    small shifts. ~1 for the same photo, well below for anything else.
+    None when neither image has any usable structure.
+    """
+    a, b = _prepare(before), _prepare(after)
+    m = MAX_SHIFT
+    core = a[m:-m, m:-m]
+    best = None
+    for dy in range(-m, m + 1, SHIFT_STEP):
+        for dx in range(-m, m + 1, SHIFT_STEP):
+            shifted = b[m + dy:b.shape[0] - m + dy, m + dx:b.shape[1] - m + dx]
+            ssim, textured = _ssim_map(core, shifted)
+            if textured.any():
+                score = float(ssim[textured].mean())
+                best = score if best is None else max(best, score)
+    return None if best is None else round(max(0.0, best), 4)
+
+
+class Precheck(NamedTuple):
+    score: Optional[float] = None    # keypoint agreement in [0, 1]; None when undecidable
+    inliers: Optional[int] = None
+    unchanged: bool = False          # the proof photo is the report photo again
+
+
+_orb = cv2.ORB_create(nfeatures=ORB_FEATURES, fastThreshold=10)
+_matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+
+def _keypoints(img: Image.Image):
+    img = ImageOps.exif_transpose(img).convert("L")
+    img.thumbnail((KEYPOINT_SIDE, KEYPOINT_SIDE), Image.BILINEAR)
+    return _orb.detectAndCompute(np.asarray(img), None)
+
+
+def keypoint_inliers(before: Image.Image, after: Image.Image) -> Optional[int]:
+    """
+    Matches that agree on one homography between the two photos.
+    None when either photo has too little texture to tell.
+    """
+    kp_a, des_a = _keypoints(before)
+    kp_b, des_b = _keypoints(after)
+    if des_a is None or des_b is None or min(len(kp_a), len(kp_b)) < MIN_KEYPOINTS:
+        return None
+    good = [
+        pair[0] for pair in _matcher.knnMatch(des_a, des_b, k=2)
+        if len(pair) == 2 and pair[0].distance < MATCH_RATIO * pair[1].distance
+    ]
+    if len(good) < 4:
+        return 0
+    src = np.float32([kp_a[m.queryIdx].pt for m in good])
+    dst = np.float32([kp_b[m.trainIdx].pt for m in good])
+    _, mask = cv2.findHomography(src, dst, cv2.RANSAC, RANSAC_REPROJ_PX)
+    return int(mask.sum()) if mask is not None else 0
+
+
+def precheck_location(before: Optional[Image.Image], after: Optional[Image.Image],
+                      check_unchanged: bool = True) -> Precheck:
+    """
+    Location score for the pair and, unless `check_unchanged` is False, whether the
+    proof photo is a re-upload. Empty when the precheck is off or an image is unavailable.
+    """
+    if not PRECHECK_ENABLED or before is None or after is None:
+        return Precheck()
+    try:
+        inliers = keypoint_inliers(before, after)
+        score = None if inliers is None else round(min(1.0, inliers / FULL_MATCH_INLIERS), 4)
+        similarity = scene_similarity(before, after) if check_unchanged else None
+        return Precheck(score, inliers, similarity is not None and similarity >= PRECHECK_UNCHANGED_ABOVE)
+    except Exception as e:
+        print(f"Location precheck failed: {e}")
+        return Precheck()
+
+
+def fingerprint_rules_out(fingerprint, after: Optional[Image.Image]) -> bool:
+    """True if the proof photo's fingerprint is too far from the report's to be the same photo."""
+    if not PRECHECK_ENABLED or fingerprint is None or after is None:
+        return False
+    try:
+        similarity = float(np.dot(np.asarray(fingerprint, dtype=np.float32), compute_fingerprint(after)))
+    except Exception as e:
+        print(f"Fingerprint precheck failed: {e}")
+        return False
+    return similarity < FINGERPRINT_GATE
+
+
+def is_clear_mismatch(check: Precheck) -> bool:
+    """Only photos with (almost) no geometrically consistent matches are rejected locally."""
+    return check.inliers is not None and check.inliers <= MISMATCH_MAX_INLIERS
@@ -0,0 +1,93 @@
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from metrics import metrics
+
+FILL_BUCKETS = [0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+
+
+class MicroBatcher:
+    """
+    Collects concurrent submissions for up to `max_wait` seconds (or until
+    `max_size` are pending) and scores them with one `flush` call.
+    `flush` gets [(id, item)] and returns {id: result}; items it leaves out,
+    or all items if it raises, are retried one by one with `fallback`.
+    A batch of one goes straight to `fallback`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[List[Tuple[str, Any]]], Awaitable[Dict[str, Any]]],
+        fallback: Callable[[Any], Awaitable[Any]],
+        max_size: int = 16,
+        max_wait: float = 0.005,
+    ):
+        self.name = name
+        self.flush = flush
+        self.fallback = fallback
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self._ids = itertools.count()
+        self._pending: List[Tuple[str, Any, asyncio.Future]] = []
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((str(next(self._ids)), item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush_now)
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # Submitters that were cancelled while waiting need no result
+        batch = [entry for entry in batch if not entry[2].done()]
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, Any, asyncio.Future]]):
+        metrics.observe(f"{self.name}_batch_size", len(batch), SIZE_BUCKETS)
+        metrics.observe(f"{self.name}_batch_fill", len(batch) / self.max_size, FILL_BUCKETS)
+
+        results: Dict[str, Any] = {}
+        if len(batch) > 1:
+            try:
+                results = await self.flush([(item_id, item) for item_id, item, _ in batch])
+                metrics.inc(f"{self.name}_batch_calls")
+            except Exception as e:
+                print(f"{self.name} batch of {len(batch)} failed, scoring individually: {e}")
+                metrics.inc(f"{self.name}_batch_errors")
+
+        missing = []
+        for item_id, item, future in batch:
+            if item_id in results:
+                if not future.done():
+                    future.set_result(results[item_id])
+            else:
+                missing.append((item, future))
+        if len(batch) > 1 and missing:
+            metrics.inc(f"{self.name}_batch_fallbacks", len(missing))
+
+        async def _single(item, future):
+            try:
+                result = await self.fallback(item)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        await asyncio.gather(*(_single(item, future) for item, future in missing if not future.done()))
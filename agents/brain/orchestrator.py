@@ -5,31 +5,49 @@ from brain.electric_agent import electric_agent_node
 from brain.waste_agent import waste_agent_node
 from brain.water_agent import water_agent_node
 from brain.infra_agent import infra_agent_node
-from brain.finalizer import finalizer_node
+from brain.finalizer import finalizer_node, degraded_verdict
+from circuit_breaker import llm_breaker
 
 from brain.locality_check_agent import locality_submission_graph
+from tracing import traced_node
+
+@traced_node
 def run_submission_process(state: AgentState):
     """
     Wrapper to invoke the compiled locality/submission subgraph.
     This encapsulates the entire Locality Check -> Save/Update logic.
     """
     return locality_submission_graph.invoke(state)
-orchestrator_builder = StateGraph(AgentState)
-orchestrator_builder.add_node("electric_agent", electric_agent_node)
-orchestrator_builder.add_node("waste_agent", waste_agent_node)
-orchestrator_builder.add_node("water_agent", water_agent_node)
-orchestrator_builder.add_node("infra_agent", infra_agent_node)
-orchestrator_builder.add_node("finalizer", finalizer_node)
-orchestrator_builder.add_node("submission_process", run_submission_process)
-orchestrator_builder.add_edge(START, "electric_agent")
-orchestrator_builder.add_edge(START, "waste_agent")
-orchestrator_builder.add_edge(START, "water_agent")
-orchestrator_builder.add_edge(START, "infra_agent")
-orchestrator_builder.add_edge("electric_agent", "finalizer")
-orchestrator_builder.add_edge("waste_agent", "finalizer")
-orchestrator_builder.add_edge("water_agent", "finalizer")
-orchestrator_builder.add_edge("infra_agent", "finalizer")
-orchestrator_builder.add_edge("finalizer", "submission_process")
-orchestrator_builder.add_edge("submission_process", END)
+SPECIALISTS = ["electric_agent", "waste_agent", "water_agent", "infra_agent"]
+def route_start(state: AgentState):
+    """While the LLM circuit is open, classification is skipped and the report is saved as UNCERTAIN."""
+    return ["degraded_finalizer"] if llm_breaker.degraded else SPECIALISTS
+def build_orchestrator(include_submission: bool = True):
+    """
+    Specialists -> Judge, optionally followed by the Locality Check -> Save/Update stage.
+    Without submission the graph only classifies, which is what offline reclassification needs.
+    """
+    orchestrator_builder = StateGraph(AgentState)
+    orchestrator_builder.add_node("electric_agent", electric_agent_node)
+    orchestrator_builder.add_node("waste_agent", waste_agent_node)
+    orchestrator_builder.add_node("water_agent", water_agent_node)
+    orchestrator_builder.add_node("infra_agent", infra_agent_node)
+    orchestrator_builder.add_node("finalizer", finalizer_node)
+    orchestrator_builder.add_node("degraded_finalizer", degraded_verdict)
+    orchestrator_builder.add_conditional_edges(START, route_start, SPECIALISTS + ["degraded_finalizer"])
+    orchestrator_builder.add_edge("electric_agent", "finalizer")
+    orchestrator_builder.add_edge("waste_agent", "finalizer")
+    orchestrator_builder.add_edge("water_agent", "finalizer")
+    orchestrator_builder.add_edge("infra_agent", "finalizer")
+    if include_submission:
+        orchestrator_builder.add_node("submission_process", run_submission_process)
+        orchestrator_builder.add_edge("finalizer", "submission_process")
+        orchestrator_builder.add_edge("degraded_finalizer", "submission_process")
+        orchestrator_builder.add_edge("submission_process", END)
+    else:
+        orchestrator_builder.add_edge("finalizer", END)
+        orchestrator_builder.add_edge("degraded_finalizer", END)
+    return orchestrator_builder.compile()
 
-app = orchestrator_builder.compile()
\ No newline at end of file
+app = build_orchestrator()
+classification_app = build_orchestrator(include_submission=False)
@@ -1,11 +1,19 @@
 import os
-from typing import Optional
+import asyncio
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel, Field
-from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
 from langgraph.graph import END, START, StateGraph
 from langchain_core.messages import HumanMessage
+from brain.location_precheck import Precheck, fingerprint_rules_out, precheck_location, is_clear_mismatch
+from brain.locality_check_agent import load_image_from_url
+from report_artifacts import report_artifacts
+from metrics import metrics
+from models import Cascade, in_ambiguous_band
+from tracing import traced_node
 load_dotenv()
+# Use the fingerprint and thumbnail stored at submission
+USE_ARTIFACTS = os.getenv("WASTE_RESOLVE_USE_ARTIFACTS", "1") == "1"
 if not os.getenv("GOOGLE_API_KEY"):
     raise ValueError("Google API Key is not found")
 
@@ -22,40 +30,156 @@ class GraphState(BaseModel):
     staffimageUrl: str = Field(description="URL of the resolved proof (After)")
     
     confidence_result: Optional[EvaluationSchema] = Field(default=None, description="The evaluation result")
+    precheck_score: Optional[float] = Field(default=None, description="Local location-match score (0-1)")
 
-flash_model = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0, 
-    max_retries=2,
+def is_decisive(result: EvaluationSchema) -> bool:
+    return not in_ambiguous_band(result.confidence)
+
+structured_llm = Cascade("waste_resolution", EvaluationSchema, accept=is_decisive)
+
+RESOLUTION_INSTRUCTIONS = (
+    "You are a Senior Waste Management Analyzer. Compare these two images.\n"
+    "Image 1: Reported Waste (Before)\n"
+    "Image 2: Staff Resolution (After)\n\n"
+    "Task:\n"
+    "1. Verify if the LOCATION is the same (check walls, ground, background objects).\n"
+    "2. Verify if the WASTE is gone.\n\n"
+    "Return a high confidence score (near 1.0) only if the location matches AND waste is cleared."
 )
-structured_llm = flash_model.with_structured_output(EvaluationSchema)
 
-async def finalizer(state: GraphState):
-    """Compare the user uploaded waste image and the staff uploaded resolved image"""
-    
-    user_image_url = state.imageUrl
-    staff_image_url = state.staffimageUrl
-    message = HumanMessage(
-        content=[
-            {
-                "type": "text",
-                "text": (
-                    "You are a Senior Waste Management Analyzer. Compare these two images.\n"
-                    "Image 1: Reported Waste (Before)\n"
-                    "Image 2: Staff Resolution (After)\n\n"
-                    "Task:\n"
-                    "1. Verify if the LOCATION is the same (check walls, ground, background objects).\n"
-                    "2. Verify if the WASTE is gone.\n\n"
-                    "Return a high confidence score (near 1.0) only if the location matches AND waste is cleared."
-                ),
-            },
-            {"type": "image_url", "image_url": {"url": user_image_url}},
+class PairEvaluation(EvaluationSchema):
+    id: str = Field(description="The pair id, copied exactly from the input")
+
+class BatchEvaluation(BaseModel):
+    items: List[PairEvaluation]
+
+# A whole batch is never escalated; its undecided pairs are re-verified one by one on the stronger tier
+batch_structured_llm = Cascade("waste_resolution", BatchEvaluation)
+
+def before_image_content(user_image_url: str, label: str) -> List[dict]:
+    """
+    Content parts for Image 1: the thumbnail stored at submission, inlined, so the
+    model fetches only the proof photo. Falls back to the report URL without an artifact.
+    """
+    data_url = report_artifacts.thumbnail_data_url(user_image_url) if USE_ARTIFACTS else None
+    metrics.inc("waste_artifact_hits" if data_url else "waste_artifact_misses")
+    return [{"type": "text", "text": label}, {"type": "image_url", "image_url": {"url": data_url or user_image_url}}]
+
+def count_remote_images(content: List[dict], pairs: int):
+    """Remote image URLs the model has to fetch, per verified pair (1.0 when every report image is inlined)."""
+    remote = sum(
+        1 for part in content
+        if part.get("type") == "image_url" and not part["image_url"]["url"].startswith("data:")
+    )
+    metrics.inc("waste_remote_images", remote)
+    metrics.observe("waste_remote_images_per_pair", remote / max(pairs, 1), [1, 1.5, 2])
+
+async def verify_resolution(user_image_url: str, staff_image_url: str, start: int = 0) -> EvaluationSchema:
+    """One before/after comparison, from cascade tier `start`. Raises on failure."""
+    content = [
+        {"type": "text", "text": RESOLUTION_INSTRUCTIONS},
+        *before_image_content(user_image_url, "Image 1 (Before):"),
+        {"type": "text", "text": "Image 2 (After):"},
+        {"type": "image_url", "image_url": {"url": staff_image_url}},
+    ]
+    count_remote_images(content, 1)
+    message = HumanMessage(content=content)
+    return await structured_llm.ainvoke([message], start=start)
+
+async def verify_resolutions(pairs: List[Tuple[str, str, str]]) -> Dict[str, EvaluationSchema]:
+    """
+    Several (id, before, after) pairs in one structured request. Pairs the model
+    leaves out are missing from the result; callers verify those individually.
+    """
+    content = [{
+        "type": "text",
+        "text": (
+            f"{RESOLUTION_INSTRUCTIONS}\n\n"
+            f"Below are {len(pairs)} INDEPENDENT pairs, each with its own id. "
+            "Evaluate every pair on its own and return one result per pair with the id copied exactly."
+        ),
+    }]
+    for pair_id, user_image_url, staff_image_url in pairs:
+        content += [
+            *before_image_content(user_image_url, f"PAIR id=\"{pair_id}\" - Image 1 (Before):"),
+            {"type": "text", "text": f"PAIR id=\"{pair_id}\" - Image 2 (After):"},
             {"type": "image_url", "image_url": {"url": staff_image_url}},
         ]
+    count_remote_images(content, len(pairs))
+    response = await batch_structured_llm.ainvoke([HumanMessage(content=content)])
+    wanted = {pair_id: (before, after) for pair_id, before, after in pairs}
+    results = {
+        item.id: EvaluationSchema(confidence=item.confidence, reasoning=item.reasoning)
+        for item in response.items if item.id in wanted
+    }
+    undecided = [pair_id for pair_id, result in results.items() if not is_decisive(result)]
+    if undecided and len(structured_llm.tiers) > 1:
+        metrics.inc("waste_batch_escalations", len(undecided))
+        rechecked = await asyncio.gather(
+            *(verify_resolution(*wanted[pair_id], start=1) for pair_id in undecided),
+            return_exceptions=True,
+        )
+        results.update(
+            (pair_id, result) for pair_id, result in zip(undecided, rechecked) if not isinstance(result, Exception)
+        )
+    return results
+
+async def precheck_pair(user_image_url: str, staff_image_url: str) -> Precheck:
+    """
+    Local checks for a pair: the keypoint location score (stored thumbnail against the
+    downscaled proof photo) and whether the proof is a re-upload of the report photo.
+    The re-upload check is skipped when the stored fingerprint already rules it out.
+    """
+    artifact = report_artifacts.load(user_image_url) if USE_ARTIFACTS else None
+    after = await asyncio.to_thread(load_image_from_url, staff_image_url)
+    check_unchanged = True
+    if artifact is not None and await asyncio.to_thread(fingerprint_rules_out, artifact.fingerprint, after):
+        metrics.inc("waste_precheck_fingerprint_skips")
+        check_unchanged = False
+    before = await asyncio.to_thread(
+        lambda: (report_artifacts.thumbnail_image(user_image_url) if artifact else None) or load_image_from_url(user_image_url)
+    )
+    return await asyncio.to_thread(precheck_location, before, after, check_unchanged)
+
+def unchanged_result() -> EvaluationSchema:
+    return EvaluationSchema(
+        confidence=0.0,
+        reasoning="Precheck: the proof photo is near-identical to the reported photo; the waste has not been shown cleared.",
+    )
+
+def mismatch_result(check: Precheck) -> EvaluationSchema:
+    return EvaluationSchema(
+        confidence=0.0,
+        reasoning=f"Location precheck: the proof photo shares no matching features with the reported site ({check.inliers} keypoint inliers).",
     )
 
+def local_result(check: Precheck) -> Optional[EvaluationSchema]:
+    """The verdict for pairs settled without an LLM call, else None."""
+    if check.unchanged:
+        return unchanged_result()
+    if is_clear_mismatch(check):
+        return mismatch_result(check)
+    return None
+
+@traced_node
+async def precheck(state: GraphState):
+    """Settles re-uploads and clear location mismatches without an LLM call; everything else goes to the model."""
+    check = await precheck_pair(state.imageUrl, state.staffimageUrl)
+    result = local_result(check)
+    if result is not None:
+        metrics.inc("waste_precheck_unchanged" if check.unchanged else "waste_precheck_rejections")
+        print(f"Precheck settled pair locally (score {check.score}, inliers {check.inliers}, unchanged {check.unchanged})")
+        return {"precheck_score": check.score, "confidence_result": result}
+    return {"precheck_score": check.score}
+
+def route_precheck(state: GraphState):
+    return "rejected" if state.confidence_result is not None else "plausible"
+
+@traced_node
+async def finalizer(state: GraphState):
+    """Compare the user uploaded waste image and the staff uploaded resolved image"""
     try:
-        response = await structured_llm.ainvoke([message])
+        response = await verify_resolution(state.imageUrl, state.staffimageUrl)
         return {"confidence_result": response}
         
     except Exception as e:
@@ -68,9 +192,11 @@ async def finalizer(state: GraphState):
         }
 graph = StateGraph(GraphState)
 
+graph.add_node('precheck', precheck)
 graph.add_node('finalizer', finalizer)
 
-graph.add_edge(START, 'finalizer')
+graph.add_edge(START, 'precheck')
+graph.add_conditional_edges('precheck', route_precheck, {"rejected": END, "plausible": 'finalizer'})
 graph.add_edge('finalizer', END)
 
 workflow = graph.compile()
\ No newline at end of file
@@ -0,0 +1,108 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+# --- CONFIG ---
+# Optional debounce before an evaluation starts; a newer message from the same sender
+# inside this window takes over. Off by default so no message pays extra latency;
+# stale cancellation works without it.
+COALESCE_WINDOW_SECONDS = float(os.getenv("CHAT_COALESCE_WINDOW_MS", "0")) / 1000.0
+
+
+class RoomJob:
+    """One /agent1 evaluation for a sender in a room. `verdict_reached` is set once final_judge has produced its decision."""
+
+    __slots__ = ("pending", "task", "verdict_reached", "future", "successor")
+
+    def __init__(self, pending: List[Tuple[str, str]]):
+        self.pending = pending  # (userId, message) not yet covered by a finished verdict; all from one sender
+        self.task: Optional[asyncio.Task] = None
+        self.verdict_reached = False
+        self.successor: Optional["RoomJob"] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Followers may all have gone away; don't warn about an unretrieved exception
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def merged_message(self) -> str:
+        """The sender's superseded messages, in order, so they are judged together."""
+        return "\n".join(msg for _, msg in self.pending)
+
+
+class RoomCoalescer:
+    """
+    Per-(room, sender) coalescing of chat evaluations. Messages from different
+    senders are never merged, so every sender's text is judged as a current message.
+    - a newer message from the same sender supersedes their queued or in-flight one,
+      and the successor judges both together,
+    - an in-flight evaluation is cancelled when superseded, but only before
+      final_judge has decided, so a reached SOS verdict always completes and is logged,
+    - a job is only superseded by one whose input covers all of its messages;
+      superseded callers receive that evaluation's result, except when their own
+      evaluation ended in an SOS, which is always returned as-is.
+    """
+
+    def __init__(self, window_seconds: float = COALESCE_WINDOW_SECONDS):
+        self.window = window_seconds
+        self._latest: Dict[Tuple[str, str], RoomJob] = {}
+        metrics.gauge("chat_coalesce_senders", lambda: len(self._latest))
+
+    def _supersede(self, key: Tuple[str, str], user_id: str, message: str) -> RoomJob:
+        prev = self._latest.get(key)
+        if prev is None or prev.verdict_reached or prev.future.done():
+            # Nothing to take over; an already decided job keeps its own result
+            job = RoomJob([(user_id, message)])
+        else:
+            job = RoomJob(prev.pending + [(user_id, message)])
+            prev.successor = job
+            if prev.task is not None and not prev.task.done():
+                prev.task.cancel()
+                metrics.inc("chat_coalesce_cancelled")
+        self._latest[key] = job
+        return job
+
+    async def _follow(self, job: RoomJob) -> dict:
+        result = await asyncio.shield(job.successor.future)
+        metrics.inc("chat_coalesce_followed")
+        return {**result, "coalesced": True}
+
+    async def _run(self, job: RoomJob, evaluate: Callable[[RoomJob], Awaitable[dict]]) -> dict:
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+            if job.successor is not None:
+                metrics.inc("chat_coalesce_debounced")
+                return await self._follow(job)
+
+        job.task = asyncio.create_task(evaluate(job))
+        try:
+            result = await asyncio.shield(job.task)
+        except asyncio.CancelledError:
+            if job.task.cancelled() and job.successor is not None:
+                return await self._follow(job)
+            raise
+
+        if result.get("trigger_sos") or job.successor is None:
+            return result
+        return await self._follow(job)
+
+    async def run(self, room_id: str, user_id: str, message: str, evaluate: Callable[[RoomJob], Awaitable[dict]]) -> dict:
+        key = (room_id, user_id)
+        job = self._supersede(key, user_id, message)
+        try:
+            result = await self._run(job, evaluate)
+            job.future.set_result(result)
+            return result
+        except BaseException as e:
+            if not job.future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    job.future.cancel()
+                else:
+                    job.future.set_exception(e)
+            raise
+        finally:
+            if self._latest.get(key) is job:
+                del self._latest[key]
+
+
+room_coalescer = RoomCoalescer()
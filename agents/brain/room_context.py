@@ -0,0 +1,155 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+
+from brain.lexical_screen import has_risk_terms
+from metrics import metrics
+
+# --- CONFIG ---
+TAIL_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TAIL_TOKENS", "400"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_SUMMARY_TOKENS", "200"))
+MAX_ROOMS = int(os.getenv("CHAT_CONTEXT_MAX_ROOMS", "50000"))
+ROOM_TTL_SECONDS = float(os.getenv("CHAT_CONTEXT_TTL_SECONDS", str(6 * 3600)))
+SUMMARY_LINE_WORDS = 16
+
+_encoding = None
+_encoding_failed = False
+
+
+def count_tokens(text: str) -> int:
+    """tiktoken count, falling back to a chars/4 estimate if the encoding can't be loaded."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken unavailable ({e}); estimating tokens from length")
+            _encoding_failed = True
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+class RoomContext:
+    __slots__ = ("tail", "tail_tokens", "summary", "summary_tokens", "omitted", "risk_events", "last_seen")
+
+    def __init__(self):
+        self.tail: Deque[Tuple[str, int]] = deque()  # (formatted line, tokens)
+        self.tail_tokens = 0
+        self.summary: Deque[Tuple[str, int, bool]] = deque()  # (line, tokens, risky)
+        self.summary_tokens = 0
+        self.omitted = 0
+        self.risk_events = 0
+        self.last_seen = time.monotonic()
+
+
+class RoomContextStore:
+    """
+    Per-room chat context under a fixed token budget.
+    The recent tail is kept verbatim. Messages that scroll out of it are folded
+    into an extractive summary: lines with danger/harassment terms are kept in
+    preference to routine ones, so earlier threats survive long conversations.
+    """
+
+    def __init__(self, max_rooms: int = MAX_ROOMS, ttl_seconds: float = ROOM_TTL_SECONDS):
+        self.max_rooms = max_rooms
+        self.ttl_seconds = ttl_seconds
+        self._rooms: "OrderedDict[str, RoomContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.gauge("chat_context_rooms", lambda: len(self._rooms))
+
+    def _room(self, room_id: str, create: bool = True) -> Optional[RoomContext]:
+        room = self._rooms.get(room_id)
+        if room is None:
+            if not create:
+                return None
+            room = self._rooms[room_id] = RoomContext()
+        else:
+            self._rooms.move_to_end(room_id)
+        room.last_seen = time.monotonic()
+        self._evict()
+        return room
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._rooms:
+            _, oldest = next(iter(self._rooms.items()))
+            if len(self._rooms) <= self.max_rooms and now - oldest.last_seen <= self.ttl_seconds:
+                break
+            self._rooms.popitem(last=False)
+
+    def _fold(self, room: RoomContext, line: str):
+        risky = has_risk_terms(line)
+        words = line.split()
+        if not risky and len(words) > SUMMARY_LINE_WORDS:
+            line = " ".join(words[:SUMMARY_LINE_WORDS]) + " ..."
+        tokens = count_tokens(line)
+        room.summary.append((line, tokens, risky))
+        room.summary_tokens += tokens
+
+        while room.summary_tokens > SUMMARY_TOKEN_BUDGET and room.summary:
+            # Oldest routine line goes first; risky lines only when nothing else is left
+            victim = next((i for i, item in enumerate(room.summary) if not item[2]), 0)
+            dropped = room.summary[victim]
+            del room.summary[victim]
+            room.summary_tokens -= dropped[1]
+            room.omitted += 1
+
+    def append(self, room_id: str, user_id: str, message: str):
+        line = f"[{user_id}]: {message}"
+        tokens = count_tokens(line)
+        with self._lock:
+            room = self._room(room_id)
+            if has_risk_terms(message):
+                room.risk_events += 1
+            room.tail.append((line, tokens))
+            room.tail_tokens += tokens
+            while room.tail_tokens > TAIL_TOKEN_BUDGET and len(room.tail) > 1:
+                old_line, old_tokens = room.tail.popleft()
+                room.tail_tokens -= old_tokens
+                self._fold(room, old_line)
+
+    def seed(self, room_id: str, messages: List) -> bool:
+        """Loads client-sent history for a room the store has not seen (e.g. after a restart)."""
+        with self._lock:
+            if room_id in self._rooms or not messages:
+                return False
+        for m in messages:
+            self.append(room_id, m.userId, m.message)
+        return True
+
+    def mark_risk(self, room_id: str):
+        with self._lock:
+            room = self._room(room_id)
+            room.risk_events += 1
+
+    def has_prior_risk(self, room_id: str) -> bool:
+        with self._lock:
+            room = self._room(room_id, create=False)
+            return bool(room and room.risk_events)
+
+    def recent_messages(self, room_id: str, limit: int = 6) -> List[str]:
+        with self._lock:
+            room = self._room(room_id, create=False)
+            return [line for line, _ in list(room.tail)[-limit:]] if room else []
+
+    def history_str(self, room_id: str) -> str:
+        with self._lock:
+            room = self._room(room_id, create=False)
+            if room is None or (not room.tail and not room.summary):
+                return "No history."
+            parts = []
+            if room.summary or room.omitted:
+                parts.append("EARLIER IN THIS ROOM (summary):")
+                if room.omitted:
+                    parts.append(f"({room.omitted} earlier routine messages omitted)")
+                parts.extend(line for line, _, _ in room.summary)
+                parts.append("RECENT MESSAGES:")
+            parts.extend(line for line, _ in room.tail)
+            return "\n".join(parts)
+
+
+room_context = RoomContextStore()
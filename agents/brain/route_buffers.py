@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from brain.route_risk import (
+    CUSUM_LIMIT, CUSUM_SLACK, CUSUM_TARGET, DROP_SPAN, EWMA_ALPHA, EWMA_FLOOR,
+    LOW_SCORE, LOW_WINDOW, RAPID_DROP, RULES, RouteRisk, recent_drop,
+)
+from metrics import metrics
+
+# --- CONFIG ---
+BUFFER_SIZE = int(os.getenv("ROUTE_BUFFER_SIZE", "32"))
+MAX_ROUTES = int(os.getenv("ROUTE_BUFFER_MAX_ROUTES", "50000"))
+_GROW_BY = 1024
+
+
+class RouteBuffers:
+    """
+    Fixed-size ring buffer of recent safety scores per route, stored as rows of
+    one preallocated float32 matrix (BUFFER_SIZE * 4 bytes + a few scalars per route).
+    Each new score updates the surveillance criteria incrementally, all in O(1)
+    with respect to BUFFER_SIZE: EWMA, CUSUM and the low-score streak from their
+    running values, the rapid drop from the last DROP_SPAN ring entries through
+    the same recent_drop() the batch sweep uses. A route is reported once when it
+    crosses into danger and stays latched until every criterion clears.
+    Least recently updated routes are evicted.
+    """
+
+    def __init__(self, size: int = BUFFER_SIZE, max_routes: int = MAX_ROUTES):
+        self.size = size
+        self._span = min(DROP_SPAN, size)
+        self.max_routes = max_routes
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free: List[int] = []
+        self._capacity = 0
+        self._scores = np.empty((0, size), dtype=np.float32)
+        self._head = np.empty(0, dtype=np.int32)
+        self._count = np.empty(0, dtype=np.int32)
+        self._ewma = np.empty(0, dtype=np.float32)
+        self._cusum = np.empty(0, dtype=np.float32)
+        self._low_streak = np.empty(0, dtype=np.int32)
+        self._latched = np.empty(0, dtype=bool)
+        self._lock = threading.Lock()
+        metrics.gauge("route_buffer_routes", lambda: len(self._slots))
+
+    def _grow(self):
+        extra = min(_GROW_BY, self.max_routes - self._capacity)
+        self._scores = np.concatenate([self._scores, np.full((extra, self.size), np.nan, dtype=np.float32)])
+        for name, dtype in (("_head", np.int32), ("_count", np.int32), ("_ewma", np.float32),
+                            ("_cusum", np.float32), ("_low_streak", np.int32), ("_latched", bool)):
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(extra, dtype=dtype)]))
+        self._free.extend(range(self._capacity + extra - 1, self._capacity - 1, -1))
+        self._capacity += extra
+
+    def _slot(self, route_id: str) -> int:
+        slot = self._slots.get(route_id)
+        if slot is not None:
+            self._slots.move_to_end(route_id)
+            return slot
+        if not self._free:
+            if self._capacity < self.max_routes:
+                self._grow()
+            else:
+                _, evicted = self._slots.popitem(last=False)
+                self._free.append(evicted)
+                metrics.inc("route_buffer_evictions")
+        slot = self._free.pop()
+        self._scores[slot].fill(np.nan)
+        self._head[slot] = self._count[slot] = self._low_streak[slot] = 0
+        self._ewma[slot] = np.nan
+        self._cusum[slot] = 0.0
+        self._latched[slot] = False
+        self._slots[route_id] = slot
+        return slot
+
+    def record(self, route_id: str, score: float) -> Optional[RouteRisk]:
+        """Adds a score; returns the risk only on the update where the route newly crosses into danger."""
+        with self._lock:
+            slot = self._slot(route_id)
+            self._scores[slot, self._head[slot]] = score
+            self._head[slot] = (self._head[slot] + 1) % self.size
+            self._count[slot] = min(self._count[slot] + 1, self.size)
+
+            ewma = self._ewma[slot]
+            self._ewma[slot] = score if np.isnan(ewma) else EWMA_ALPHA * score + (1 - EWMA_ALPHA) * ewma
+            self._cusum[slot] = max(0.0, self._cusum[slot] + (CUSUM_TARGET - CUSUM_SLACK) - score)
+            self._low_streak[slot] = self._low_streak[slot] + 1 if score < LOW_SCORE else 0
+            tail = self._scores[slot, (self._head[slot] - self._span + np.arange(self._span)) % self.size]
+            drawdown = float(recent_drop(tail))
+
+            hits = {
+                "rapid_drop": drawdown >= RAPID_DROP,
+                "low_average": self._low_streak[slot] >= LOW_WINDOW,
+                "ewma_low": self._count[slot] >= LOW_WINDOW and self._ewma[slot] < EWMA_FLOOR,
+                "cusum_drift": self._cusum[slot] > CUSUM_LIMIT,
+            }
+            danger = any(hits.values())
+            crossed = danger and not self._latched[slot]
+            self._latched[slot] = danger
+            if not crossed:
+                return None
+            metrics.inc("route_buffer_flags")
+            return RouteRisk(
+                route_id=route_id,
+                reasons=[label for key, label in RULES if hits[key]],
+                latest=float(score),
+                drawdown=round(drawdown, 3),
+                ewma=round(float(self._ewma[slot]), 3),
+                cusum=round(float(self._cusum[slot]), 3),
+            )
+
+    def history(self, route_id: str) -> List[float]:
+        """Buffered scores, oldest first."""
+        with self._lock:
+            slot = self._slots.get(route_id)
+            if slot is None:
+                return []
+            ring = np.roll(self._scores[slot], -int(self._head[slot]))
+            return [float(x) for x in ring[~np.isnan(ring)]]
+
+
+route_buffers = RouteBuffers()
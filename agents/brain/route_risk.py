@@ -0,0 +1,124 @@
+import itertools
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+# --- DANGER CRITERIA (the surveillance rubric) ---
+RAPID_DROP = 3.0          # latest score >= 3 points below the peak of the last DROP_SPAN scores
+DROP_SPAN = int(os.getenv("ROUTE_RISK_DROP_SPAN", "4"))
+LOW_SCORE = 5.0           # last LOW_WINDOW scores all below this
+LOW_WINDOW = 3
+# --- DRIFT DETECTION ---
+EWMA_ALPHA = float(os.getenv("ROUTE_RISK_EWMA_ALPHA", "0.3"))
+EWMA_FLOOR = float(os.getenv("ROUTE_RISK_EWMA_FLOOR", "5.5"))
+CUSUM_TARGET = float(os.getenv("ROUTE_RISK_CUSUM_TARGET", "8.0"))  # expected score on a safe route
+CUSUM_SLACK = float(os.getenv("ROUTE_RISK_CUSUM_SLACK", "1.0"))
+CUSUM_LIMIT = float(os.getenv("ROUTE_RISK_CUSUM_LIMIT", "6.0"))
+# Only the most recent scores of each route are evaluated
+MAX_HISTORY = int(os.getenv("ROUTE_RISK_MAX_HISTORY", "64"))
+
+
+def recent_drop(tail: np.ndarray) -> np.ndarray:
+    """
+    Fall of the latest score (last column) below the peak of the given recent scores.
+    `tail` is (..., DROP_SPAN), oldest first, NaN where a route has no score yet.
+    A route that has recovered has no drop, however low it dipped earlier.
+    Rounded so the float32 ring buffers and the float64 batch sweep agree at the threshold.
+    """
+    return np.round(np.fmax.reduce(tail, axis=-1).astype(np.float64) - tail[..., -1], 4)
+
+
+class RouteRisk(BaseModel):
+    route_id: str
+    reasons: List[str]
+    latest: float
+    drawdown: float
+    ewma: float
+    cusum: float
+
+
+def to_matrix(route_data: Dict[str, Sequence[float]], max_history: int = MAX_HISTORY) -> Tuple[List[str], np.ndarray]:
+    """Right-aligned (routes x time) matrix, NaN-padded on the left; the last column is the latest score."""
+    ids = list(route_data.keys())
+    values = list(route_data.values())
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    width = int(min(max_history, lengths.max(initial=0))) or 1
+    lengths = np.minimum(lengths, width)
+    flat = np.fromiter(
+        itertools.chain.from_iterable(v[-width:] for v in values if len(v)), dtype=np.float64, count=int(lengths.sum())
+    )
+    # Scatter every route's tail into its right-aligned row without a per-row Python loop
+    rows = np.repeat(np.arange(len(ids)), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    cols = np.arange(flat.size) - starts + np.repeat(width - lengths, lengths)
+    matrix = np.full((len(ids), width), np.nan, dtype=np.float64)
+    matrix[rows, cols] = flat
+    return ids, matrix
+
+
+def evaluate_matrix(matrix: np.ndarray) -> Dict[str, np.ndarray]:
+    """All criteria for every route in one vectorized pass. Returns per-route arrays."""
+    n, width = matrix.shape
+    present = ~np.isnan(matrix)
+
+    # Rapid drop: the latest score against the peak of the last DROP_SPAN scores
+    drawdown = np.nan_to_num(recent_drop(matrix[:, -DROP_SPAN:]), nan=0.0)
+
+    # Low average: the last LOW_WINDOW scores all present and below LOW_SCORE
+    last = matrix[:, -LOW_WINDOW:]
+    low = (last.shape[1] == LOW_WINDOW) & np.all(present[:, -LOW_WINDOW:] & (last < LOW_SCORE), axis=1)
+
+    # EWMA and one-sided (downward) CUSUM, recursed over time, vectorized over routes.
+    # Rows are NaN-prefixed then contiguous, so NaN only ever precedes the first score:
+    # EWMA starts at the first score and fmax() keeps CUSUM at 0 until then.
+    ewma = np.full(n, np.nan)
+    cusum = np.zeros(n)
+    drift = CUSUM_TARGET - CUSUM_SLACK
+    for t in range(width):
+        x = matrix[:, t]
+        smoothed = EWMA_ALPHA * x + (1 - EWMA_ALPHA) * ewma
+        ewma = np.where(np.isnan(ewma), x, smoothed)
+        cusum = np.fmax(0.0, cusum + drift - x)
+
+    counts = present.sum(axis=1)
+    latest = matrix[:, -1]
+    return {
+        "latest": latest,
+        "drawdown": drawdown,
+        "rapid_drop": drawdown >= RAPID_DROP,
+        "low_average": low,
+        "ewma": ewma,
+        "ewma_low": (counts >= LOW_WINDOW) & (np.nan_to_num(ewma, nan=10.0) < EWMA_FLOOR),
+        "cusum": cusum,
+        "cusum_drift": cusum > CUSUM_LIMIT,
+    }
+
+
+RULES = [
+    ("rapid_drop", f"Rapid drop of >= {RAPID_DROP:g} points within {DROP_SPAN} scores"),
+    ("low_average", "Last 3 scores all below 5"),
+    ("ewma_low", "Smoothed score trending below safe level"),
+    ("cusum_drift", "Sustained downward drift (CUSUM)"),
+]
+
+
+def evaluate_routes(route_data: Dict[str, Sequence[float]]) -> List[RouteRisk]:
+    """Deterministic surveillance sweep; returns only the flagged routes."""
+    if not route_data:
+        return []
+    ids, matrix = to_matrix(route_data)
+    result = evaluate_matrix(matrix)
+    flags = np.column_stack([result[key] for key, _ in RULES])
+    flagged = []
+    for row in np.flatnonzero(flags.any(axis=1)):
+        flagged.append(RouteRisk(
+            route_id=ids[row],
+            reasons=[label for (key, label), hit in zip(RULES, flags[row]) if hit],
+            latest=float(result["latest"][row]),
+            drawdown=round(float(result["drawdown"][row]), 3),
+            ewma=round(float(result["ewma"][row]), 3),
+            cusum=round(float(result["cusum"][row]), 3),
+        ))
+    return flagged
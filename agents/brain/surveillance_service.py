@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+from brain.layel_2 import FLAG_CONCURRENCY, MAX_FLAGS_PER_SWEEP, flag_routes
+from brain.route_risk import evaluate_routes
+from metrics import metrics
+from stream_json import ObjectFieldParser
+
+# Routes evaluated per vectorized pass while the body is still streaming in
+CHUNK_ROUTES = int(os.getenv("SURVEILLANCE_CHUNK_ROUTES", "5000"))
+
+
+def _line(obj: dict) -> bytes:
+    return (json.dumps(obj) + "\n").encode()
+
+
+def _valid_scores(scores) -> bool:
+    return isinstance(scores, list) and all(
+        isinstance(x, (int, float)) and not isinstance(x, bool) for x in scores
+    )
+
+
+async def stream_surveillance(body: AsyncIterator[bytes], body_read: Optional[asyncio.Event] = None) -> AsyncIterator[bytes]:
+    """
+    Parses {"payload": {routeId: [scores]}} as it arrives and evaluates it in chunks
+    of CHUNK_ROUTES; each chunk's flagged routes are alerted right away,
+    FLAG_CONCURRENCY at a time, so alert lines stream out while the body is still
+    being read. Only the current chunk is held in memory. At most
+    MAX_FLAGS_PER_SWEEP alerts are raised; later flagged routes are reported with
+    "alerted": false. Ends with a summary line. Raises ValueError on a malformed body.
+    `body_read` is set once the whole body has been consumed.
+    """
+    parser = ObjectFieldParser("payload")
+    totals = {"routes": 0, "flagged": 0, "alerted": 0, "invalid": 0}
+    raised = 0
+    chunk: Dict[str, List[float]] = {}
+
+    async def alert(chunk: Dict[str, List[float]]) -> AsyncIterator[bytes]:
+        nonlocal raised
+        flagged = await asyncio.to_thread(evaluate_routes, chunk)
+        totals["flagged"] += len(flagged)
+        budget = max(0, MAX_FLAGS_PER_SWEEP - raised)
+        to_alert, skipped = flagged[:budget], flagged[budget:]
+        raised += len(to_alert)
+        for start in range(0, len(to_alert), FLAG_CONCURRENCY):
+            wave = to_alert[start:start + FLAG_CONCURRENCY]
+            alerts = await flag_routes(wave)
+            totals["alerted"] += len(alerts)
+            for risk, result in zip(wave, alerts):
+                yield _line({**risk.model_dump(), "alerted": True, "alert": result})
+        for risk in skipped:
+            yield _line({**risk.model_dump(), "alerted": False, "alert": None})
+
+    async for data in body:
+        for route_id, scores in parser.feed(data):
+            if not _valid_scores(scores):
+                totals["invalid"] += 1
+                continue
+            chunk[str(route_id)] = scores
+            totals["routes"] += 1
+            if len(chunk) >= CHUNK_ROUTES:
+                async for line in alert(chunk):
+                    yield line
+                chunk = {}
+    parser.close()
+    if body_read is not None:
+        body_read.set()
+    if chunk:
+        async for line in alert(chunk):
+            yield line
+
+    metrics.inc("surveillance_batch_routes", totals["routes"])
+    metrics.inc("surveillance_batch_alerts", totals["alerted"])
+    yield _line({"status": "complete", **totals, "capped": totals["flagged"] > MAX_FLAGS_PER_SWEEP})
+
+
+async def resume_stream(first: bytes, lines: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """The rest of a stream whose first line is already out; a body found malformed midway ends it with an error line."""
+    yield first
+    try:
+        async for line in lines:
+            yield line
+    except ValueError as e:
+        yield _line({"status": "error", "error": f"Invalid surveillance payload: {e}"})
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from brain.lexical_screen import NEGATORS, has_risk_terms, normalize
+from metrics import metrics
+
+# --- CONFIG ---
+CACHE_ENABLED = os.getenv("CHAT_VERDICT_CACHE", "1") == "1"
+CACHE_MAX_ENTRIES = int(os.getenv("CHAT_VERDICT_CACHE_SIZE", "20000"))
+CACHE_TTL_SECONDS = float(os.getenv("CHAT_VERDICT_CACHE_TTL_SECONDS", "3600"))
+# Only short messages are cached; longer ones are too context-dependent to reuse
+MAX_CACHE_TOKENS = int(os.getenv("CHAT_VERDICT_CACHE_MAX_TOKENS", "12"))
+NEAR_DUPLICATE_SIMILARITY = float(os.getenv("CHAT_VERDICT_CACHE_SIMILARITY", "0.85"))
+
+# MinHash over character 3-grams, LSH with BANDS x ROWS = NUM_PERM
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE = 3
+_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(1234)
+_A = _rng.integers(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+
+# Coarse history-risk buckets; rooms with prior risk never use the cache
+CLEAN_HISTORY = "clean"
+
+
+def minhash(text: str) -> np.ndarray:
+    padded = f" {text} "
+    shingles = {padded[i:i + SHINGLE] for i in range(max(1, len(padded) - SHINGLE + 1))}
+    base = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") >> 3 for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    # (a*x + b) mod p per permutation; uint64 wraparound is fine for hashing purposes
+    hashed = (_A[:, None] * base[None, :] + _B[:, None]) % np.uint64(_PRIME)
+    return hashed.min(axis=1)
+
+
+def _guard(norm: str) -> Tuple[frozenset, bool]:
+    """Near-duplicates must agree on negations and risk terms ("i'm safe" vs "i'm not safe")."""
+    return frozenset(tok for tok in norm.split() if tok in NEGATORS), has_risk_terms(norm)
+
+
+class _Entry:
+    __slots__ = ("scores", "signature", "guard", "bands", "stored_at")
+
+    def __init__(self, scores, signature, guard, bands):
+        self.scores = scores
+        self.signature = signature
+        self.guard = guard
+        self.bands = bands
+        self.stored_at = time.monotonic()
+
+
+class VerdictCache:
+    """
+    Reuses analyzer sub-scores for short recurring messages.
+    Exact hits on (history bucket, normalized text); near-duplicates through MinHash LSH.
+    TTL-expired and least-recently-used entries are evicted.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._bands: Dict[Tuple[str, int, bytes], Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+        metrics.gauge("chat_verdict_cache_entries", lambda: len(self._entries))
+
+    @staticmethod
+    def cacheable(norm: str) -> bool:
+        return bool(norm) and len(norm.split()) <= MAX_CACHE_TOKENS
+
+    def _band_keys(self, bucket: str, signature: np.ndarray):
+        rows = signature.reshape(BANDS, ROWS)
+        return [(bucket, i, rows[i].tobytes()) for i in range(BANDS)]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in entry.bands:
+            members = self._bands.get(band)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._bands[band]
+
+    def _fresh(self, key) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.stored_at > self.ttl_seconds:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, message: str, bucket: str = CLEAN_HISTORY):
+        """Returns (sentiment, urgency, severity) or None."""
+        norm = normalize(message)
+        if not self.cacheable(norm):
+            return None
+        with self._lock:
+            entry = self._fresh((bucket, norm))
+            if entry is not None:
+                metrics.inc("chat_verdict_cache_hits")
+                return entry.scores
+
+            signature = minhash(norm)
+            guard = _guard(norm)
+            candidates = set()
+            for band in self._band_keys(bucket, signature):
+                candidates.update(self._bands.get(band, ()))
+            best, best_sim = None, NEAR_DUPLICATE_SIMILARITY
+            for key in candidates:
+                candidate = self._fresh(key)
+                if candidate is None or candidate.guard != guard:
+                    continue
+                sim = float(np.mean(candidate.signature == signature))
+                if sim >= best_sim:
+                    best, best_sim = candidate, sim
+            if best is not None:
+                metrics.inc("chat_verdict_cache_near_hits")
+                return best.scores
+        metrics.inc("chat_verdict_cache_misses")
+        return None
+
+    def put(self, message: str, scores, bucket: str = CLEAN_HISTORY):
+        norm = normalize(message)
+        if not self.cacheable(norm) or any(s is None for s in scores):
+            return
+        signature = minhash(norm)
+        key = (bucket, norm)
+        with self._lock:
+            self._remove(key)
+            bands = self._band_keys(bucket, signature)
+            self._entries[key] = _Entry(tuple(scores), signature, _guard(norm), bands)
+            for band in bands:
+                self._bands.setdefault(band, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+
+verdict_cache = VerdictCache()
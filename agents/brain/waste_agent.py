@@ -1,5 +1,6 @@
 from state import AgentState
 from utils import analyze_image_category
+from tracing import traced_node
 
 WASTE_SYSTEM_PROMPT = """
 You are a Waste Management Specialist.
@@ -28,6 +29,7 @@ Assign severity based on volume, hygiene, and obstruction:
 - LOW: Single wrapper or bottle.
 """
 
+@traced_node
 async def waste_agent_node(state: AgentState):
     print("🗑️ Waste Agent Analyzing...")
     
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+from brain.location_precheck import Precheck
+from brain.resolveWasteAgent import (
+    EvaluationSchema, local_result, precheck_pair, verify_resolution, verify_resolutions,
+)
+from metrics import metrics
+from report_artifacts import report_artifacts
+from visual_index import visual_index
+
+# --- CONFIG ---
+RESOLVED_CONFIDENCE = 0.8
+BATCH_CONCURRENCY = int(os.getenv("WASTE_BATCH_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("WASTE_BATCH_MAX_ITEMS", "200"))
+MAX_PAIRS_PER_REQUEST = 4
+
+
+def apply_resolution(report_id: Optional[str], geohash: Optional[str], result: EvaluationSchema,
+                     image_url: Optional[str] = None):
+    if result.confidence < RESOLVED_CONFIDENCE:
+        return
+    if report_id:
+        # Resolved reports should no longer match as duplicates
+        visual_index.remove(report_id, geohash, "WASTE")
+    if image_url:
+        # Nothing will be verified against this report again
+        report_artifacts.delete(image_url)
+
+
+def _line(obj: dict) -> bytes:
+    return (json.dumps(obj) + "\n").encode()
+
+
+async def stream_resolution_batch(items: List, pairs_per_request: int = 1) -> AsyncIterator[bytes]:
+    """
+    Verifies many WasteReportRequest items, BATCH_CONCURRENCY LLM requests at a time,
+    each covering up to `pairs_per_request` pairs. Yields one NDJSON line per item
+    as soon as it is verified, then a summary line. A failed item is reported
+    with "success": false and never fails the rest of the batch.
+    """
+    pairs_per_request = max(1, min(pairs_per_request, MAX_PAIRS_PER_REQUEST))
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    groups = [list(range(i, min(i + pairs_per_request, len(items)))) for i in range(0, len(items), pairs_per_request)]
+
+    async def verify_one(index: int) -> EvaluationSchema:
+        async with semaphore:
+            return await verify_resolution(items[index].imageUrl, items[index].staffimageUrl)
+
+    async def precheck(index: int) -> Precheck:
+        async with semaphore:
+            return await precheck_pair(items[index].imageUrl, items[index].staffimageUrl)
+
+    async def verify_group(group: List[int]) -> Dict[int, object]:
+        results: Dict[int, object] = {}
+        # Re-uploads and clear location mismatches are settled locally, without an LLM call
+        checks = dict(zip(group, await asyncio.gather(*(precheck(i) for i in group))))
+        for i in group:
+            result = local_result(checks[i])
+            if result is not None:
+                results[i] = result
+        group = [i for i in group if i not in results]
+        prechecked = dict(results)
+        if len(group) > 1:
+            try:
+                async with semaphore:
+                    found = await verify_resolutions(
+                        [(str(i), items[i].imageUrl, items[i].staffimageUrl) for i in group]
+                    )
+                results.update((int(pair_id), result) for pair_id, result in found.items())
+            except Exception as e:
+                print(f"Multi-pair verification failed, retrying individually: {e}")
+            missing = [i for i in group if i not in results]
+            if missing:
+                metrics.inc("waste_batch_fallbacks", len(missing))
+        else:
+            missing = group
+        singles = await asyncio.gather(*(verify_one(i) for i in missing), return_exceptions=True)
+        results.update(zip(missing, singles))
+        metrics.inc("waste_precheck_unchanged", sum(checks[i].unchanged for i in prechecked))
+        metrics.inc("waste_precheck_rejections", sum(not checks[i].unchanged for i in prechecked))
+        return {i: (result, checks[i].score) for i, result in results.items()}
+
+    totals = {"items": len(items), "succeeded": 0, "failed": 0, "resolved": 0}
+    for done in asyncio.as_completed([verify_group(g) for g in groups]):
+        for index, (result, precheck_score) in sorted((await done).items()):
+            item = items[index]
+            if isinstance(result, Exception):
+                totals["failed"] += 1
+                yield _line({
+                    "index": index, "reportId": item.reportId, "success": False,
+                    "error": str(result), "precheck_score": precheck_score,
+                })
+                continue
+            try:
+                apply_resolution(item.reportId, item.geohash, result, item.imageUrl)
+            except Exception as e:
+                print(f"Resolution cleanup failed for {item.reportId}: {e}")
+                metrics.inc("waste_resolution_cleanup_failures")
+            totals["succeeded"] += 1
+            totals["resolved"] += result.confidence >= RESOLVED_CONFIDENCE
+            yield _line({
+                "index": index,
+                "reportId": item.reportId,
+                "success": True,
+                "confidence_result": result.model_dump(),
+                "precheck_score": precheck_score,
+            })
+
+    metrics.inc("waste_batch_items", totals["items"])
+    metrics.inc("waste_batch_failures", totals["failed"])
+    yield _line({"status": "complete", **totals})
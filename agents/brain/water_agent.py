@@ -1,5 +1,6 @@
 from state import AgentState
 from utils import analyze_image_category
+from tracing import traced_node
 
 WATER_SYSTEM_PROMPT = """
 You are an expert Hydrology and Sanitation Engineer. 
@@ -28,6 +29,7 @@ Assign severity based on public health and resource loss:
 - LOW: Minor dampness.
 """
 
+@traced_node
 async def water_agent_node(state: AgentState):
     print("💧 Water Agent Analyzing...")
     
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from metrics import metrics
+
+# --- CONFIG ---
+WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "8"))
+# Share of failed or slow calls in the window that opens the circuit
+FAILURE_RATIO = float(os.getenv("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+# A call slower than this counts as a failure even when it succeeds
+SLOW_CALL_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_CALL_SECONDS", "20"))
+OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+HALF_OPEN_PROBES = int(os.getenv("LLM_BREAKER_HALF_OPEN_PROBES", "1"))
+
+CLOSED, OPEN, HALF_OPEN = "CLOSED", "OPEN", "HALF_OPEN"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the dependency while the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Count-based rolling window of call outcomes. The circuit opens when at least
+    FAILURE_RATIO of the last WINDOW calls (once MIN_CALLS were seen) failed or
+    exceeded SLOW_CALL_SECONDS. After OPEN_SECONDS it goes half-open and lets
+    HALF_OPEN_PROBES calls through: all succeeding closes it, any failure reopens it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=WINDOW)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probes_passed = 0
+        self._lock = threading.Lock()
+        metrics.gauge(f"breaker_{name}_open", lambda: 0 if self.state == CLOSED else 1)
+
+    def _transition(self, state: str):
+        print(f"Circuit '{self.name}': {self.state} -> {state}")
+        metrics.inc(f"breaker_{self.name}_{state.lower()}")
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._probes_in_flight = self._probes_passed = 0
+        elif state == CLOSED:
+            self._outcomes.clear()
+
+    @property
+    def degraded(self) -> bool:
+        """True while callers should not even try the dependency (open and not yet due for a probe)."""
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self._opened_at < OPEN_SECONDS
+
+    def acquire(self) -> bool:
+        """Whether a call may go ahead now. Every True must be followed by record() or release()."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < OPEN_SECONDS:
+                    metrics.inc(f"breaker_{self.name}_rejected")
+                    return False
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= HALF_OPEN_PROBES:
+                    metrics.inc(f"breaker_{self.name}_rejected")
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record(self, ok: bool, seconds: float):
+        ok = ok and seconds <= SLOW_CALL_SECONDS
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if not ok:
+                    self._transition(OPEN)
+                else:
+                    self._probes_passed += 1
+                    if self._probes_passed >= HALF_OPEN_PROBES:
+                        self._transition(CLOSED)
+                return
+            if self.state == OPEN:
+                # A call admitted before the circuit opened
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= MIN_CALLS and failures >= FAILURE_RATIO * len(self._outcomes):
+                self._transition(OPEN)
+
+    def release(self):
+        """Gives back an admitted call that ended without an outcome (cancelled)."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    @asynccontextmanager
+    async def guard(self):
+        """Wraps one call; raises CircuitOpenError without running it while the circuit is open."""
+        if not self.acquire():
+            raise CircuitOpenError(f"Circuit '{self.name}' is open")
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Superseded work is not evidence about the dependency
+            self.release()
+            raise
+        except Exception:
+            self.record(False, time.perf_counter() - started)
+            raise
+        self.record(True, time.perf_counter() - started)
+
+
+llm_breaker = CircuitBreaker("llm")
@@ -0,0 +1,73 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import metrics
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "900"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+
+def derive_key(scope: str, *parts: Optional[str]) -> str:
+    """Stable hex key for a request. Also safe to use as a backend document id."""
+    raw = "|".join([scope] + [p or "" for p in parts])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Deduplicates retried requests.
+    - A key that is still running attaches the caller to the same execution.
+    - A key that completed within the TTL replays the stored response.
+    Failures are never stored, so a retry after an error runs again.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._completed: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _purge(self, now: float):
+        while self._completed:
+            key, (expires_at, _) = next(iter(self._completed.items()))
+            if expires_at > now and len(self._completed) <= self.max_entries:
+                break
+            self._completed.popitem(last=False)
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._completed[key] = (time.monotonic() + self.ttl, task.result())
+        self._completed.move_to_end(key)
+        self._purge(time.monotonic())
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        now = time.monotonic()
+        self._purge(now)
+
+        cached = self._completed.get(key)
+        if cached is not None:
+            metrics.inc("idempotency_replayed")
+            return cached[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.inc("idempotency_attached")
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+            metrics.inc("idempotency_executed")
+
+        # Shielded so one caller disconnecting does not cancel the shared execution
+        return await asyncio.shield(task)
+
+
+idempotency_store = IdempotencyStore()
+metrics.gauge("idempotency_entries", lambda: len(idempotency_store._completed))
+metrics.gauge("idempotency_inflight", lambda: len(idempotency_store._inflight))
@@ -1,22 +1,40 @@
 import os
+import asyncio
+import time
+import uuid
 from jose import jwt
 import requests
 from typing import List, Dict, Optional
-from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 # --- LANGGRAPH IMPORTS ---
-from brain.layel_1 import app_graph, FrontendMessage
-from brain.layel_2 import surveillance_agent
+from brain.layel_1 import FrontendMessage, SCORING_MODES, DEFAULT_SCORING_MODE, use_persistent_checkpointer
+from brain.checkpointer import CHECKPOINT_BACKEND
+from brain.chat_service import evaluate_chat
+from brain.surveillance_service import resume_stream, stream_surveillance
 from brain.agent3 import analyze_emergency
 from brain.resolveWasteAgent import workflow
+from brain.waste_resolution_service import (
+    BATCH_MAX_ITEMS as WASTE_BATCH_MAX_ITEMS, apply_resolution, stream_resolution_batch,
+)
 
 # [CHANGE 1: Renamed 'app' to 'report_agent' to avoid conflict with FastAPI app]
 from brain.orchestrator import app as report_agent 
 from state import ReportStatus # Importing enums is good practice
+from outbox import report_outbox, OUTBOX_ENABLED
+from stream_json import BodyStreamingResponse
+from metrics import metrics
+from tracing import install as install_tracing, tracer
+from profiler import PROFILER_TOKEN, ProfilerBusy, authorized, profiler
+from loop_watchdog import loop_watchdog
+from idempotency import idempotency_store, derive_key
+from rate_limit import reports_limiter, chat_limiter, throttle_limiter
 
 app = FastAPI()
+install_tracing(app)
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")  # e.g. dev-xyz.us.auth0.com
 AUTH0_AUDIENCE = os.getenv("AUTH0_AUDIENCE")
 ALGORITHMS = ["RS256"]
@@ -29,13 +47,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_background_workers():
+    loop_watchdog.start()
+    if OUTBOX_ENABLED:
+        report_outbox.start()
+    if CHECKPOINT_BACKEND == "sqlite":
+        try:
+            app.state.chat_checkpointer = await use_persistent_checkpointer()
+            print("💾 Chat checkpoints persisted to SQLite")
+        except ImportError as e:
+            print(f"SQLite checkpointer unavailable ({e}); keeping in-memory checkpoints")
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    loop_watchdog.stop()
+    if OUTBOX_ENABLED:
+        report_outbox.stop()
+    saver = getattr(app.state, "chat_checkpointer", None)
+    if saver is not None:
+        await saver.conn.close()
+
 # --- REQUEST SCHEMAS ---
 class ChatRequest(BaseModel):
     roomId: str
-    messages: List[FrontendMessage]
+    # Optional: history is kept server-side per room; only used to seed a room after a restart
+    messages: List[FrontendMessage] = []
     currentUserMessage: str
     currentUserId: str
+    # "parallel" (three analyzer calls), "combined" (one structured call) or
+    # "batched" (combined, shared across rooms); defaults to CHAT_SCORING_MODE
+    scoringMode: Optional[str] = None
 
+# Body shape of /surveillance/batch (parsed incrementally, not through this model)
 class RouteBatchRequest(BaseModel):
     payload: Dict[str, List[float]]
 
@@ -58,6 +102,13 @@ class ReportRequest(BaseModel):
 class WasteReportRequest(BaseModel):
     imageUrl:str
     staffimageUrl:str
+    reportId: Optional[str] = None
+    geohash: Optional[str] = None
+
+class WasteBatchRequest(BaseModel):
+    items: List[WasteReportRequest]
+    # Pairs compared per LLM request (1-4); 1 keeps one call per pair
+    pairsPerRequest: int = 1
 def fetch_user_profile(access_token: str):
     url = f"https://{AUTH0_DOMAIN}/userinfo"
     headers = {
@@ -115,8 +166,56 @@ def get_user_from_token(authorization: str = Header(...)):
 
 
 # --- ENDPOINTS ---
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+@app.get("/traces/usage")
+async def get_trace_usage(recent: int = 20):
+    """Per-endpoint request, LLM token and cost totals, plus the slowest recent traces."""
+    return tracer.usage(recent)
+
+@app.get("/debug/profile")
+async def debug_profile(
+    seconds: float = 10,
+    mode: str = "wall",
+    interval_ms: float = 10,
+    loop_only: bool = False,
+    x_debug_token: Optional[str] = Header(None, alias="X-Debug-Token"),
+):
+    """Sampling profile of the whole process as collapsed stacks (flamegraph.pl / speedscope)."""
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorized(x_debug_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        stacks = await profiler.profile(seconds, mode, interval_ms / 1000.0, loop_only)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return PlainTextResponse(stacks)
+
+@app.get("/debug/loop-stalls")
+async def debug_loop_stalls(x_debug_token: Optional[str] = Header(None, alias="X-Debug-Token")):
+    """Recent event-loop stalls with the stack that was blocking the loop. Lag histograms are in /metrics."""
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorized(x_debug_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return {"threshold_ms": loop_watchdog.threshold * 1000, "stalls": loop_watchdog.stalls()}
+
 @app.post("/resolveWasteReports")
-async def resolve_waste_report(req: WasteReportRequest):
+async def resolve_waste_report(
+    req: WasteReportRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    parts = (idempotency_key,) if idempotency_key else (req.imageUrl, req.staffimageUrl)
+    key = derive_key("resolveWasteReports", *parts)
+    return await idempotency_store.run(key, lambda: run_waste_resolution(req))
+
+async def run_waste_resolution(req: WasteReportRequest):
+    tracer.tag(reportId=req.reportId)
     try:
         initial_report_state = {
             "imageUrl": req.imageUrl,
@@ -128,21 +227,49 @@ async def resolve_waste_report(req: WasteReportRequest):
 
         if not confidence_data:
             raise HTTPException(status_code=500, detail="Analysis completed but no result returned.")
+        try:
+            apply_resolution(req.reportId, req.geohash, confidence_data, req.imageUrl)
+        except Exception as e:
+            # Index/artifact cleanup must not turn a computed verdict into a 500
+            print(f"Resolution cleanup failed for {req.reportId}: {e}")
+            metrics.inc("waste_resolution_cleanup_failures")
         return {
             "success": True,
-            "confidence_result": confidence_data.model_dump()
+            "confidence_result": confidence_data.model_dump(),
+            "precheck_score": final_state.get("precheck_score")
         }
     except Exception as e:
         print(f"Error in Report Endpoint: {e}")
         raise HTTPException(status_code=500, detail=f"Orchestration Failed: {str(e)}")
+@app.post("/resolveWasteReports/batch")
+async def resolve_waste_reports_batch(req: WasteBatchRequest):
+    """Streams NDJSON: one EvaluationSchema result (or error) per item, then a summary line."""
+    if not req.items:
+        raise HTTPException(status_code=400, detail="No items to verify")
+    if len(req.items) > WASTE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {WASTE_BATCH_MAX_ITEMS} items per batch")
+    return StreamingResponse(
+        stream_resolution_batch(req.items, req.pairsPerRequest), media_type="application/x-ndjson"
+    )
+
 @app.post("/reports")
 async def create_report(
     req: ReportRequest, 
-    user_info: dict = Depends(get_user_from_token) 
+    user_info: dict = Depends(get_user_from_token),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
+    # Keys are scoped to the verified user so one caller can never replay another's response
+    parts = (idempotency_key,) if idempotency_key else (req.imageUrl, req.geohash)
+    key = derive_key("reports", user_info["userId"], *parts)
+    return await idempotency_store.run(key, lambda: run_report(req, user_info, key))
+
+async def run_report(req: ReportRequest, user_info: dict, idempotency_key: str):
+    # Only fresh executions spend quota; replays and attached retries are free
+    reports_limiter.enforce(user_info["userId"])
     try:
         secure_user_id = user_info["userId"]
         secure_email = user_info["email"]
+        tracer.tag(userId=secure_user_id, idempotencyKey=idempotency_key)
         print(f"email ${secure_email} usr_Id ${secure_user_id}")
 
         print(f"--- Processing Report from: {secure_email} ---")
@@ -162,8 +289,10 @@ async def create_report(
             "locality_email": None,
             "locality_userId": None,
             "locality_reportId": None,
+            "locality_geohash": None,
 
             "tool": "SAVE", 
+            "idempotencyKey": idempotency_key,
             
 
             "water_analysis": None,
@@ -176,6 +305,8 @@ async def create_report(
             "assigned_category": None,
             "route": "",
             "updatedRoute": "",
+            "image_fingerprint": None,
+            "degraded": False,
             
  
             "reportId": None 
@@ -188,6 +319,7 @@ async def create_report(
         category = result.get("assigned_category") 
         extracted_title = "Report Processed" 
         tool=result.get("tool")
+        tracer.tag(reportId=result.get("reportId"), category=getattr(category, "value", category))
 
         if category:
  
@@ -207,7 +339,8 @@ async def create_report(
                 "title": extracted_title, 
                 "severity": result.get("severity"),
                 "ai_analysis": result.get("aiAnalysis"),
-                "tool":tool
+                "tool":tool,
+                "degraded": bool(result.get("degraded"))
 
             }
         else:
@@ -223,6 +356,7 @@ async def create_report(
         raise HTTPException(status_code=500, detail=f"Orchestration Failed: {str(e)}")
 @app.post("/agent1")
 async def chat_endpoint(req: ChatRequest):
+    tracer.tag(roomId=req.roomId, userId=req.currentUserId)
     try:
         initial_state = {
             "roomId": req.roomId,
@@ -230,43 +364,51 @@ async def chat_endpoint(req: ChatRequest):
             "currentUserMessage": req.currentUserMessage,
             "currentUserId": req.currentUserId
         }
-        config = {"configurable": {"thread_id": req.roomId}}
-        
-        # Invoke the LangGraph agent
-        final_state = await app_graph.ainvoke(initial_state, config=config)
-        decision = final_state["final_model_score"]
-        
-        return {
-            "status": "success",
-            "final_score": decision.final_safety_score,
-            "trigger_sos": decision.trigger_sos, 
-            "sos_context": decision.sos_context,
-            "analysis": decision.reason,
-            "details": {
-                "sentiment": final_state.get("model_1"),
-                "urgency": final_state.get("model_2"),
-                "severity": final_state.get("model_3")
-            }
-        }
+        mode = req.scoringMode if req.scoringMode in SCORING_MODES else DEFAULT_SCORING_MODE
+        return await evaluate_chat(initial_state, mode)
     except Exception as e:
         print(f"Error in Chat Endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/surveillance/batch")
+async def surveillance_batch(request: Request):
+    """
+    Route surveillance sweep over a RouteBatchRequest body of any size.
+    The body is parsed and evaluated incrementally; the response streams NDJSON,
+    one line per flagged route as its alert is raised, then a summary line.
+    """
+    body_read = asyncio.Event()
+    lines = stream_surveillance(request.stream(), body_read)
+    try:
+        # A body that is malformed before anything is flagged still gets a 400
+        first = await anext(lines)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid surveillance payload: {e}")
+    return BodyStreamingResponse(resume_stream(first, lines), body_read, media_type="application/x-ndjson")
+
 @app.post("/throttle")
 async def throttle_push(req: ThrottleRequest):
+    tracer.tag(userId=req.userId, routeId=req.routeId)
+    # Over the limit the alert is still persisted; only the AI analysis is skipped
+    rate_limited = not throttle_limiter.allow(req.userId)
     try:
         initial_state = {
             "userId": req.userId,
             "routeId": req.routeId,
             "message": req.message, 
-            "context": None          
+            "context": None,
+            # Both alert writes target this id, so a retried write cannot create a second alert
+            "alertId": uuid.uuid4().hex,
+            "startedAt": time.perf_counter(),
+            "skipAnalysis": rate_limited
         }
         result = await analyze_emergency.ainvoke(initial_state)  
         final_msg = result.get("context", "No analysis generated")
         
         return {
             "status": "Emergency Marked",
-            "ai_analysis": final_msg
+            "ai_analysis": final_msg,
+            "rate_limited": rate_limited
         }
     except Exception as e:
         print(f"Error in throttle agent: {e}")
@@ -0,0 +1,147 @@
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from langchain_google_genai import ChatGoogleGenerativeAI
+from pydantic import BaseModel
+
+from circuit_breaker import CircuitOpenError, llm_breaker
+from metrics import metrics
+from tracing import tracer
+
+# --- CONFIG ---
+# Model tiers, cheapest first. Every LLM call site picks its models from here.
+MODEL_TIERS: Dict[str, str] = {
+    "lite": os.getenv("MODEL_TIER_LITE", "gemini-2.0-flash-lite"),
+    "flash": os.getenv("MODEL_TIER_FLASH", "gemini-2.0-flash"),
+    "pro": os.getenv("MODEL_TIER_PRO", "gemini-2.5-pro"),
+}
+
+# List prices in USD per 1M input/output tokens, for per-request cost totals. Override with MODEL_PRICE_<TIER>="in,out".
+MODEL_PRICES: Dict[str, tuple] = {
+    tier: tuple(float(x) for x in os.getenv(f"MODEL_PRICE_{tier.upper()}", default).split(","))
+    for tier, default in (("lite", "0.075,0.30"), ("flash", "0.10,0.40"), ("pro", "1.25,10.00"))
+}
+
+# Tiers tried in order by each cascading call site. Override with MODEL_CASCADE_<SITE>="lite,flash".
+DEFAULT_CASCADES: Dict[str, List[str]] = {
+    "report_category": ["lite", "flash"],
+    "report_judge": ["lite", "flash"],
+    "chat_scores": ["lite", "flash"],
+    "chat_judge": ["flash", "pro"],
+    "waste_resolution": ["flash", "pro"],
+}
+
+# Confidence inside this band is treated as a coin flip and escalated
+AMBIGUOUS_LOW = float(os.getenv("MODEL_CASCADE_AMBIGUOUS_LOW", "0.35"))
+AMBIGUOUS_HIGH = float(os.getenv("MODEL_CASCADE_AMBIGUOUS_HIGH", "0.65"))
+
+_models: Dict[tuple, ChatGoogleGenerativeAI] = {}
+
+
+def chat_model(tier: str = "flash", **kwargs) -> ChatGoogleGenerativeAI:
+    """Shared client for a tier (temperature 0, two retries unless overridden)."""
+    options = {"temperature": 0, "max_retries": 2, **kwargs}
+    key = (tier, tuple(sorted(options.items())))
+    if key not in _models:
+        _models[key] = ChatGoogleGenerativeAI(model=MODEL_TIERS[tier], **options)
+    return _models[key]
+
+
+async def guarded_ainvoke(runnable, prompt, tier: str = "flash", site: Optional[str] = None):
+    """
+    One LLM call through the shared circuit breaker, traced with its token usage.
+    Raises CircuitOpenError while the circuit is open.
+    """
+    with tracer.span(f"LLM {site or tier}", kind="client", **{"llm.site": site, "llm.tier": tier}) as span:
+        async with llm_breaker.guard():
+            result = await runnable.ainvoke(prompt)
+        # Structured calls are made with include_raw=True so the usage stays visible
+        raw = result.get("raw") if isinstance(result, dict) else result
+        tracer.record_llm(span, MODEL_TIERS[tier], getattr(raw, "usage_metadata", None), MODEL_PRICES.get(tier))
+        return result
+
+
+def cascade_tiers(site: str) -> List[str]:
+    configured = os.getenv(f"MODEL_CASCADE_{site.upper()}")
+    tiers = [t.strip() for t in configured.split(",") if t.strip()] if configured else DEFAULT_CASCADES[site]
+    unknown = [t for t in tiers if t not in MODEL_TIERS]
+    if unknown:
+        raise ValueError(f"Unknown model tier(s) {unknown} for cascade '{site}'")
+    return tiers
+
+
+def in_ambiguous_band(confidence: float) -> bool:
+    return AMBIGUOUS_LOW <= confidence <= AMBIGUOUS_HIGH
+
+
+class Cascade:
+    """
+    Calls the site's tiers cheapest first and escalates to the next tier when
+    the call fails, the output does not parse/validate (`parse` raises or a
+    structured call returns None), or `accept(result)` is False (low confidence,
+    ambiguous scores). The last tier's answer is returned as is; its errors propagate.
+    Every call goes through the shared circuit breaker; CircuitOpenError is
+    raised straight away rather than escalated.
+
+    Metrics: llm_<site>_calls, llm_<site>_escalations (+ _invalid / _rejected),
+    llm_<site>_escalation_rate and llm_<site>_<tier>_seconds.
+    """
+
+    def __init__(
+        self,
+        site: str,
+        schema: Optional[Type[BaseModel]] = None,
+        parse: Optional[Callable[[Any], Any]] = None,
+        accept: Optional[Callable[[Any], bool]] = None,
+    ):
+        self.site = site
+        self.tiers = cascade_tiers(site)
+        self.parse = parse
+        self.accept = accept
+        self.runnables = [
+            chat_model(tier).with_structured_output(schema, include_raw=True) if schema else chat_model(tier)
+            for tier in self.tiers
+        ]
+        metrics.gauge(f"llm_{site}_escalation_rate", self.escalation_rate)
+
+    def escalation_rate(self) -> float:
+        calls = metrics.value(f"llm_{self.site}_calls")
+        return round(metrics.value(f"llm_{self.site}_escalations") / calls, 4) if calls else 0.0
+
+    def _escalate(self, reason: str):
+        metrics.inc(f"llm_{self.site}_escalations")
+        metrics.inc(f"llm_{self.site}_escalations_{reason}")
+
+    async def ainvoke(self, prompt, accept: Optional[Callable[[Any], bool]] = None, start: int = 0):
+        """`start` skips the cheaper tiers, for callers that already saw them fail to decide."""
+        accept = accept or self.accept
+        metrics.inc(f"llm_{self.site}_calls")
+        last = len(self.runnables) - 1
+        start = min(start, last)
+        for i, (tier, runnable) in enumerate(zip(self.tiers, self.runnables)):
+            if i < start:
+                continue
+            started = time.perf_counter()
+            try:
+                result = await guarded_ainvoke(runnable, prompt, tier, self.site)
+                if isinstance(result, dict) and "parsed" in result:
+                    if result.get("parsing_error"):
+                        raise result["parsing_error"]
+                    result = result["parsed"]
+                if self.parse:
+                    result = self.parse(result)
+                if result is None:
+                    raise ValueError("empty structured output")
+            except Exception as e:
+                if i == last or isinstance(e, CircuitOpenError):
+                    raise
+                print(f"{self.site}: tier '{tier}' output invalid, escalating: {e}")
+                self._escalate("invalid")
+                continue
+            finally:
+                metrics.observe(f"llm_{self.site}_{tier}_seconds", time.perf_counter() - started)
+            if i < last and accept is not None and not accept(result):
+                self._escalate("rejected")
+                continue
+            return result
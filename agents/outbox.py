@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import random
+import sqlite3
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from metrics import metrics
+
+# --- CONFIG ---
+OUTBOX_ENABLED = os.getenv("REPORT_OUTBOX", "0").lower() in ("1", "true", "yes")
+OUTBOX_PATH = os.getenv("REPORT_OUTBOX_PATH", os.path.join(os.path.dirname(__file__), ".outbox", "outbox.sqlite3"))
+OUTBOX_BATCH_SIZE = int(os.getenv("REPORT_OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("REPORT_OUTBOX_MAX_ATTEMPTS", "12"))
+OUTBOX_BASE_DELAY = float(os.getenv("REPORT_OUTBOX_BASE_DELAY", "1.0"))
+OUTBOX_MAX_DELAY = float(os.getenv("REPORT_OUTBOX_MAX_DELAY", "300"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("REPORT_OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_RETENTION = float(os.getenv("REPORT_OUTBOX_RETENTION", str(24 * 3600)))
+TIMEOUT = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    delivered_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+def new_outbox_key() -> str:
+    # Also used as the Firestore document id, so it must be path-safe
+    return uuid.uuid4().hex
+
+
+def derive_outbox_key(operation: str, report_id: str, payload: dict, *parts: Optional[str]) -> str:
+    """
+    Deterministic key for one logical write, so a retried submission re-enqueues
+    the same row and the backend sees the same key. Timestamps are left out of
+    the payload hash since they differ on every attempt.
+    """
+    stable = {k: v for k, v in payload.items() if k not in ("updatedAt", "createdAt", "idempotencyKey")}
+    digest = hashlib.sha256(json.dumps(stable, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    raw = "|".join([operation, report_id or "", digest] + [p or "" for p in parts])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class ReportOutbox:
+    """
+    Durable write-behind queue for report save/update POSTs to the Node backend.
+    A write is acknowledged as soon as its row commits; a background thread
+    delivers due rows in batches, retrying with exponential backoff.
+    Every delivery carries its idempotency key so retries are safe.
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool = ThreadPoolExecutor(max_workers=4)
+        self._session = requests.Session()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # --- PRODUCER SIDE ---
+
+    def enqueue(self, kind: str, url: str, payload: dict, key: Optional[str] = None) -> str:
+        """Commits a delivery. Re-enqueueing an existing key is a no-op."""
+        key = key or new_outbox_key()
+        now = time.time()
+        body = json.dumps({**payload, "idempotencyKey": key}, default=str)
+        with self._lock:
+            inserted = self._db().execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, kind, url, payload, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, url, body, now, now),
+            ).rowcount
+        if inserted:
+            metrics.inc(f"outbox_enqueued_{kind}")
+            self._wake.set()
+        return key
+
+    # --- DISPATCHER SIDE ---
+
+    def _due(self, limit: int) -> List[tuple]:
+        with self._lock:
+            return self._db().execute(
+                "SELECT id, idempotency_key, kind, url, payload, attempts, created_at FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+
+    def _deliver(self, row: tuple):
+        row_id, key, kind, url, payload, attempts, created_at = row
+        try:
+            response = self._session.post(
+                url,
+                data=payload,
+                headers={"Content-Type": "application/json", "Idempotency-Key": key},
+                timeout=TIMEOUT,
+            )
+            if response.status_code < 300:
+                self._mark_delivered(row_id, created_at)
+                return
+            # Client errors will not fix themselves, except timeouts/throttling
+            permanent = 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+            self._mark_failed(row_id, attempts, f"HTTP {response.status_code}: {response.text[:200]}", permanent)
+        except Exception as e:
+            self._mark_failed(row_id, attempts, str(e), False)
+
+    def _mark_delivered(self, row_id: int, created_at: float):
+        now = time.time()
+        with self._lock:
+            self._db().execute(
+                "UPDATE outbox SET status = 'delivered', delivered_at = ?, last_error = NULL WHERE id = ?",
+                (now, row_id),
+            )
+        metrics.inc("outbox_delivered")
+        metrics.observe("outbox_delivery_lag_seconds", now - created_at)
+
+    def _mark_failed(self, row_id: int, attempts: int, error: str, permanent: bool):
+        attempts += 1
+        if permanent or attempts >= OUTBOX_MAX_ATTEMPTS:
+            status, next_at = "dead", time.time()
+            metrics.inc("outbox_dead")
+            print(f"Outbox delivery {row_id} gave up after {attempts} attempts: {error}")
+        else:
+            delay = min(OUTBOX_MAX_DELAY, OUTBOX_BASE_DELAY * (2 ** (attempts - 1)))
+            status, next_at = "pending", time.time() + delay * random.uniform(0.5, 1.0)
+            metrics.inc("outbox_retries")
+        with self._lock:
+            self._db().execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (status, attempts, next_at, error[:500], row_id),
+            )
+
+    def dispatch_once(self) -> int:
+        """Delivers one batch of due rows. Returns how many were attempted."""
+        rows = self._due(OUTBOX_BATCH_SIZE)
+        if rows:
+            list(self._pool.map(self._deliver, rows))
+        return len(rows)
+
+    def _purge_delivered(self):
+        with self._lock:
+            self._db().execute(
+                "DELETE FROM outbox WHERE status = 'delivered' AND delivered_at < ?",
+                (time.time() - OUTBOX_RETENTION,),
+            )
+
+    def _run(self):
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                attempted = self.dispatch_once()
+                if time.time() - last_purge > 600:
+                    self._purge_delivered()
+                    last_purge = time.time()
+            except Exception as e:
+                print(f"Outbox dispatcher error: {e}")
+                attempted = 0
+            if not attempted:
+                self._wake.wait(OUTBOX_POLL_INTERVAL)
+                self._wake.clear()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="report-outbox", daemon=True)
+        self._thread.start()
+        print(f"📮 Report outbox dispatcher started ({self.path})")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    # --- METRICS ---
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def oldest_pending_age(self) -> float:
+        with self._lock:
+            oldest = self._db().execute("SELECT MIN(created_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+        return round(time.time() - oldest, 3) if oldest else 0.0
+
+    def dead_letters(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM outbox WHERE status = 'dead'").fetchone()[0]
+
+
+report_outbox = ReportOutbox()
+
+if OUTBOX_ENABLED:
+    metrics.gauge("outbox_depth", report_outbox.depth)
+    metrics.gauge("outbox_oldest_pending_seconds", report_outbox.oldest_pending_age)
+    metrics.gauge("outbox_dead_letters", report_outbox.dead_letters)
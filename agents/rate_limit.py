@@ -0,0 +1,94 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from fastapi import HTTPException
+
+from metrics import metrics
+
+MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "50000"))
+
+
+class TokenBucketLimiter:
+    """
+    Per-caller token bucket.
+    Buckets live in an LRU ordered dict; a bucket that has been idle long enough
+    to refill completely is indistinguishable from a new one, so it is evicted.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: int, max_buckets: int = MAX_BUCKETS):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_buckets = max_buckets
+        self.enabled = per_minute > 0
+        self.idle_ttl = self.burst / self.rate if self.rate > 0 else 0.0
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.gauge(f"rate_limit_{name}_buckets", lambda: len(self._buckets))
+
+    def _evict(self, now: float):
+        while self._buckets:
+            key, (_, last) = next(iter(self._buckets.items()))
+            if now - last < self.idle_ttl and len(self._buckets) <= self.max_buckets:
+                break
+            self._buckets.popitem(last=False)
+
+    def acquire(self, key: str) -> float:
+        """Takes one token. Returns 0 when allowed, otherwise seconds until a token is available."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+            else:
+                tokens, last = bucket
+                bucket[0] = min(self.burst, tokens + (now - last) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                retry_after = 0.0
+            else:
+                retry_after = (1.0 - bucket[0]) / self.rate
+            self._evict(now)
+        return retry_after
+
+    def allow(self, key: str) -> bool:
+        """Non-raising check for callers that degrade (skip the costly work) instead of rejecting."""
+        if self.acquire(key or "anonymous") > 0:
+            metrics.inc(f"rate_limit_{self.name}_degraded")
+            return False
+        return True
+
+    def enforce(self, key: str):
+        """Raises a 429 with Retry-After when the caller is over its limit."""
+        retry_after = self.acquire(key or "anonymous")
+        if retry_after > 0:
+            metrics.inc(f"rate_limit_{self.name}_rejected")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please slow down.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+def limiter_from_env(name: str, per_minute: float, burst: int) -> TokenBucketLimiter:
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    return TokenBucketLimiter(
+        name,
+        per_minute=float(os.getenv(f"{prefix}_PER_MIN", per_minute)),
+        burst=int(os.getenv(f"{prefix}_BURST", burst)),
+    )
+
+
+# Set *_PER_MIN to 0 to disable a limiter.
+# chat and throttle never reject: over the limit they skip the LLM work but still
+# detect SOS / persist the alert (see chat_service.evaluate_chat and agent3).
+reports_limiter = limiter_from_env("reports", per_minute=6, burst=3)
+chat_limiter = limiter_from_env("chat", per_minute=30, burst=10)
+throttle_limiter = limiter_from_env("throttle", per_minute=6, burst=3)
@@ -0,0 +1,261 @@
+"""
+Offline bulk reclassification of historical reports.
+
+Streams report records from a JSONL/NDJSON export through the classification
+part of the orchestrator (specialists + judge) only. Nothing is saved or updated
+in the backend.
+
+Usage (from the agents/ directory):
+    python reclassify.py reports.jsonl --output reclassified.jsonl --report diff.json
+
+The output file doubles as the checkpoint: re-running the same command skips
+every record that already has a successful result.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from typing import Dict, Iterator, Optional, Set
+
+from brain.orchestrator import classification_app
+
+RATE_LIMIT_MARKERS = ("429", "resourceexhausted", "resource_exhausted", "quota", "rate limit")
+
+
+def record_id(record: dict) -> Optional[str]:
+    return record.get("reportId") or record.get("id")
+
+
+def enum_value(value) -> Optional[str]:
+    value = getattr(value, "value", value)
+    return str(value).upper() if value else None
+
+
+def iter_records(path: str) -> Iterator[dict]:
+    """Yields one record per non-empty line without loading the export into memory."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping malformed line {line_no}: {e}")
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    done = set()
+    if not os.path.exists(path):
+        return done
+    for result in iter_records(path):
+        if result.get("id") and not result.get("error"):
+            done.add(result["id"])
+    return done
+
+
+class RateGate:
+    """
+    Shared pacing for all workers.
+    Enforces a minimum spacing between record starts and a global pause
+    whenever any worker hits a rate limit, backing off exponentially.
+    """
+
+    def __init__(self, records_per_minute: float, base_backoff: float = 5.0, max_backoff: float = 120.0):
+        self.interval = 60.0 / records_per_minute if records_per_minute > 0 else 0.0
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._next_start = 0.0
+        self._paused_until = 0.0
+        self._consecutive_limits = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_start, self._paused_until)
+            self._next_start = start_at + self.interval
+        delay = start_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def rate_limited(self):
+        self._consecutive_limits += 1
+        backoff = min(self.max_backoff, self.base_backoff * (2 ** (self._consecutive_limits - 1)))
+        self._paused_until = max(self._paused_until, time.monotonic() + backoff)
+        print(f"Rate limited, pausing all workers for {backoff:.0f}s")
+
+    def succeeded(self):
+        self._consecutive_limits = 0
+
+
+def looks_rate_limited(result: dict) -> bool:
+    # Specialists swallow their exceptions into the analysis reasoning
+    texts = [result.get("aiAnalysis") or ""]
+    for key in ("water_analysis", "waste_analysis", "infra_analysis", "electric_analysis"):
+        analysis = result.get(key)
+        if analysis is not None:
+            texts.append(getattr(analysis, "reasoning", "") or "")
+    blob = " ".join(texts).lower()
+    return any(marker in blob for marker in RATE_LIMIT_MARKERS)
+
+
+async def classify(record: dict) -> dict:
+    initial_state = {
+        "userId": record.get("userId"),
+        "imageUrl": record["imageUrl"],
+        "description": record.get("description") or "",
+        "geohash": record.get("geohash"),
+        "water_analysis": None,
+        "waste_analysis": None,
+        "infra_analysis": None,
+        "electric_analysis": None,
+        "uncertain_analysis": None,
+        "aiAnalysis": None,
+        "severity": None,
+        "assigned_category": None,
+        "route": "",
+        "updatedRoute": "",
+    }
+    return await classification_app.ainvoke(initial_state)
+
+
+async def process(record: dict, gate: RateGate, max_retries: int) -> dict:
+    rid = record_id(record)
+    old_category = enum_value(record.get("assigned_category") or record.get("category"))
+    old_severity = enum_value(record.get("severity"))
+    entry = {"id": rid, "old_category": old_category, "old_severity": old_severity}
+
+    if not record.get("imageUrl"):
+        return {**entry, "error": "missing imageUrl"}
+
+    for attempt in range(max_retries + 1):
+        await gate.acquire()
+        try:
+            result = await classify(record)
+        except Exception as e:
+            if any(m in str(e).lower() for m in RATE_LIMIT_MARKERS):
+                gate.rate_limited()
+                continue
+            return {**entry, "error": str(e)}
+
+        # A degraded UNCERTAIN verdict means the LLM circuit is open; wait and retry instead of recording it
+        if looks_rate_limited(result) or result.get("degraded"):
+            gate.rate_limited()
+            continue
+
+        gate.succeeded()
+        new_category = enum_value(result.get("assigned_category"))
+        new_severity = enum_value(result.get("severity"))
+        return {
+            **entry,
+            "new_category": new_category,
+            "new_severity": new_severity,
+            "aiAnalysis": result.get("aiAnalysis"),
+            "category_changed": new_category != old_category,
+            "severity_changed": new_severity != old_severity,
+        }
+
+    return {**entry, "error": f"rate limited after {max_retries + 1} attempts"}
+
+
+def build_diff_report(output_path: str) -> dict:
+    """Summarises the latest result per report id from the output file."""
+    latest: Dict[str, dict] = {}
+    for result in iter_records(output_path):
+        if result.get("id"):
+            latest[result["id"]] = result
+
+    ok = [r for r in latest.values() if not r.get("error")]
+    category_moves = Counter(
+        f"{r['old_category']} -> {r['new_category']}" for r in ok if r.get("category_changed")
+    )
+    severity_moves = Counter(
+        f"{r['old_severity']} -> {r['new_severity']}" for r in ok if r.get("severity_changed")
+    )
+    return {
+        "total": len(latest),
+        "classified": len(ok),
+        "failed": len(latest) - len(ok),
+        "category_changed": sum(1 for r in ok if r.get("category_changed")),
+        "severity_changed": sum(1 for r in ok if r.get("severity_changed")),
+        "category_transitions": dict(category_moves.most_common()),
+        "severity_transitions": dict(severity_moves.most_common()),
+        "changed_ids": sorted(r["id"] for r in ok if r.get("category_changed") or r.get("severity_changed")),
+    }
+
+
+async def run(args):
+    done = load_checkpoint(args.output)
+    if done:
+        print(f"Resuming: {len(done)} records already classified")
+
+    gate = RateGate(args.rpm)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    stats = Counter()
+    started = time.monotonic()
+
+    with open(args.output, "a", encoding="utf-8") as out:
+
+        async def worker():
+            while True:
+                record = await queue.get()
+                if record is None:
+                    queue.task_done()
+                    return
+                result = await process(record, gate, args.max_retries)
+                out.write(json.dumps(result, default=str) + "\n")
+                out.flush()
+                stats["failed" if result.get("error") else "classified"] += 1
+                finished = stats["classified"] + stats["failed"]
+                if finished % 50 == 0:
+                    rate = finished / (time.monotonic() - started)
+                    print(f"Progress: {finished} done, {stats['failed']} failed ({rate:.2f} records/s)")
+                queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+        for record in iter_records(args.input):
+            rid = record_id(record)
+            if not rid:
+                stats["skipped_no_id"] += 1
+                continue
+            if rid in done:
+                continue
+            done.add(rid)
+            await queue.put(record)
+            stats["queued"] += 1
+            if args.limit and stats["queued"] >= args.limit:
+                break
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    report = build_diff_report(args.output)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Done: {report['classified']} classified, {report['failed']} failed, "
+          f"{report['category_changed']} category changes, {report['severity_changed']} severity changes")
+    print(f"Diff report written to {args.report}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-run report classification over a JSONL export.")
+    parser.add_argument("input", help="JSONL/NDJSON export of report records")
+    parser.add_argument("--output", default="reclassified.jsonl", help="Per-record results; also the resume checkpoint")
+    parser.add_argument("--report", default="reclassify_diff.json", help="Summary of changed categories and severities")
+    parser.add_argument("--concurrency", type=int, default=4, help="Records classified in parallel")
+    parser.add_argument("--rpm", type=float, default=60, help="Max records started per minute (0 = unlimited)")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries per record after a rate limit")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after this many new records (0 = all)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run(parse_args()))
+    except KeyboardInterrupt:
+        print("Interrupted; re-run the same command to resume.")
+        sys.exit(130)
@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import List, Optional
+
+from PIL import Image, ImageOps
+from pydantic import BaseModel
+
+# --- CONFIG ---
+ARTIFACTS_DIR = os.getenv("REPORT_ARTIFACTS_DIR", os.path.join(os.path.dirname(__file__), ".artifacts"))
+# Only categories that are verified again later need artifacts
+ARTIFACT_CATEGORIES = set(os.getenv("REPORT_ARTIFACT_CATEGORIES", "WASTE").split(","))
+THUMBNAIL_MAX_SIDE = int(os.getenv("REPORT_ARTIFACT_THUMBNAIL_SIDE", "384"))
+THUMBNAIL_QUALITY = 80
+STAGED_MAX = 64
+# Resolution deletes a report's artifacts; this bounds the ones never resolved (0 keeps them forever)
+ARTIFACT_TTL_DAYS = float(os.getenv("REPORT_ARTIFACT_TTL_DAYS", "180"))
+PURGE_INTERVAL_SECONDS = 3600
+
+
+def artifact_key(image_url: str) -> str:
+    return hashlib.sha1(image_url.encode("utf-8")).hexdigest()
+
+
+def make_thumbnail(img: Image.Image) -> bytes:
+    """Upright RGB JPEG, longest side THUMBNAIL_MAX_SIDE."""
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((THUMBNAIL_MAX_SIDE, THUMBNAIL_MAX_SIDE), Image.BILINEAR)
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+class ReportArtifact(BaseModel):
+    imageUrl: str
+    reportId: Optional[str] = None
+    category: Optional[str] = None
+    fingerprint: Optional[List[float]] = None
+    analysis: Optional[dict] = None
+    createdAt: str
+
+
+class ArtifactStore:
+    """
+    Compact per-report artifacts written at submission and read at resolution:
+    a normalized thumbnail, the image fingerprint and the category agent's analysis.
+    Files are keyed by sha1(imageUrl): <root>/<key[:2]>/<key>.json and .jpg.
+    They are deleted when the report is resolved; files older than ARTIFACT_TTL_DAYS
+    are purged in the background, at most once per PURGE_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, root: str = ARTIFACTS_DIR):
+        self.root = root
+        # Thumbnails made while the image is in memory (locality check), used by save()
+        self._staged: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    def stage_thumbnail(self, image_url: str, img: Optional[Image.Image]):
+        if not image_url or img is None:
+            return
+        try:
+            thumb = make_thumbnail(img)
+        except Exception as e:
+            print(f"Thumbnail failed for {image_url}: {e}")
+            return
+        with self._lock:
+            self._staged[image_url] = thumb
+            while len(self._staged) > STAGED_MAX:
+                self._staged.popitem(last=False)
+
+    def save(self, image_url: str, report_id: Optional[str], category: Optional[str],
+             fingerprint=None, analysis=None, img: Optional[Image.Image] = None) -> bool:
+        if not image_url or category not in ARTIFACT_CATEGORIES:
+            return False
+        with self._lock:
+            thumb = self._staged.pop(image_url, None)
+        if thumb is None and img is not None:
+            thumb = make_thumbnail(img)
+        if thumb is None:
+            return False
+
+        key = artifact_key(image_url)
+        artifact = ReportArtifact(
+            imageUrl=image_url,
+            reportId=report_id,
+            category=category,
+            fingerprint=[float(x) for x in fingerprint] if fingerprint is not None else None,
+            analysis=analysis.model_dump() if hasattr(analysis, "model_dump") else analysis,
+            createdAt=datetime.now(timezone.utc).isoformat(),
+        )
+        os.makedirs(os.path.dirname(self._path(key, "json")), exist_ok=True)
+        # Write-then-rename so a reader never sees a partial file
+        for ext, data in (("jpg", thumb), ("json", artifact.model_dump_json().encode("utf-8"))):
+            tmp = self._path(key, ext) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key, ext))
+        self._maybe_purge()
+        return True
+
+    def load(self, image_url: str) -> Optional[ReportArtifact]:
+        if not image_url:
+            return None
+        try:
+            with open(self._path(artifact_key(image_url), "json"), "rb") as f:
+                return ReportArtifact.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Unreadable artifact for {image_url}: {e}")
+            return None
+
+    def thumbnail_bytes(self, image_url: str) -> Optional[bytes]:
+        try:
+            with open(self._path(artifact_key(image_url), "jpg"), "rb") as f:
+                return f.read()
+        except (FileNotFoundError, TypeError, AttributeError):
+            return None
+
+    def thumbnail_data_url(self, image_url: str) -> Optional[str]:
+        data = self.thumbnail_bytes(image_url)
+        return f"data:image/jpeg;base64,{base64.b64encode(data).decode('ascii')}" if data else None
+
+    def thumbnail_image(self, image_url: str) -> Optional[Image.Image]:
+        data = self.thumbnail_bytes(image_url)
+        return Image.open(BytesIO(data)) if data else None
+
+    def delete(self, image_url: str):
+        key = artifact_key(image_url)
+        for ext in ("json", "jpg"):
+            try:
+                os.remove(self._path(key, ext))
+            except FileNotFoundError:
+                pass
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        with self._lock:
+            if ARTIFACT_TTL_DAYS <= 0 or now - self._last_purge < PURGE_INTERVAL_SECONDS:
+                return
+            self._last_purge = now
+        threading.Thread(target=self.purge_expired, name="artifact-purge", daemon=True).start()
+
+    def purge_expired(self, ttl_days: float = ARTIFACT_TTL_DAYS) -> int:
+        """Removes artifact files older than ttl_days. Returns the number of files removed."""
+        cutoff = time.time() - ttl_days * 86400
+        removed = 0
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            print(f"Purged {removed} expired report artifact files")
+        return removed
+
+
+report_artifacts = ArtifactStore()
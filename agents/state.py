@@ -42,6 +42,7 @@ class AgentState(TypedDict):
     locality_email:Optional[str]
     locality_userId:Optional[str]
     locality_reportId:Optional[str]
+    locality_geohash:Optional[str]
     water_analysis: Optional[AgentAnalysis]
     waste_analysis: Optional[AgentAnalysis]
     infra_analysis: Optional[AgentAnalysis]
@@ -53,4 +54,8 @@ class AgentState(TypedDict):
     status: ReportStatus
     route:str
     updatedRoute:str
-    tool:Literal["SAVE","UPDATE"]
\ No newline at end of file
+    tool:Literal["SAVE","UPDATE"]
+    image_fingerprint:Optional[List[float]]
+    idempotencyKey:Optional[str]
+    # Set when the report was routed without the LLM because its circuit was open
+    degraded:Optional[bool]
\ No newline at end of file
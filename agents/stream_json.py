@@ -0,0 +1,146 @@
+import asyncio
+import codecs
+import json
+from typing import Any, List, Tuple
+
+from starlette.responses import StreamingResponse
+
+# A single pending token (key or value) larger than this is treated as malformed input
+MAX_PENDING_CHARS = 4 * 1024 * 1024
+_WHITESPACE = " \t\n\r"
+
+
+class ObjectFieldParser:
+    """
+    Incremental parser for a body shaped like {"<field>": {"k1": v1, "k2": v2, ...}, ...}.
+    Bytes are fed as they arrive; complete (key, value) pairs of the inner
+    object are returned as soon as they are parsed, so the whole body is never
+    held in memory. Other top-level fields are skipped.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        # start -> outer_key -> (skip_value | inner) -> ... -> done
+        self._state = "start"
+        self._found = False
+
+    def _skip_ws(self) -> bool:
+        while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+            self._pos += 1
+        return self._pos < len(self._buf)
+
+    def _expect(self, ch: str) -> bool:
+        if not self._skip_ws():
+            return False
+        if self._buf[self._pos] != ch:
+            raise ValueError(f"Expected '{ch}' at offset {self._pos}, got '{self._buf[self._pos]}'")
+        self._pos += 1
+        return True
+
+    def _decode(self):
+        """Returns (ok, value). ok=False means more input is needed."""
+        if not self._skip_ws():
+            return False, None
+        try:
+            value, end = self._decoder.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError:
+            if len(self._buf) - self._pos > MAX_PENDING_CHARS:
+                raise ValueError("JSON token too large or malformed")
+            return False, None
+        # A number at the very end of the buffer may still be growing
+        if end >= len(self._buf):
+            return False, None
+        self._pos = end
+        return True, value
+
+    def feed(self, data: bytes) -> List[Tuple[str, Any]]:
+        self._buf = self._buf[self._pos:] + self._utf8.decode(data)
+        self._pos = 0
+        pairs = []
+        while True:
+            mark = self._pos
+            if self._state == "start":
+                if not self._expect("{"):
+                    break
+                self._state = "outer_key"
+            elif self._state == "outer_key":
+                if not self._skip_ws():
+                    break
+                if self._buf[self._pos] in ",":
+                    self._pos += 1
+                    continue
+                if self._buf[self._pos] == "}":
+                    self._pos += 1
+                    self._state = "done"
+                    continue
+                ok, key = self._decode()
+                if not ok or not self._expect(":"):
+                    self._pos = mark
+                    break
+                if key == self.field:
+                    if not self._expect("{"):
+                        self._pos = mark
+                        break
+                    self._found = True
+                    self._state = "inner"
+                else:
+                    self._state = "skip_value"
+            elif self._state == "skip_value":
+                ok, _ = self._decode()
+                if not ok:
+                    break
+                self._state = "outer_key"
+            elif self._state == "inner":
+                if not self._skip_ws():
+                    break
+                ch = self._buf[self._pos]
+                if ch == ",":
+                    self._pos += 1
+                    continue
+                if ch == "}":
+                    self._pos += 1
+                    self._state = "outer_key"
+                    continue
+                ok, key = self._decode()
+                if not ok or not self._expect(":"):
+                    self._pos = mark
+                    break
+                ok, value = self._decode()
+                if not ok:
+                    self._pos = mark
+                    break
+                pairs.append((key, value))
+            else:  # done
+                self._skip_ws()
+                break
+        return pairs
+
+    def close(self):
+        """Raises if the body ended before the object was complete."""
+        self._buf = self._buf[self._pos:] + self._utf8.decode(b"", final=True)
+        self._pos = 0
+        if self._state != "done" or self._skip_ws():
+            raise ValueError("Incomplete or malformed JSON body")
+        if not self._found:
+            raise ValueError(f"Body has no '{self.field}' object")
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose content is produced while the request body is still
+    being read. Starlette's disconnect listener shares receive() with the body
+    reader and would swallow body chunks, so it only starts once `body_read` is set.
+    Until then a client disconnect surfaces in the body reader itself.
+    """
+
+    def __init__(self, content, body_read: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+    async def listen_for_disconnect(self, receive):
+        await self.body_read.wait()
+        await super().listen_for_disconnect(receive)
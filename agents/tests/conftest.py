@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules are imported the way main.py imports them, from the agents/ directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The model clients are created at import time; no request is made in these tests
+os.environ.setdefault("GOOGLE_API_KEY", "test")
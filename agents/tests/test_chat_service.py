@@ -0,0 +1,55 @@
+import asyncio
+
+from brain import chat_service
+from brain.layel_1 import FinalScore, SentimentScore, SeverityScore, UrgencyScore
+from brain.room_context import room_context
+from brain.verdict_cache import CLEAN_HISTORY, verdict_cache
+
+SAFE = (
+    SentimentScore(sentiment_score=0.8, reason="friendly"),
+    UrgencyScore(urgency_score=0.0, reason="none"),
+    SeverityScore(severity_score=0.0, reason="none"),
+)
+SUSPICIOUS = (
+    SentimentScore(sentiment_score=0.2, reason="pushy"),
+    UrgencyScore(urgency_score=0.1, reason="none"),
+    SeverityScore(severity_score=0.6, reason="unwanted requests"),
+)
+
+
+def fake_graph(verdicts, seen):
+    """Stands in for the LLM graph: returns the next scripted verdict, records the state it got."""
+    async def run_graph(state, mode, job=None):
+        seen.append(state)
+        scores, score = verdicts.pop(0)
+        decision = FinalScore(final_safety_score=score, trigger_sos=False, reason="scripted", sos_context="")
+        model_1, model_2, model_3 = (state["model_1"], state["model_2"], state["model_3"]) if state["model_1"] else scores
+        return {"final_model_score": decision, "model_1": model_1, "model_2": model_2, "model_3": model_3}
+    return run_graph
+
+
+def chat(room_id, message):
+    state = {"roomId": room_id, "currentUserId": "u1", "currentUserMessage": message, "messages": []}
+    return asyncio.run(chat_service.evaluate_chat(state, "parallel"))
+
+
+def test_suspicious_verdict_makes_the_room_bypass_the_cache(monkeypatch):
+    seen = []
+    monkeypatch.setattr(chat_service, "run_graph", fake_graph(
+        [(SAFE, 9.0), (SUSPICIOUS, 5.5), (SAFE, 9.0)], seen,
+    ))
+    monkeypatch.setattr(chat_service, "track_route", lambda room_id, score: None)
+
+    # A clean room caches the safe sub-scores of a short message
+    chat("room-clean", "where are you now")
+    assert verdict_cache.get("where are you now", CLEAN_HISTORY) is not None
+
+    # No risk terms, but the model judges it suspicious: the room is flagged, nothing is cached
+    chat("room-flagged", "send me your pic")
+    assert room_context.has_prior_risk("room-flagged")
+    assert verdict_cache.get("send me your pic", CLEAN_HISTORY) is None
+
+    # The cached message is evaluated afresh in the flagged room
+    response = chat("room-flagged", "where are you now")
+    assert "cached_scores" not in response
+    assert seen[-1]["model_1"] is None
@@ -0,0 +1,12 @@
+import pytest
+
+from brain.lexical_screen import screen_message
+
+
+@pytest.mark.parametrize("message", ["please help me", "help me please", "help me!! please someone"])
+def test_plea_with_filler_is_an_emergency_in_any_word_order(message):
+    assert screen_message(message).verdict == "EMERGENCY"
+
+
+def test_plea_in_ordinary_context_goes_to_the_llm():
+    assert screen_message("can you help me with my homework").verdict == "UNKNOWN"
@@ -1,13 +1,7 @@
 import json
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from state import AgentAnalysis, SeverityLevel
-
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash", 
-    temperature=0,
-    max_retries=2
-)
+from models import Cascade, in_ambiguous_band
 
 # --- GLOBAL CONTEXT FOR ALL AGENTS ---
 # This ensures every agent knows they are part of a 4-agent system.
@@ -26,6 +20,24 @@ You must determine if the image falls under YOUR specific jurisdiction.
 - Your 'confidence' score is not just "do I see an object," but "is this MY department's responsibility?"
 """
 
+def parse_agent_analysis(response) -> AgentAnalysis:
+    """Strict parse of a specialist's JSON reply; raises so the cascade can escalate."""
+    raw_content = response.content.replace("```json", "").replace("```", "").strip()
+    data = json.loads(raw_content)
+    return AgentAnalysis(
+        title=data.get("title", "Untitled Analysis"),
+        confidence=float(data["confidence"]),
+        severity=SeverityLevel(data.get("severity", "LOW")),
+        reasoning=data.get("reasoning", "No reasoning provided")
+    )
+
+# Clear in/out-of-jurisdiction answers stay on the cheap tier; the ambiguous band escalates
+category_cascade = Cascade(
+    "report_category",
+    parse=parse_agent_analysis,
+    accept=lambda analysis: not in_ambiguous_band(analysis.confidence),
+)
+
 async def analyze_image_category(
     image_url: str, 
     system_prompt: str,
@@ -72,16 +84,7 @@ async def analyze_image_category(
     )
     
     try:
-        response = await llm.ainvoke([SystemMessage(content=final_system_prompt), message])
-        raw_content = response.content.replace("```json", "").replace("```", "").strip()
-        data = json.loads(raw_content)
-        
-        return AgentAnalysis(
-            title=data.get("title", "Untitled Analysis"), 
-            confidence=float(data.get("confidence", 0.0)),
-            severity=SeverityLevel(data.get("severity", "LOW")), 
-            reasoning=data.get("reasoning", "No reasoning provided")
-        )
+        return await category_cascade.ainvoke([SystemMessage(content=final_system_prompt), message])
 
     except Exception as e:
         print(f" AI Analysis Failed: {e}")
@@ -0,0 +1,315 @@
+import math
+import os
+import threading
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from PIL import Image
+
+# --- CONFIG ---
+VISUAL_INDEX_DIR = os.getenv("VISUAL_INDEX_DIR", os.path.join(os.path.dirname(__file__), ".visual_index"))
+GEOHASH_PREFIX_LEN = int(os.getenv("VISUAL_INDEX_GEOHASH_PREFIX", "5"))
+COMPACT_TOMBSTONE_RATIO = float(os.getenv("VISUAL_INDEX_COMPACT_RATIO", "0.5"))
+
+HASH_SIZE = 8          # 8x8 low-frequency DCT block
+SAMPLE_SIZE = 32       # Images are reduced to 32x32 grayscale before the DCT
+FINGERPRINT_DIM = HASH_SIZE * HASH_SIZE - 1  # DC term is dropped
+# Row layout version; partitions written with an older layout are ignored
+PARTITION_SUFFIX = ".v2.vec"
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_decode(geohash: str) -> Tuple[float, float, float, float]:
+    """(lat, lon, lat_err, lon_err) of a geohash cell's centre."""
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for ch in geohash.lower():
+        bits = _BASE32.index(ch)
+        for shift in range(4, -1, -1):
+            bit = (bits >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2, (lat_hi - lat_lo) / 2, (lon_hi - lon_lo) / 2
+
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    out, bits, n, even = [], 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            bit = lon >= mid
+            lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            bit = lat >= mid
+            lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+        bits = (bits << 1) | int(bit)
+        n += 1
+        even = not even
+        if n == 5:
+            out.append(_BASE32[bits])
+            bits, n = 0, 0
+    return "".join(out)
+
+
+def geohash_neighbors(geohash: str) -> List[str]:
+    """The cell itself plus its (up to) 8 neighbours at the same precision."""
+    lat, lon, lat_err, lon_err = geohash_decode(geohash)
+    cells = []
+    for dlat in (0, 1, -1):
+        for dlon in (0, 1, -1):
+            nlat = lat + 2 * lat_err * dlat
+            if abs(nlat) > 90:
+                continue
+            nlon = (lon + 2 * lon_err * dlon + 180) % 360 - 180
+            cell = geohash_encode(nlat, nlon, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    h = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371e3 * math.asin(math.sqrt(h))
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0, :] = np.sqrt(1.0 / n)
+    return m.astype(np.float32)
+
+
+_DCT = _dct_matrix(SAMPLE_SIZE)
+
+
+def compute_fingerprint(image: Image.Image) -> np.ndarray:
+    """
+    Perceptual (pHash-style) embedding of an image.
+    Low-frequency DCT coefficients, mean-centred and L2-normalised,
+    so cosine similarity == dot product.
+    """
+    gray = image.convert("L").resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.float32)
+    coeffs = _DCT @ pixels @ _DCT.T
+    low = coeffs[:HASH_SIZE, :HASH_SIZE].flatten()[1:]
+    low = low - low.mean()
+    norm = np.linalg.norm(low)
+    if norm == 0:
+        return np.zeros(FINGERPRINT_DIM, dtype=np.float32)
+    return (low / norm).astype(np.float32)
+
+
+ROW_DTYPE = np.dtype([
+    ("report_id", "S64"),
+    ("alive", "u1"),
+    # Owner, contact, geohash and position of the report, so a match can be turned into an update
+    ("user_id", "S64"),
+    ("email", "S128"),
+    ("geohash", "S12"),
+    ("lat", "<f8"),
+    ("lng", "<f8"),
+    ("vec", "<f4", (FINGERPRINT_DIM,)),
+])
+
+
+class Match(NamedTuple):
+    report_id: str
+    score: float
+    user_id: str
+    email: str
+    geohash: str
+    lat: float
+    lng: float
+
+
+class _Partition:
+    """One append-only file of fixed-size rows, read through np.memmap."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mm: Optional[np.memmap] = None
+
+    def rows(self) -> Optional[np.memmap]:
+        if self._mm is None:
+            if not os.path.exists(self.path) or os.path.getsize(self.path) < ROW_DTYPE.itemsize:
+                return None
+            self._mm = np.memmap(self.path, dtype=ROW_DTYPE, mode="r+")
+        return self._mm
+
+    def invalidate(self):
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm = None
+
+    def append(
+        self, report_id: str, vec: np.ndarray, user_id: str = "", email: str = "", geohash: str = "",
+        lat: float = float("nan"), lng: float = float("nan"),
+    ):
+        row = np.zeros(1, dtype=ROW_DTYPE)
+        row["report_id"] = report_id.encode("utf-8")[:64]
+        row["alive"] = 1
+        row["user_id"] = user_id.encode("utf-8")[:64]
+        row["email"] = email.encode("utf-8")[:128]
+        row["geohash"] = geohash.encode("utf-8")[:12]
+        row["lat"], row["lng"] = lat, lng
+        row["vec"] = vec
+        self.invalidate()
+        with open(self.path, "ab") as f:
+            f.write(row.tobytes())
+
+    def delete(self, report_id: str) -> bool:
+        rows = self.rows()
+        if rows is None:
+            return False
+        hits = np.nonzero((rows["report_id"] == report_id.encode("utf-8")[:64]) & (rows["alive"] == 1))[0]
+        if len(hits) == 0:
+            return False
+        rows["alive"][hits] = 0
+        rows.flush()
+        return True
+
+    def tombstone_ratio(self) -> float:
+        rows = self.rows()
+        if rows is None or len(rows) == 0:
+            return 0.0
+        return 1.0 - float(rows["alive"].sum()) / len(rows)
+
+    def compact(self) -> int:
+        rows = self.rows()
+        if rows is None:
+            return 0
+        live = np.array(rows[rows["alive"] == 1])
+        removed = len(rows) - len(live)
+        self.invalidate()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(live.tobytes())
+        os.replace(tmp_path, self.path)
+        return removed
+
+
+class VisualIndex:
+    """
+    Local nearest-neighbour index over report image fingerprints.
+    Partitioned on disk as <root>/<CATEGORY>/<geohash prefix>.v2.vec so a query
+    only scans reports of the same department in its own cell and the 8 cells
+    around it (a report just across a cell boundary is still found).
+    """
+
+    def __init__(self, root: str = VISUAL_INDEX_DIR, prefix_len: int = GEOHASH_PREFIX_LEN):
+        self.root = root
+        self.prefix_len = prefix_len
+        self._partitions: Dict[Tuple[str, str], _Partition] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, geohash: Optional[str], category: Optional[str]) -> Tuple[str, str]:
+        cat = str(getattr(category, "value", category) or "UNCERTAIN").upper()
+        prefix = (geohash or "_")[: self.prefix_len].lower()
+        return cat, prefix
+
+    def _partition(self, geohash: Optional[str], category: Optional[str]) -> _Partition:
+        key = self._key(geohash, category)
+        part = self._partitions.get(key)
+        if part is None:
+            cat_dir = os.path.join(self.root, key[0])
+            os.makedirs(cat_dir, exist_ok=True)
+            part = _Partition(os.path.join(cat_dir, f"{key[1]}{PARTITION_SUFFIX}"))
+            self._partitions[key] = part
+        return part
+
+    def add(
+        self,
+        report_id: str,
+        vec: np.ndarray,
+        geohash: Optional[str],
+        category: Optional[str],
+        user_id: Optional[str] = None,
+        email: Optional[str] = None,
+        location: Optional[Tuple[float, float]] = None,
+    ):
+        """Incrementally inserts (or replaces) a report's fingerprint."""
+        if not report_id:
+            return
+        lat, lng = location or (float("nan"), float("nan"))
+        with self._lock:
+            part = self._partition(geohash, category)
+            part.delete(report_id)
+            part.append(report_id, vec, user_id or "", email or "", geohash or "", lat, lng)
+
+    def remove(self, report_id: str, geohash: Optional[str], category: Optional[str]) -> bool:
+        """Tombstones a report (e.g. once resolved). Compacts the partition if it gets sparse."""
+        with self._lock:
+            part = self._partition(geohash, category)
+            removed = part.delete(report_id)
+            if removed and part.tombstone_ratio() >= COMPACT_TOMBSTONE_RATIO:
+                part.compact()
+            return removed
+
+    def get(self, report_id: str, geohash: Optional[str], category: Optional[str]) -> Optional[np.ndarray]:
+        with self._lock:
+            rows = self._partition(geohash, category).rows()
+            if rows is None:
+                return None
+            hits = np.nonzero((rows["report_id"] == report_id.encode("utf-8")[:64]) & (rows["alive"] == 1))[0]
+            return np.array(rows["vec"][hits[-1]]) if len(hits) else None
+
+    def search(
+        self,
+        vec: np.ndarray,
+        geohash: Optional[str],
+        category: Optional[str],
+        k: int = 5,
+        min_score: float = 0.0,
+    ) -> List[Match]:
+        """Returns up to k matches from the query's cell and its neighbours, best first."""
+        prefix = (geohash or "")[: self.prefix_len].lower()
+        try:
+            cells = geohash_neighbors(prefix) if prefix else [None]
+        except ValueError:  # not a valid geohash; search its own partition only
+            cells = [prefix]
+        matches: List[Match] = []
+        with self._lock:
+            for cell in cells:
+                rows = self._partition(cell, category).rows()
+                if rows is None:
+                    continue
+                scores = np.where(rows["alive"] == 1, rows["vec"] @ vec, -np.inf)
+                top = np.argpartition(-scores, k)[:k] if k < len(scores) else np.arange(len(scores))
+                matches.extend(
+                    Match(
+                        rows["report_id"][i].decode("utf-8"), float(scores[i]), rows["user_id"][i].decode("utf-8"),
+                        rows["email"][i].decode("utf-8"), rows["geohash"][i].decode("utf-8"),
+                        float(rows["lat"][i]), float(rows["lng"][i]),
+                    )
+                    for i in top
+                    if scores[i] >= min_score
+                )
+        matches.sort(key=lambda m: m.score, reverse=True)
+        return matches[:k]
+
+    def compact(self) -> int:
+        """Rewrites every partition without its tombstoned rows. Returns rows reclaimed."""
+        reclaimed = 0
+        with self._lock:
+            for cat in os.listdir(self.root) if os.path.isdir(self.root) else []:
+                cat_dir = os.path.join(self.root, cat)
+                for name in os.listdir(cat_dir):
+                    if not name.endswith(PARTITION_SUFFIX):
+                        continue
+                    key = (cat, name[: -len(PARTITION_SUFFIX)])
+                    part = self._partitions.setdefault(key, _Partition(os.path.join(cat_dir, name)))
+                    reclaimed += part.compact()
+        return reclaimed
+
+
+visual_index = VisualIndex()
@@ -0,0 +1,99 @@
+# GENERATED from agents/loop_watchdog.py by sentinal/vendor_shared.py -- do not edit here.
+# Edit the agents/ version, then re-run the script (--check reports drift).
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from metrics import metrics
+
+# --- CONFIG ---
+WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG", "1") == "1"
+# How often the heartbeat task wakes up to measure lag
+LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")) / 1000.0
+# A loop that has not run the heartbeat for this long is considered stalled
+STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "250")) / 1000.0
+RECENT_STALLS = 50
+LAG_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class LoopWatchdog:
+    """
+    Measures event-loop lag continuously and catches whatever is blocking it.
+
+    A heartbeat task sleeps LAG_INTERVAL and records how late it woke up
+    (event_loop_lag_seconds histogram). A separate thread checks the time of
+    the last heartbeat; once it is older than STALL_THRESHOLD the loop is
+    stuck in synchronous code, so the thread grabs the loop thread's stack at
+    that moment. The stall's full duration is filled in when the loop recovers.
+    """
+
+    def __init__(self, interval: float = LAG_INTERVAL, threshold: float = STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._loop_thread: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._current: Optional[dict] = None
+        self._stalls: "deque[dict]" = deque(maxlen=RECENT_STALLS)
+        self._lock = threading.Lock()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            metrics.observe("event_loop_lag_seconds", lag, LAG_BUCKETS)
+            with self._lock:
+                self._last_beat = now
+                stall, self._current = self._current, None
+            if stall is not None:
+                # Blocked from roughly the previous heartbeat until now
+                stall["seconds"] = round(lag + self.interval, 4)
+                metrics.observe("event_loop_stall_seconds", stall["seconds"], LAG_BUCKETS)
+                print(f"⚠️ Event loop was blocked for {stall['seconds']:.3f}s in:\n{stall['stack']}")
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            with self._lock:
+                blocked_for = time.monotonic() - self._last_beat - self.interval
+                if blocked_for < self.threshold or self._current is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>"
+                self._current = {"detected_at": time.time(), "seconds": None, "stack": stack}
+                self._stalls.append(self._current)
+            metrics.inc("event_loop_stalls")
+
+    def start(self):
+        """Call from the running event loop (e.g. a startup hook)."""
+        if not WATCHDOG_ENABLED or self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        print(f"🐶 Event loop watchdog started (stall threshold {self.threshold * 1000:.0f}ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stalls(self) -> list:
+        """Recent stalls, newest first; 'seconds' is None while a stall is still in progress."""
+        with self._lock:
+            return [dict(s) for s in reversed(self._stalls)]
+
+
+loop_watchdog = LoopWatchdog()
@@ -6,10 +6,17 @@ from concurrent.futures import ThreadPoolExecutor
 
 import firebase_admin
 from firebase_admin import credentials, db, firestore
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware # ADDED
 from faster_whisper import WhisperModel
 
+from metrics import metrics
+from tracing import TracingMiddleware, tracer
+from profiler import PROFILER_TOKEN, ProfilerBusy, authorized, profiler
+from loop_watchdog import loop_watchdog
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +25,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(TracingMiddleware)
 try:
     if os.getenv("K_SERVICE"): 
         cred = credentials.ApplicationDefault() # Cloud Native Auth
@@ -33,10 +41,58 @@ except ValueError:
 
 fs_db = firestore.client()
 
+@app.on_event("startup")
+async def start_loop_watchdog():
+    loop_watchdog.start()
+
+@app.on_event("shutdown")
+async def stop_loop_watchdog():
+    loop_watchdog.stop()
+
 @app.get("/")
 def read_root():
     return {"status": "Sentinel Active"}
 
+@app.get("/traces/usage")
+def get_trace_usage(recent: int = 20):
+    """Per-endpoint request and latency totals, plus the slowest recent traces."""
+    return tracer.usage(recent)
+
+@app.get("/debug/profile")
+async def debug_profile(
+    seconds: float = 10,
+    mode: str = "wall",
+    interval_ms: float = 10,
+    loop_only: bool = False,
+    x_debug_token: Optional[str] = Header(None, alias="X-Debug-Token"),
+):
+    """Sampling profile of the whole process (Whisper workers included) as collapsed stacks."""
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorized(x_debug_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        stacks = await profiler.profile(seconds, mode, interval_ms / 1000.0, loop_only)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return PlainTextResponse(stacks)
+
+@app.get("/metrics")
+def get_metrics():
+    """Event-loop lag and stall histograms."""
+    return metrics.snapshot()
+
+@app.get("/debug/loop-stalls")
+def debug_loop_stalls(x_debug_token: Optional[str] = Header(None, alias="X-Debug-Token")):
+    """Recent event-loop stalls with the stack that was blocking the loop."""
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorized(x_debug_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return {"threshold_ms": loop_watchdog.threshold * 1000, "stalls": loop_watchdog.stalls()}
+
 
 
 model_name = os.getenv('MODEL_TYPE', 'tiny.en')
@@ -101,7 +157,9 @@ def transcribe_audio(audio_data):
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await manager.connect(websocket)
     try:
-        user_doc = fs_db.collection('users').document(user_id).get()
+        with tracer.span("ws connect", kind="server", userId=user_id):
+            with tracer.span("firestore users.get", kind="client"):
+                user_doc = fs_db.collection('users').document(user_id).get()
         db_keywords = user_doc.to_dict().get('safetyKeywords', [])
 
         if not isinstance(db_keywords, list):
@@ -130,30 +188,35 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             audio_buffer.extend(data)
 
             if len(audio_buffer) >= CHUNK_LIMIT:
-                float_audio = normalize_audio(audio_buffer)
-                
-                # Run AI (Non-blocking)
-                loop = asyncio.get_running_loop()
-                transcript = await loop.run_in_executor(executor, transcribe_audio, float_audio)
-                
-                if transcript:
-                    print(f"User {user_id}: {transcript}")
-                    
-                    for word in user_keywords:
-                        if word.lower() in transcript.lower():
-                            print(f" MATCH: {word}")
-                            
-                            db.reference(f'women/alerts/{user_id}').set({
-                                'type': 'CRITICAL',
-                                'source': 'AUDIO_SENTINEL',
-                                'keyword': word,
-                                'timestamp': {'.sv': 'timestamp'},
-                                'status': 'ACTIVE'
-                            })
-                            
-                            await websocket.send_text(json.dumps({"status": "ALERT_TRIGGERED", "keyword": word}))
-                            break
-                
+                with tracer.span("ws audio chunk", kind="server", userId=user_id, bytes=len(audio_buffer)) as chunk:
+                    float_audio = normalize_audio(audio_buffer)
+
+                    # Run AI (Non-blocking)
+                    loop = asyncio.get_running_loop()
+                    with tracer.span("whisper transcribe", audio_seconds=round(len(float_audio) / 16000, 2)):
+                        transcript = await loop.run_in_executor(executor, transcribe_audio, float_audio)
+                    chunk.set(transcribed=bool(transcript))
+
+                    if transcript:
+                        print(f"User {user_id}: {transcript}")
+
+                        for word in user_keywords:
+                            if word.lower() in transcript.lower():
+                                print(f" MATCH: {word}")
+                                chunk.set(keyword=word)
+
+                                with tracer.span("rtdb alert.set", kind="client"):
+                                    db.reference(f'women/alerts/{user_id}').set({
+                                        'type': 'CRITICAL',
+                                        'source': 'AUDIO_SENTINEL',
+                                        'keyword': word,
+                                        'timestamp': {'.sv': 'timestamp'},
+                                        'status': 'ACTIVE'
+                                    })
+
+                                await websocket.send_text(json.dumps({"status": "ALERT_TRIGGERED", "keyword": word}))
+                                break
+
                 overlap = 16000 
                 audio_buffer = audio_buffer[-overlap:]
 
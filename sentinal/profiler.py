@@ -0,0 +1,131 @@
+# GENERATED from agents/profiler.py by sentinal/vendor_shared.py -- do not edit here.
+# Edit the agents/ version, then re-run the script (--check reports drift).
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+# --- CONFIG ---
+# The debug endpoint is disabled unless a token is configured
+PROFILER_TOKEN = os.getenv("DEBUG_PROFILER_TOKEN", "")
+MAX_SECONDS = float(os.getenv("DEBUG_PROFILER_MAX_SECONDS", "60"))
+MIN_INTERVAL = 0.001
+DEFAULT_INTERVAL = 0.01
+MAX_DEPTH = 128
+
+# Leaf functions of a thread that is waiting rather than running (cpu mode fallback)
+_IDLE_LEAVES = {
+    "wait", "select", "poll", "epoll", "_worker", "sleep", "acquire", "get", "accept",
+    "recv", "recv_into", "readinto", "read", "_recv", "run_forever", "_run_once",
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def authorized(token: Optional[str]) -> bool:
+    return bool(PROFILER_TOKEN) and token is not None and hmac.compare_digest(token, PROFILER_TOKEN)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(";", ":").replace(" ", "_")
+
+
+def _stack(frame) -> list:
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _thread_cpu_ticks(native_id: int) -> Optional[int]:
+    """utime + stime of one thread from /proc (Linux); None where unavailable."""
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", "rb") as f:
+            fields = f.read().rsplit(b")", 1)[1].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack with sys._current_frames() from a
+    background thread, so the profiled code is not instrumented at all.
+    Output is Brendan Gregg's collapsed-stack format ("a;b;c count" per line),
+    ready for flamegraph.pl or speedscope.
+
+    wall: every sample of every thread counts, so waiting shows up too. The
+          event-loop thread's stacks are rooted at "event-loop", and a loop
+          blocked by sync work shows that work instead of the selector.
+    cpu:  a thread's sample counts only if it used CPU since the previous sample
+          (per-thread /proc ticks; otherwise threads parked in a known wait are skipped).
+
+    Only one run at a time; a run never exceeds MAX_SECONDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def _sample(self, seconds: float, interval: float, mode: str, loop_thread: Optional[int], loop_only: bool) -> str:
+        me = threading.get_ident()
+        names: Dict[int, str] = {}
+        native: Dict[int, int] = {}
+        last_ticks: Dict[int, Optional[int]] = {}
+        counts: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            if len(names) != threading.active_count():
+                for t in threading.enumerate():
+                    names[t.ident] = t.name
+                    native[t.ident] = getattr(t, "native_id", None)
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (loop_only and ident != loop_thread):
+                    continue
+                stack = _stack(frame)
+                if mode == "cpu":
+                    ticks = _thread_cpu_ticks(native[ident]) if native.get(ident) else None
+                    previous = last_ticks.get(ident)
+                    last_ticks[ident] = ticks
+                    if ticks is not None:
+                        if previous is None or ticks <= previous:
+                            continue
+                    elif stack and stack[-1].rsplit(":", 1)[-1] in _IDLE_LEAVES:
+                        continue
+                root = "event-loop" if ident == loop_thread else f"thread:{names.get(ident, ident)}".replace(" ", "_")
+                counts[";".join([root] + stack)] += 1
+            samples += 1
+            time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+        header = f"# mode={mode} seconds={seconds} interval_ms={interval * 1000:g} samples={samples}\n"
+        return header + "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+    async def profile(self, seconds: float, mode: str = "wall", interval: float = DEFAULT_INTERVAL,
+                      loop_only: bool = False) -> str:
+        """Runs one profile off the event loop; raises ProfilerBusy if another run is active."""
+        if mode not in ("wall", "cpu"):
+            raise ValueError("mode must be 'wall' or 'cpu'")
+        seconds = min(max(seconds, 0.1), MAX_SECONDS)
+        interval = max(interval, MIN_INTERVAL)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            # Called from a request handler, so this is the event-loop thread
+            loop_thread = threading.get_ident()
+            return await asyncio.to_thread(self._sample, seconds, interval, mode, loop_thread, loop_only)
+        finally:
+            self._lock.release()
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,339 @@
+# GENERATED from agents/tracing.py by sentinal/vendor_shared.py -- do not edit here.
+# Edit the agents/ version, then re-run the script (--check reports drift).
+import functools
+import inspect
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from metrics import metrics
+
+# --- CONFIG ---
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "agents")
+# file: JSONL under TRACE_DIR | otlp: OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT | none: totals only
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "file")
+TRACE_DIR = os.getenv("TRACE_DIR", os.path.join(os.path.dirname(__file__), ".traces"))
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318")
+RECENT_TRACES = 200
+# Per-endpoint totals are keyed by route template; requests no route matched share one bucket
+MAX_ENDPOINTS = 256
+UNMATCHED_ENDPOINT = "<unmatched>"
+OTHER_ENDPOINT = "<other>"
+EXPORT_BATCH = 256
+EXPORT_QUEUE_MAX = 10000
+
+_OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, kind: str, parent_id: Optional[str], attributes: dict):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update((k, v) for k, v in attributes.items() if v is not None)
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start_ns,
+            "end": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """One request: its id, its root span, the ids it is tagged with and its LLM usage."""
+
+    def __init__(self, endpoint: str):
+        self.trace_id = secrets.token_hex(16)
+        self.endpoint = endpoint
+        self.root: Optional[Span] = None
+        self.tags: Dict[str, str] = {}
+        self.usage = {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+        self._lock = threading.Lock()
+
+    def add_usage(self, input_tokens: int, output_tokens: int, cost_usd: float):
+        with self._lock:
+            self.usage["llm_calls"] += 1
+            self.usage["input_tokens"] += input_tokens
+            self.usage["output_tokens"] += output_tokens
+            self.usage["cost_usd"] += cost_usd
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class SpanExporter:
+    """Background thread that ships finished spans in batches, so exporting never blocks a request."""
+
+    def __init__(self, mode: str = TRACE_EXPORTER):
+        self.mode = mode
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=EXPORT_QUEUE_MAX)
+        self._thread: Optional[threading.Thread] = None
+        self._path = os.path.join(TRACE_DIR, f"{SERVICE_NAME}-spans.jsonl")
+
+    def submit(self, span: Span):
+        if self.mode == "none":
+            return
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            metrics.inc("trace_spans_dropped")
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_otlp(batch) if self.mode == "otlp" else self._write_file(batch)
+                metrics.inc("trace_spans_exported", len(batch))
+            except Exception as e:
+                metrics.inc("trace_export_failures")
+                print(f"Span export failed ({len(batch)} spans dropped): {e}")
+
+    def _write_file(self, batch: List[dict]):
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        if os.path.exists(self._path) and os.path.getsize(self._path) > TRACE_FILE_MAX_BYTES:
+            os.replace(self._path, self._path + ".1")
+        with open(self._path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(span, default=str) + "\n" for span in batch)
+
+    def _write_otlp(self, batch: List[dict]):
+        def attrs(d: dict) -> list:
+            out = []
+            for key, value in d.items():
+                if isinstance(value, bool):
+                    out.append({"key": key, "value": {"boolValue": value}})
+                elif isinstance(value, int):
+                    out.append({"key": key, "value": {"intValue": str(value)}})
+                elif isinstance(value, float):
+                    out.append({"key": key, "value": {"doubleValue": value}})
+                else:
+                    out.append({"key": key, "value": {"stringValue": str(value)}})
+            return out
+
+        spans = [{
+            "traceId": s["traceId"],
+            "spanId": s["spanId"],
+            **({"parentSpanId": s["parentSpanId"]} if s["parentSpanId"] else {}),
+            "name": s["name"],
+            "kind": _OTLP_KINDS.get(s["kind"], 1),
+            "startTimeUnixNano": str(s["start"]),
+            "endTimeUnixNano": str(s["end"]),
+            "attributes": attrs(s["attributes"]),
+            "status": {"code": 2, "message": s["error"]} if s["error"] else {"code": 1},
+        } for s in batch]
+        body = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": attrs({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]}).encode("utf-8")
+        request = urllib.request.Request(
+            f"{TRACE_OTLP_ENDPOINT.rstrip('/')}/v1/traces", data=body,
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        urllib.request.urlopen(request, timeout=10).close()
+
+
+class Tracer:
+    """
+    Contextvar-based spans: a root span per HTTP request, children for graph nodes,
+    LLM calls and outbound HTTP calls. Context follows asyncio tasks and
+    asyncio.to_thread, so spans nest correctly across LangGraph's parallel nodes.
+    Finished traces roll up into per-endpoint request, token and cost totals.
+    """
+
+    def __init__(self, exporter: SpanExporter):
+        self.exporter = exporter
+        self._totals: Dict[str, dict] = {}
+        self._recent: "deque[dict]" = deque(maxlen=RECENT_TRACES)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attributes):
+        parent = _current_span.get()
+        if parent is None:
+            # Work outside any request (startup, background jobs) gets its own trace
+            trace = Trace(name if kind == "server" else f"background {name}")
+        else:
+            trace = parent.trace
+        span = Span(trace, name, kind, parent.span_id if parent else None, {k: v for k, v in attributes.items() if v is not None})
+        if trace.root is None:
+            trace.root = span
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            if span is trace.root:
+                span.set(**trace.tags, **{f"llm.{k}": round(v, 8) for k, v in trace.usage.items()})
+                self._finish(trace, span)
+            self.exporter.submit(span)
+
+    def _finish(self, trace: Trace, root: Span):
+        duration = (root.end_ns - root.start_ns) / 1e9
+        with self._lock:
+            endpoint = trace.endpoint
+            if endpoint not in self._totals and len(self._totals) >= MAX_ENDPOINTS:
+                endpoint = OTHER_ENDPOINT
+            totals = self._totals.setdefault(endpoint, {
+                "requests": 0, "errors": 0, "seconds": 0.0,
+                "llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+            })
+            totals["requests"] += 1
+            totals["errors"] += root.error is not None or root.attributes.get("http.status_code", 200) >= 500
+            totals["seconds"] += duration
+            for key, value in trace.usage.items():
+                totals[key] += value
+            self._recent.append({
+                "traceId": trace.trace_id,
+                "endpoint": trace.endpoint,
+                "seconds": round(duration, 4),
+                "tags": dict(trace.tags),
+                **trace.usage,
+                "cost_usd": round(trace.usage["cost_usd"], 8),
+            })
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def tag(self, **tags):
+        """Tags the whole trace (e.g. reportId, roomId); the ids end up on the root span."""
+        span = _current_span.get()
+        if span is not None:
+            span.trace.tags.update((k, str(v)) for k, v in tags.items() if v is not None)
+            span.set(**tags)
+
+    def record_llm(self, span: Span, model: str, usage: Optional[dict], price: Optional[tuple] = None):
+        """Adds prompt/response token counts (and cost, given USD per 1M input/output tokens) to an LLM span."""
+        input_tokens = int((usage or {}).get("input_tokens") or 0)
+        output_tokens = int((usage or {}).get("output_tokens") or 0)
+        cost = (input_tokens * price[0] + output_tokens * price[1]) / 1e6 if price else 0.0
+        span.set(**{
+            "llm.model": model,
+            "llm.input_tokens": input_tokens,
+            "llm.output_tokens": output_tokens,
+            "llm.cost_usd": round(cost, 8),
+        })
+        span.trace.add_usage(input_tokens, output_tokens, cost)
+        metrics.inc("llm_input_tokens", input_tokens)
+        metrics.inc("llm_output_tokens", output_tokens)
+
+    def usage(self, recent: int = 20) -> dict:
+        with self._lock:
+            endpoints = {
+                name: {**t, "seconds": round(t["seconds"], 3), "cost_usd": round(t["cost_usd"], 6),
+                       "avg_seconds": round(t["seconds"] / t["requests"], 4) if t["requests"] else 0.0}
+                for name, t in self._totals.items()
+            }
+            slowest = sorted(self._recent, key=lambda r: r["seconds"], reverse=True)[:recent]
+        return {"endpoints": endpoints, "slowest_recent": slowest}
+
+
+tracer = Tracer(SpanExporter())
+
+
+def traced_node(fn=None, *, name: Optional[str] = None):
+    """Decorator: one span per graph node (or any function), sync or async."""
+    def wrap(fn):
+        span_name = f"node {name or fn.__name__}"
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap(fn) if fn is not None else wrap
+
+
+def instrument_requests():
+    """Client span for every call made through `requests`, including image downloads and backend POSTs."""
+    import requests
+
+    if getattr(requests.Session.request, "_traced", False):
+        return
+    original = requests.Session.request
+
+    @functools.wraps(original)
+    def request(self, method, url, *args, **kwargs):
+        with tracer.span(f"HTTP {method.upper()}", kind="client", **{"http.method": method.upper(), "http.url": str(url)}) as span:
+            response = original(self, method, url, *args, **kwargs)
+            span.set(**{"http.status_code": response.status_code, "http.response_bytes": response.headers.get("Content-Length")})
+            return response
+
+    request._traced = True
+    requests.Session.request = request
+
+
+class TracingMiddleware:
+    """ASGI middleware: a root server span per HTTP request, ended once the body (streamed or not) is sent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method, path = scope["method"], scope["path"]
+        with tracer.span(f"{method} {path}", kind="server", **{"http.method": method, "http.path": path}) as span:
+            async def traced_send(message):
+                if message["type"] == "http.response.start":
+                    span.set(**{"http.status_code": message["status"]})
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-trace-id", span.trace.trace_id.encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, traced_send)
+            finally:
+                # The router records the matched route in the scope; raw paths would grow the totals without bound
+                route = getattr(scope.get("route"), "path", None)
+                span.name = span.trace.endpoint = f"{method} {route}" if route else UNMATCHED_ENDPOINT
+
+
+def install(app):
+    """Root span per HTTP request, plus outbound HTTP instrumentation."""
+    instrument_requests()
+    app.add_middleware(TracingMiddleware)
@@ -0,0 +1,54 @@
+"""
+Copies the shared observability modules from agents/ into this directory.
+
+The sentinel image is built from sentinal/ alone (see Dockerfile: COPY . .), so
+it cannot import from agents/. agents/ holds the only editable version of these
+modules; the copies here are generated and must not be edited by hand.
+
+    python vendor_shared.py           # refresh the copies
+    python vendor_shared.py --check   # exit 1 if a copy has drifted
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(HERE, "..", "agents")
+SOURCE_NOTE = "# Also shipped with the sentinel service"
+SHARED_MODULES = ["metrics.py", "tracing.py", "profiler.py", "loop_watchdog.py"]
+HEADER = (
+    "# GENERATED from agents/{name} by sentinal/vendor_shared.py -- do not edit here.\n"
+    "# Edit the agents/ version, then re-run the script (--check reports drift).\n"
+)
+
+
+def vendored(name: str) -> str:
+    with open(os.path.join(SOURCE_DIR, name), encoding="utf-8") as f:
+        source = f.read()
+    # The original's "also shipped with the sentinel" note is replaced by the header
+    if source.startswith(SOURCE_NOTE):
+        source = source.split("\n", 1)[1]
+    return HEADER.format(name=name) + source
+
+
+def main(check: bool) -> int:
+    drifted = []
+    for name in SHARED_MODULES:
+        expected = vendored(name)
+        target = os.path.join(HERE, name)
+        current = open(target, encoding="utf-8").read() if os.path.exists(target) else None
+        if current == expected:
+            continue
+        if check:
+            drifted.append(name)
+        else:
+            with open(target, "w", encoding="utf-8") as f:
+                f.write(expected)
+            print(f"vendored agents/{name}")
+    if drifted:
+        print(f"out of date (run sentinal/vendor_shared.py): {', '.join(drifted)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main("--check" in sys.argv[1:]))
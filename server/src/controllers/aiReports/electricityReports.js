@@ -10,13 +10,14 @@ export const saveElectricityReport = async (req, res) => {
     }
 
     const dataToSave = { ...data };
-    const reportDocRef = db
+    const userReports = db
       .collection('electricityReports')
       .doc(geohash)
       .collection('reports')
       .doc(userId)
-      .collection('userReports')
-      .doc();
+      .collection('userReports');
+    // Retried deliveries from the agents outbox reuse the same document
+    const reportDocRef = data.idempotencyKey ? userReports.doc(data.idempotencyKey) : userReports.doc();
 
     const finalData={
       ...dataToSave,
@@ -11,13 +11,14 @@ export const saveUncertainReport = async (req, res) => {
 
     const dataToSave = { ...data };
 
-    const reportDocRef = db
+    const userReports = db
       .collection('uncertainReports')
       .doc(geohash)
       .collection('reports')
       .doc(userId)
-      .collection('userReports')
-      .doc();
+      .collection('userReports');
+    // Retried deliveries from the agents outbox reuse the same document
+    const reportDocRef = data.idempotencyKey ? userReports.doc(data.idempotencyKey) : userReports.doc();
     const finalData = {
         ...dataToSave,
         id: reportDocRef.id, 
@@ -11,13 +11,14 @@ export const saveWasteReport = async (req, res) => {
 
     
 
-    const reportDocRef = db
+    const userReports = db
       .collection('wasteReports')
       .doc(geohash)
       .collection('reports')
       .doc(userId)
-      .collection('userReports')
-      .doc();
+      .collection('userReports');
+    // Retried deliveries from the agents outbox reuse the same document
+    const reportDocRef = data.idempotencyKey ? userReports.doc(data.idempotencyKey) : userReports.doc();
 
     const dataToSave = { 
       ...data,
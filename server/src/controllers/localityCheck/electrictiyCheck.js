@@ -69,6 +69,7 @@ export const electricityCheck = async (req, res) => {
                 imageUrl: reportData.imageUrl,
                 userId,
                 reportId: reportDoc.id,             
+                geohash: hash,
                 locality_email: reportData.email,
                 distance: distance // Useful for debugging
               };
@@ -65,6 +65,7 @@ export const infraCheck = async (req, res) => {
                 imageUrl: reportData.imageUrl,
                 userId: userId,
                 reportId: reportDoc.id,
+                geohash: hash,
                 locality_email: reportData.email,
                 distance: distance
               };
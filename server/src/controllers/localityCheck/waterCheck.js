@@ -62,6 +62,7 @@ export const waterCheck = async (req, res) => {
                 imageUrl: reportData.imageUrl,
                 userId,
                 reportId: reportDoc.id,
+                geohash: hash,
                 locality_email: reportData.email,
                 distance: distance
               };
@@ -30,7 +30,9 @@ export const resolveWasteReports = async (req, res) => {
         const aiServiceUrl = process.env.PYTHON_SERVER;
         const aiResponse = await axios.post(`${aiServiceUrl}/resolveWasteReports`, {
             imageUrl,
-            staffimageUrl
+            staffimageUrl,
+            reportId,
+            geohash
         });
 
         const aiData = aiResponse.data;
@@ -1,9 +1,9 @@
 import { db } from '../../firebaseadmin/firebaseadmin.js';
-import admin from 'firebase-admin';
+import { applyReportUpdate } from '../../utils/applyReportUpdate.js';
 
 export const updateInfrastructureReports = async (req, res) => {
   try {
-    const { userId, email, reportId, geohash, updatedAt } = req.body;
+    const { userId, email, reportId, geohash, updatedAt, idempotencyKey } = req.body;
 
     if (!userId || !email || !reportId || !geohash) {
       return res.status(400).json({
@@ -19,11 +19,14 @@ export const updateInfrastructureReports = async (req, res) => {
       .collection('userReports')
       .doc(reportId);
 
-    await reportDocRef.update({
-      interests: admin.firestore.FieldValue.arrayUnion(email),
-      upvotes: admin.firestore.FieldValue.increment(1),
-      updatedAt: updatedAt || admin.firestore.FieldValue.serverTimestamp()
-    });
+    // Retried deliveries from the agents outbox must not upvote twice
+    const outcome = await applyReportUpdate(reportDocRef, { email, updatedAt, idempotencyKey });
+    if (outcome === "NOT_FOUND") {
+      return res.status(404).json({ status: "FAILED", message: "Report document not found.", reportId });
+    }
+    if (outcome === "DUPLICATE") {
+      return res.status(200).json({ status: "VERIFIED", message: "Update already applied", reportId });
+    }
 
     return res.status(200).json({
       status: "VERIFIED",
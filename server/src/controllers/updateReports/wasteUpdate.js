@@ -1,9 +1,9 @@
 import { db } from '../../firebaseadmin/firebaseadmin.js';
-import admin from 'firebase-admin';
+import { applyReportUpdate } from '../../utils/applyReportUpdate.js';
 
 export const updateWasteReports = async (req, res) => {
   try {
-    const { userId, email, reportId, geohash, updatedAt } = req.body;
+    const { userId, email, reportId, geohash, updatedAt, idempotencyKey } = req.body;
 
     // 1. Debug Log: Look at this in your terminal when the error happens!
     console.log("DEBUG: Update Payload Received:", req.body);
@@ -25,18 +25,15 @@ export const updateWasteReports = async (req, res) => {
       .collection('userReports')
       .doc(reportId);
 
-    // Check if doc exists before updating (Optional but recommended)
-    const doc = await reportDocRef.get();
-    if (!doc.exists) {
+    // Retried deliveries from the agents outbox must not upvote twice
+    const outcome = await applyReportUpdate(reportDocRef, { email, updatedAt, idempotencyKey });
+    if (outcome === "NOT_FOUND") {
         console.error("❌ Document not found at path:", reportDocRef.path);
         return res.status(404).json({ message: "Report document not found." });
     }
-
-    await reportDocRef.update({
-      interests: admin.firestore.FieldValue.arrayUnion(email),
-      upvotes: admin.firestore.FieldValue.increment(1),
-      updatedAt: updatedAt || admin.firestore.FieldValue.serverTimestamp()
-    });
+    if (outcome === "DUPLICATE") {
+      return res.status(200).json({ status: "VERIFIED", message: "Update already applied", reportId });
+    }
 
     return res.status(200).json({
       status: "VERIFIED",
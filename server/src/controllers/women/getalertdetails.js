@@ -55,6 +55,7 @@ const getAlertDetails = async (req, res) => {
         source: "AI Watchdog",
         aiAnalysis: doc.reason,
         score: doc.score,    
+        status: doc.status || "ACTIVE",
         timestamp: doc.timestamp
       });
     }
@@ -1,6 +1,6 @@
 import { db } from "../../firebaseadmin/firebaseadmin.js";
 const log_sos=async(req,res)=>{
-    const { routeId, userId, context, score } = req.body;
+    const { routeId, userId, context, score, status } = req.body;
     try {
         if(!routeId){
             return res.status(400).json({ error: "routeId is required" });
@@ -14,14 +14,16 @@ const log_sos=async(req,res)=>{
         if(score===undefined){
             return res.status(400).json({ error: "score is required" });
         }
-        await db.collection('model_sos_activity').add({
+        // PROVISIONAL: logged by the lexical fast path, confirmed or retracted once the model has reviewed it
+        const docRef = await db.collection('model_sos_activity').add({
         routeId,
         userId,
         reason: context,
         score,
+        status: status === "PROVISIONAL" ? "PROVISIONAL" : "ACTIVE",
         timestamp: new Date()
         });
-        res.json({ status: "logged" });
+        res.json({ status: "logged", sosId: docRef.id });
     } catch (e) {
         res.status(500).send(e.toString());
     }
@@ -0,0 +1,22 @@
+import { db } from "../../firebaseadmin/firebaseadmin.js";
+const OUTCOMES = ["CONFIRMED", "RETRACTED"];
+const review_sos=async(req,res)=>{
+    const { sosId, outcome, reason } = req.body;
+    try {
+        if(!sosId){
+            return res.status(400).json({ error: "sosId is required" });
+        }
+        if(!OUTCOMES.includes(outcome)){
+            return res.status(400).json({ error: "outcome must be CONFIRMED or RETRACTED" });
+        }
+        await db.collection('model_sos_activity').doc(sosId).update({
+        status: outcome,
+        reviewReason: reason || "",
+        reviewedAt: new Date()
+        });
+        res.json({ status: "reviewed", sosId, outcome });
+    } catch (e) {
+        res.status(500).send(e.toString());
+    }
+}
+export default review_sos
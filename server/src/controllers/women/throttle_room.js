@@ -1,8 +1,28 @@
 import { db } from "../../firebaseadmin/firebaseadmin.js";
 const throttle_room = async (req, res) => {
-    const { triggeredByUserId, routeId, aiAnalysis, alertLevel, timestamp } = req.body;
+    const { alertId, triggeredByUserId, routeId, aiAnalysis, alertLevel, timestamp, analysisStatus } = req.body;
     
     try {
+        // Follow-up: attach the AI analysis to an alert that was already persisted
+        if (alertId && !triggeredByUserId) {
+            if (!aiAnalysis) {
+                return res.status(400).json({
+                    status: "error",
+                    message: "Missing aiAnalysis",
+                });
+            }
+            await db.collection("log-sos").doc(alertId).update({
+                aiAnalysis,
+                analysisStatus: analysisStatus || "COMPLETE",
+                analyzedAt: new Date().toISOString(),
+            });
+            return res.status(200).json({
+                status: "success",
+                message: "Throttle analysis attached",
+                alertId,
+            });
+        }
+
         if (!triggeredByUserId || !routeId || !aiAnalysis || !alertLevel || !timestamp) {
             return res.status(400).json({
                 status: "error",
@@ -10,18 +30,23 @@ const throttle_room = async (req, res) => {
             });
         }
 
-        await db.collection("log-sos")
-                .add({
+        // The agent sends its own alertId, so writing the full alert twice
+        // (e.g. after a timed-out first attempt) still yields one document
+        const collection = db.collection("log-sos");
+        const docRef = alertId ? collection.doc(alertId) : collection.doc();
+        await docRef.set({
                     triggeredByUserId,
                     routeId,
                     aiAnalysis,
                     alertLevel,
-                    timestamp
-                });
+                    timestamp,
+                    analysisStatus: analysisStatus || "COMPLETE",
+                }, { merge: true });
 
         return res.status(200).json({
             status: "success",
             message: "Room throttled successfully",
+            alertId: docRef.id,
         });
 
     } catch (error) {
@@ -33,4 +58,4 @@ const throttle_room = async (req, res) => {
     }
 }
 
-export default throttle_room;
\ No newline at end of file
+export default throttle_room;
@@ -0,0 +1,41 @@
+import { db } from '../firebaseadmin/firebaseadmin.js';
+import admin from 'firebase-admin';
+
+// Keys only need to outlive the agents outbox retry window. Expiry is done by a
+// Firestore TTL policy on the `expireAt` field of the appliedUpdates collection.
+const APPLIED_UPDATE_TTL_MS = Number(process.env.APPLIED_UPDATE_TTL_DAYS || 7) * 24 * 60 * 60 * 1000;
+
+/**
+ * Upvotes a report once per idempotency key.
+ * The report write and the applied-key record commit in one transaction, so
+ * concurrent retries of the same update cannot both increment.
+ * Resolves to "APPLIED", "DUPLICATE" or "NOT_FOUND".
+ */
+export const applyReportUpdate = (reportDocRef, { email, updatedAt, idempotencyKey }) => {
+  const appliedRef = idempotencyKey ? db.collection('appliedUpdates').doc(idempotencyKey) : null;
+
+  return db.runTransaction(async (tx) => {
+    const [doc, applied] = await Promise.all([
+      tx.get(reportDocRef),
+      appliedRef ? tx.get(appliedRef) : null
+    ]);
+
+    if (!doc.exists) return "NOT_FOUND";
+    if (applied?.exists) return "DUPLICATE";
+
+    tx.update(reportDocRef, {
+      interests: admin.firestore.FieldValue.arrayUnion(email),
+      upvotes: admin.firestore.FieldValue.increment(1),
+      updatedAt: updatedAt || admin.firestore.FieldValue.serverTimestamp()
+    });
+
+    if (appliedRef) {
+      tx.set(appliedRef, {
+        reportPath: reportDocRef.path,
+        appliedAt: admin.firestore.FieldValue.serverTimestamp(),
+        expireAt: admin.firestore.Timestamp.fromMillis(Date.now() + APPLIED_UPDATE_TTL_MS)
+      });
+    }
+    return "APPLIED";
+  });
+};